@@ -3,7 +3,8 @@ from asyncpal.pool import IDLE_TIMEOUT
 from asyncpal.misc import (LOGGER, get_chunks, split_map_task,
                            split_starmap_task, get_remote_traceback,
                            Countdown)
-from asyncpal.future import Future, FutureFilter, Status, as_done, wait, collect
+from asyncpal.future import (Future, FutureFilter, MapJob, Status,
+                             as_done, wait, collect)
 from asyncpal.pool.threadpool import (Pool, ThreadPool, SingleThreadPool,
                                       DualThreadPool, TripleThreadPool,
                                       QuadThreadPool)
@@ -11,9 +12,12 @@ from asyncpal.pool.processpool import (ProcessPool, SingleProcessPool,
                                        DualProcessPool, TripleProcessPool,
                                        QuadProcessPool, MP_CONTEXT,
                                        WINDOWS_MAX_PROCESS_WORKERS)
+from asyncpal.serializer import (Serializer, PickleSerializer,
+                                 CloudpickleSerializer)
 from asyncpal.errors import (Error, BrokenPoolError,
                              InitializerError, FinalizerError,
-                             InvalidStateError, CancelledError)
+                             InvalidStateError, CancelledError,
+                             WorkerCrashError)
 
 
 __all__ = ["Pool", "ThreadPool", "ProcessPool",
@@ -21,7 +25,8 @@ __all__ = ["Pool", "ThreadPool", "ProcessPool",
            "DualThreadPool", "DualProcessPool",
            "TripleThreadPool", "TripleProcessPool",
            "QuadThreadPool", "QuadProcessPool",
-           "Future", "FutureFilter", "Status", "Countdown",
+           "Serializer", "PickleSerializer", "CloudpickleSerializer",
+           "Future", "FutureFilter", "MapJob", "Status", "Countdown",
            "as_done", "wait", "collect", "split_map_task",
            "split_starmap_task", "get_chunks",
            "get_remote_traceback",
@@ -29,4 +34,4 @@ __all__ = ["Pool", "ThreadPool", "ProcessPool",
            "WINDOWS_MAX_PROCESS_WORKERS",
            "Error", "BrokenPoolError",
            "InitializerError", "FinalizerError",
-           "InvalidStateError", "CancelledError"]
+           "InvalidStateError", "CancelledError", "WorkerCrashError"]
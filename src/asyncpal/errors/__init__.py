@@ -40,3 +40,7 @@ class InitializerError(BrokenPoolError):
 
 class FinalizerError(BrokenPoolError):
     pass
+
+
+class WorkerCrashError(Error):
+    pass
@@ -1,14 +1,17 @@
-"""In this module are defined the `Future` and the `FutureFilter`
+"""In this module are defined the `Future`, `FutureFilter`, and `MapJob`
 classes as well as the `wait`, `collect`, and `as_done` functions"""
+import bisect
 import functools
 import time
 import threading
+from array import array
 from enum import Enum, unique
 from queue import SimpleQueue, Empty as EmptyQueue
 from asyncpal import errors, misc
 
 
-__all__ = ["Future", "FutureFilter", "Status", "wait", "collect", "as_done"]
+__all__ = ["Future", "FutureFilter", "MapJob", "Status",
+           "wait", "collect", "as_done"]
 
 
 def wait(futures, timeout=None):
@@ -104,6 +107,7 @@ class FutureFilter:
         self._futures = list()
         self._lock = threading.RLock()
         self._queue = SimpleQueue()
+        self._pools = dict()
         self._n = len(self._futures)
         if futures:
             self.populate(futures)
@@ -122,6 +126,7 @@ class FutureFilter:
         """
         with self._lock:
             self._futures.append(future)
+            self._add_pool(future.pool)
             future.add_callback(functools.partial(self._queue.put))
             self._n += 1
 
@@ -134,6 +139,8 @@ class FutureFilter:
         """
         with self._lock:
             self._futures.extend(futures)
+            for future in futures:
+                self._add_pool(future.pool)
             self._n += len(futures)
         for future in futures:
             future.add_callback(functools.partial(self._queue.put))
@@ -175,7 +182,16 @@ class FutureFilter:
             future = self._get_from_queue(block, new_timeout)
             yield future
 
+    def _add_pool(self, pool):
+        if pool is not None:
+            self._pools[id(pool)] = pool
+
     def _get_from_queue(self, block, timeout):
+        if block:
+            with self._lock:
+                pools = tuple(self._pools.values())
+            for pool in pools:
+                pool._flush_batch()
         try:
             future = self._queue.get(block=block, timeout=timeout)
         except EmptyQueue as e:
@@ -189,21 +205,37 @@ class FutureFilter:
 
 
 class Future:
-    """Future class"""
+    """Future class.
+    Memory footprint is kept low as pools might create millions of futures:
+    attributes are slotted, the three instants of interest are stored in fixed
+    fields, and the threading.Event needed to block is only created when
+    someone actually waits for an unfinished future."""
+
+    __slots__ = ("_pool", "_task_id", "_status", "_is_done", "_result",
+                 "_exception", "_callbacks", "_cancel_flag", "_mutex",
+                 "_on_done_event", "_pending_instant", "_running_instant",
+                 "_done_instant", "__weakref__")
 
     def __init__(self, pool, task_id):
         """This class shouldn't be instantiated by the programmer"""
         self._pool = pool
         self._task_id = task_id
-        self._on_done_event = threading.Event()
         self._status = None
         self._is_done = False
-        self._result = self._duration = self._exception = None
-        self._callbacks = list()
-        self._mutex = threading.RLock()
-        self._pending_duration = self._task_duration = 0
-        self._status_to_time = dict()
+        self._result = self._exception = None
+        self._callbacks = None
         self._cancel_flag = False
+        self._mutex = threading.Lock()
+        self._on_done_event = None
+        self._pending_instant = None
+        self._running_instant = None
+        self._done_instant = None
+
+    # Note that reading a single attribute is atomic, and once a future
+    # is done its state doesn't change anymore, hence the properties
+    # below don't need to acquire the mutex. The exception is a lazy
+    # result (see ProcessPool) that the first reader of the outcome
+    # decodes under the mutex: a decoding error fails the future
 
     @property
     def pool(self):
@@ -215,65 +247,69 @@ class Future:
 
     @property
     def is_pending(self):
-        with self._mutex:
-            return True if self._status == Status.PENDING else False
+        return self._status is Status.PENDING
 
     @property
     def is_running(self):
-        with self._mutex:
-            return True if self._status == Status.RUNNING else False
+        return self._status is Status.RUNNING
 
     @property
     def is_completed(self):
-        with self._mutex:
-            return True if self._status == Status.COMPLETED else False
+        if type(self._result) is LazyResult:
+            self._decode_result()
+        return self._status is Status.COMPLETED
 
     @property
     def is_failed(self):
-        with self._mutex:
-            return True if self._status == Status.FAILED else False
+        if type(self._result) is LazyResult:
+            self._decode_result()
+        return self._status is Status.FAILED
 
     @property
     def is_cancelled(self):
-        with self._mutex:
-            return True if self._status == Status.CANCELLED else False
+        return self._status is Status.CANCELLED
 
     @property
     def is_done(self):
-        with self._mutex:
-            return self._is_done
+        return self._is_done
 
     @property
     def result(self):
-        with self._mutex:
-            return self._result
+        if type(self._result) is LazyResult:
+            self._decode_result()
+        return self._result
 
     @property
     def duration(self):
-        with self._mutex:
-            self._update_pending_duration()
-            self._update_task_duration()
-            return self._pending_duration, self._task_duration
+        if not self._is_done:
+            return 0, 0
+        pending_duration = task_duration = 0
+        if self._pending_instant:
+            pending_duration = self._done_instant - self._pending_instant
+        if self._running_instant and self._status is not Status.CANCELLED:
+            task_duration = self._done_instant - self._running_instant
+        return pending_duration, task_duration
 
     @property
     def exception(self):
-        with self._mutex:
-            return self._exception
+        if type(self._result) is LazyResult:
+            self._decode_result()
+        return self._exception
 
     @property
     def callbacks(self):
         with self._mutex:
-            return tuple(self._callbacks)
+            return tuple(self._callbacks) if self._callbacks else tuple()
 
     @property
     def cancel_flag(self):
-        with self._mutex:
-            return self._cancel_flag
+        return self._cancel_flag
 
     @property
     def status(self):
-        with self._mutex:
-            return self._status
+        if type(self._result) is LazyResult:
+            self._decode_result()
+        return self._status
 
     def collect(self, timeout=None):
         """
@@ -297,15 +333,15 @@ class Future:
         'str' function on the RemoteError object will return
         the remote traceback as a string.
         """
-        r = self._on_done_event.wait(timeout=timeout)
-        if r is False:
+        if not self._is_done and not self.wait(timeout):
             raise TimeoutError
-        with self._mutex:
-            if self._exception is not None:
-                raise self._exception
-            if self._status == Status.CANCELLED:
-                raise errors.CancelledError
-            return self._result
+        if type(self._result) is LazyResult:
+            self._decode_result()
+        if self._exception is not None:
+            raise self._exception
+        if self._status is Status.CANCELLED:
+            raise errors.CancelledError
+        return self.result
 
     def wait(self, timeout=None):
         """
@@ -317,7 +353,17 @@ class Future:
         [return]
         Returns True if the future is done in the provided timeout range.
         """
-        return self._on_done_event.wait(timeout=timeout)
+        if self._is_done:
+            return True
+        with self._mutex:
+            if self._is_done:
+                return True
+            event = self._on_done_event
+            if event is None:
+                event = self._on_done_event = threading.Event()
+        if self._pool is not None:
+            self._pool._flush_batch()
+        return event.wait(timeout=timeout)
 
     def add_callback(self, callback):
         """
@@ -326,11 +372,7 @@ class Future:
         [param]
         - callback: the callback to add
         """
-        with self._mutex:
-            self._callbacks.append(callback)
-            if not self._is_done:
-                return
-            self._execute_callbacks((callback, ))
+        self.add_callbacks((callback, ))
 
     def add_callbacks(self, callbacks):
         """
@@ -340,10 +382,12 @@ class Future:
         - callbacks: sequence of callbacks
         """
         with self._mutex:
+            if self._callbacks is None:
+                self._callbacks = list()
             self._callbacks.extend(callbacks)
             if not self._is_done:
                 return
-            self._execute_callbacks(callbacks)
+        self._execute_callbacks(callbacks)
 
     def remove_callback(self, callback):
         """
@@ -353,7 +397,8 @@ class Future:
         - callback: the callback to remove
         """
         with self._mutex:
-            self._callbacks = [item for item in self._callbacks if item != callback]
+            if self._callbacks:
+                self._callbacks = [item for item in self._callbacks if item != callback]
 
     def remove_callbacks(self, callbacks):
         """
@@ -363,7 +408,8 @@ class Future:
         - callbacks: sequence of callbacks
         """
         with self._mutex:
-            self._callbacks = [item for item in self._callbacks if item not in callbacks]
+            if self._callbacks:
+                self._callbacks = [item for item in self._callbacks if item not in callbacks]
 
     def cancel(self):
         """
@@ -371,40 +417,50 @@ class Future:
         Note that right after, the cancel_flag property is set to True
         and later, the cancelled property will be set to True or not.
         """
-        with self._mutex:
-            self._cancel_flag = True
+        self._cancel_flag = True
+        if self._pool is not None:
+            self._pool._propagate_cancel(self)
 
     def set_status(self, status, instant=None):
         """Private method ! Don't call it !"""
+        if status in (Status.COMPLETED, Status.FAILED, Status.CANCELLED):
+            self._set_done(status, None, None, instant)
+            return
         instant = time.monotonic() if instant is None else instant
         with self._mutex:
             if self._is_done:
                 raise errors.InvalidStateError
             self._status = status
-            self._status_to_time[status] = instant
-            if status in (Status.COMPLETED, Status.FAILED,
-                          Status.CANCELLED):
-                self._is_done = True
-                self._on_done_event.set()
-                self._execute_callbacks(self._callbacks)
+            if status is Status.PENDING:
+                self._pending_instant = instant
+            else:
+                self._running_instant = instant
 
     def set_result(self, result, instant=None):
         """Private method ! Don't call it !"""
-        instant = time.monotonic() if instant is None else instant
-        with self._mutex:
-            if self._is_done:
-                raise errors.InvalidStateError
-            self._result = result
-            self.set_status(Status.COMPLETED, instant)
+        self._set_done(Status.COMPLETED, result, None, instant)
 
     def set_exception(self, exc, instant=None):
         """Private method ! Don't call it !"""
+        self._set_done(Status.FAILED, None, exc, instant)
+
+    def _set_done(self, status, result, exc, instant):
         instant = time.monotonic() if instant is None else instant
         with self._mutex:
             if self._is_done:
                 raise errors.InvalidStateError
+            self._result = result
             self._exception = exc
-            self.set_status(Status.FAILED, instant)
+            self._status = status
+            self._done_instant = instant
+            self._is_done = True
+            event = self._on_done_event
+            callbacks = tuple(self._callbacks) if self._callbacks else None
+        # waiters and callbacks are notified outside the mutex
+        if event is not None:
+            event.set()
+        if callbacks:
+            self._execute_callbacks(callbacks)
 
     def _execute_callbacks(self, callbacks):
         for callback in callbacks:
@@ -414,29 +470,293 @@ class Future:
                 msg = "Exception while calling callback for future {}".format(repr(self))
                 misc.LOGGER.exception(msg)
 
-    def _update_pending_duration(self):
+    def _decode_result(self):
+        # the first reader decodes the result, in its own thread
         with self._mutex:
-            instant_a = self._status_to_time.get(Status.PENDING)
-            if not instant_a:
+            result = self._result
+            if type(result) is not LazyResult:
                 return
-            for status in (Status.COMPLETED, Status.FAILED, Status.CANCELLED):
-                instant_b = self._status_to_time.get(status)
-                if not instant_b:
-                    continue
-                self._pending_duration = instant_b - instant_a
-                break
-
-    def _update_task_duration(self):
-        with self._mutex:
-            instant_a = self._status_to_time.get(Status.RUNNING)
-            if not instant_a:
-                return
-            for status in (Status.COMPLETED, Status.FAILED):
-                instant_b = self._status_to_time.get(status)
-                if not instant_b:
-                    continue
-                self._task_duration = instant_b - instant_a
-                break
+            try:
+                self._result = result.decode()
+            except Exception as e:
+                self._result = None
+                self._exception = e
+                self._status = Status.FAILED
+
+
+class LazyResult:
+    """Private class !
+    Serialized result that a Future decodes on first access"""
+
+    __slots__ = ("_data", "_loads")
+
+    def __init__(self, data, loads):
+        self._data = data
+        self._loads = loads
+
+    def decode(self):
+        return self._loads(self._data)
+
+
+class MapJob:
+    """
+    Handle returned by the eager Map operations (`map_all`, `starmap_all`,
+    and their unordered variants).
+
+    Instead of one Future per task, a MapJob stores the results in a single
+    list of slots and tracks completion with one counter and one condition.
+    Iterating over a MapJob yields the results either in their original
+    order or as they are done, depending on the `keep_order` option.
+    A MapJob is also an iterator: `next` consumes a single iteration.
+    Beware, a remote exception as well as CancelledError, or TimeoutError
+    exceptions might be raised while iterating.
+    """
+
+    def __init__(self, pool, keep_order=True, timeout=None, chunked=False):
+        """This class shouldn't be instantiated by the programmer"""
+        self._pool = pool
+        self._keep_order = keep_order
+        self._timeout = timeout
+        self._chunked = chunked
+        self._slots = list()
+        # index of the first element of each slot (only for chunked jobs)
+        self._starts = array("q")
+        self._size = 0
+        self._exceptions = dict()
+        self._done_order = array("q")
+        self._n_done = 0
+        self._is_sealed = False
+        self._cancel_flag = False
+        self._cond = threading.Condition(threading.Lock())
+        # consumed by __next__, the job used to be a generator
+        self._iterator = None
+        # futures run on behalf of the job (the probes of "auto" chunks)
+        self._futures = list()
+
+    @property
+    def pool(self):
+        return self._pool
+
+    @property
+    def keep_order(self):
+        return self._keep_order
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @property
+    def cancel_flag(self):
+        return self._cancel_flag
+
+    @property
+    def is_done(self):
+        with self._cond:
+            return self._is_complete()
+
+    @property
+    def progress(self):
+        """Ratio (float between 0 and 1) of elements that are done"""
+        with self._cond:
+            return self._n_done / self._size if self._size else 1.0
+
+    def count_done(self):
+        """Returns the number of elements that are done"""
+        with self._cond:
+            return self._n_done
+
+    def wait(self, timeout=None):
+        """
+        Wait (blocking) for all the tasks of the job to be done.
+
+        [param]
+        - timeout: None or a timeout value (int or float) in seconds.
+
+        [return]
+        Returns True if the job is done in the provided timeout range.
+        """
+        with self._cond:
+            return self._cond.wait_for(self._is_complete, timeout)
+
+    def collect(self, timeout=None):
+        """
+        Collect the results of the job in their original order.
+        Beware, remote exceptions as well as CancelledError,
+        or TimeoutError exceptions might be raised.
+
+        [param]
+        - timeout: None or a timeout value (int or float) in seconds.
+
+        [return]
+        Returns a tuple containing the ordered results
+
+        [except]
+        - TimeoutError: raised when timeout expires
+        - CancelledError: raised when a task got cancelled
+        """
+        return tuple(self._iterate_ordered(timeout))
+
+    def cancel(self):
+        """
+        Tries to cancel the tasks of the job that haven't started yet.
+        """
+        self._cancel_flag = True
+        for future in tuple(self._futures):
+            future.cancel()
+        if self._pool is not None:
+            self._pool._propagate_cancel(self)
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        """Return the result at this index, blocking until it is available"""
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("MapJob index out of range")
+        if self._chunked:
+            slot = bisect.bisect_right(self._starts, index) - 1
+        else:
+            slot = index
+        self._wait_slot(slot, None)
+        value = self._get_slot(slot)
+        return value[index - self._starts[slot]] if self._chunked else value
+
+    def __iter__(self):
+        if self._keep_order:
+            return self._iterate_ordered(self._timeout)
+        return self._iterate_unordered(self._timeout)
+
+    def __next__(self):
+        if self._iterator is None:
+            self._iterator = iter(self)
+        return next(self._iterator)
+
+    def _iterate_ordered(self, timeout):
+        countdown = misc.Countdown(timeout)
+        for slot in range(len(self._slots)):
+            self._wait_slot(slot, countdown.check())
+            yield from self._get_values(slot)
+
+    def _iterate_unordered(self, timeout):
+        countdown = misc.Countdown(timeout)
+        for i in range(len(self._slots)):
+            with self._cond:
+                if not self._cond.wait_for(lambda: len(self._done_order) > i,
+                                           countdown.check()):
+                    raise TimeoutError
+                slot = self._done_order[i]
+            yield from self._get_values(slot)
+
+    def _wait_slot(self, slot, timeout):
+        if self._slots[slot] is not _PENDING:
+            return
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._slots[slot] is not _PENDING,
+                                       timeout):
+                raise TimeoutError
+
+    def _get_slot(self, slot):
+        value = self._slots[slot]
+        if value is _FAILED:
+            raise self._exceptions[slot]
+        return value
+
+    def _get_values(self, slot):
+        value = self._get_slot(slot)
+        return value if self._chunked else (value, )
+
+    def _is_complete(self):
+        return self._is_sealed and len(self._done_order) == len(self._slots)
+
+    def _add_task(self, task_id, size=1):
+        with self._cond:
+            slot = len(self._slots)
+            self._slots.append(_PENDING)
+            if self._chunked:
+                self._starts.append(self._size)
+            self._size += size
+        return MapJobTask(self, slot, task_id)
+
+    def _link_future(self, future):
+        self._futures.append(future)
+        if self._cancel_flag:
+            future.cancel()
+
+    def _seal(self):
+        with self._cond:
+            self._is_sealed = True
+            self._cond.notify_all()
+
+    def _set_slot(self, slot, result, exc):
+        with self._cond:
+            if self._slots[slot] is not _PENDING:
+                raise errors.InvalidStateError
+            if exc is None:
+                self._slots[slot] = result
+            else:
+                self._exceptions[slot] = exc
+                self._slots[slot] = _FAILED
+            self._done_order.append(slot)
+            if self._chunked:
+                end = (self._starts[slot + 1] if slot + 1 < len(self._starts)
+                       else self._size)
+                self._n_done += end - self._starts[slot]
+            else:
+                self._n_done += 1
+            self._cond.notify_all()
+
+
+class MapJobTask:
+    """Stands in for a Future in the task queue of a pool
+    on behalf of a MapJob. Private class !"""
+
+    __slots__ = ("_job", "_slot", "_task_id")
+
+    def __init__(self, job, slot, task_id):
+        self._job = job
+        self._slot = slot
+        self._task_id = task_id
+
+    @property
+    def task_id(self):
+        return self._task_id
+
+    @property
+    def cancel_flag(self):
+        return self._job._cancel_flag
+
+    def set_status(self, status, instant=None):
+        """Private method ! Don't call it !"""
+        # pending and running statuses aren't tracked per task
+        if status is Status.CANCELLED:
+            self._job._set_slot(self._slot, None, errors.CancelledError())
+
+    def set_result(self, result, instant=None):
+        """Private method ! Don't call it !"""
+        self._job._set_slot(self._slot, result, None)
+
+    def set_exception(self, exc, instant=None):
+        """Private method ! Don't call it !"""
+        self._job._set_slot(self._slot, None, exc)
+
+    def copy_outcome(self, future):
+        """Private method ! Callback that copies the outcome
+        of a done future into the slot of this task"""
+        try:
+            if future.is_cancelled:
+                self.set_status(Status.CANCELLED)
+            elif future.is_failed:
+                self.set_exception(future.exception)
+            else:
+                self.set_result(future.result)
+        except errors.InvalidStateError as e:
+            pass  # the slot failed first, e.g., the job timed out
+
+
+_PENDING = object()
+_FAILED = object()
 
 
 @unique
@@ -1,7 +1,9 @@
 """Misc functions and classes."""
 import os
 import sys
+import math
 import time
+import threading
 import itertools
 import functools
 import logging
@@ -13,7 +15,7 @@ from asyncpal import errors
 
 __all__ = ["split_map_task", "split_starmap_task",
            "get_chunks", "get_remote_traceback",
-           "Countdown", "LOGGER"]
+           "Countdown", "ChunkSizer", "GuidedChunkSizer", "LOGGER"]
 
 
 LOGGER = logging.getLogger("asyncpal")
@@ -31,12 +33,16 @@ def get_chunks(iterable, chunk_size):
 
     [param]
     - iterable: the iterable to split
-    - chunk_size: max length for a chunk
+    - chunk_size: max length for a chunk, or a callable (such as
+        a ChunkSizer object) that returns the length of the next chunk
 
     [return]
     Returns an iterator
     """
     iterator = iter(iterable)
+    if callable(chunk_size):
+        return iter(lambda: tuple(itertools.islice(iterator, chunk_size())),
+                    tuple())
     return iter(lambda: tuple(itertools.islice(iterator, chunk_size)),
                 tuple())
 
@@ -69,6 +75,24 @@ def add(a, b):
     return a + b
 
 
+def update_counter(counter, n):
+    """Private function !"""
+    with counter.get_lock():
+        counter.value += n
+
+
+class Counter:
+    """Thread-safe counter that exposes the same interface as
+    the synchronized multiprocessing.Value, so that thread workers
+    and process workers can update their counters the same way"""
+    def __init__(self, value=0):
+        self.value = value
+        self._lock = threading.Lock()
+
+    def get_lock(self):
+        return self._lock
+
+
 class Countdown:
     """Class to continually update a timeout as time passes.
     Used a lot by pools for map operations"""
@@ -112,6 +136,138 @@ class Countdown:
         return x if x > 0 else 0
 
 
+class ChunkSizer:
+    """Adaptive chunk size used by Map operations when 'chunk_size'
+    is set to "auto". Calling the object returns the length of the next chunk.
+
+    Completed chunks are fed back with the `observe` method which reads
+    `Future.duration`: the task duration gives the time spent per element
+    while the rest of the lifetime of the future is the per-chunk overhead.
+    The chunk size grows or shrinks so that this overhead stays around
+    'overhead_ratio' times the compute time of a chunk."""
+    def __init__(self, overhead_ratio=0.05, max_chunk_size=4096, n_probes=3):
+        """Init.
+
+        [param]
+        - overhead_ratio: targeted ratio of per-chunk overhead to compute time
+        - max_chunk_size: upper bound for the chunk size
+        - n_probes: number of observations after which the chunk size
+            is considered settled"""
+        self._overhead_ratio = overhead_ratio
+        self._max_chunk_size = max_chunk_size
+        self._n_probes = n_probes
+        self._chunk_size = 1
+        self._overhead = None
+        self._item_duration = None
+        self._n_samples = 0
+        self._is_settled = False
+
+    @property
+    def chunk_size(self):
+        return self._chunk_size
+
+    @property
+    def overhead_ratio(self):
+        return self._overhead_ratio
+
+    @property
+    def max_chunk_size(self):
+        return self._max_chunk_size
+
+    @property
+    def n_samples(self):
+        return self._n_samples
+
+    @property
+    def is_settled(self):
+        """Whether enough probes have been observed or the chunk size
+        stopped changing"""
+        return self._is_settled
+
+    def observe(self, future):
+        """Feed a completed chunk future to the sizer.
+        Failed or cancelled futures are ignored"""
+        if not future.is_completed or not future.result:
+            return
+        pending_duration, task_duration = future.duration
+        self.update(len(future.result), pending_duration - task_duration,
+                    task_duration)
+
+    def update(self, n_items, overhead, task_duration):
+        """Update the chunk size with a new measure
+
+        [param]
+        - n_items: the length of the measured chunk
+        - overhead: the time spent outside the task (queueing, IPC, ...)
+        - task_duration: the time spent running the chunk"""
+        if n_items < 1:
+            return
+        item_duration = max(task_duration, 0) / n_items
+        overhead = max(overhead, 0)
+        # queueing inflates the measured overhead, so only its floor is kept
+        if self._overhead is None:
+            self._overhead = overhead
+            self._item_duration = item_duration
+        else:
+            self._overhead = min(self._overhead, overhead)
+            self._item_duration = (self._item_duration + item_duration) / 2
+        self._n_samples += 1
+        if self._item_duration > 0:
+            x = self._overhead / (self._overhead_ratio * self._item_duration)
+            chunk_size = min(max(math.ceil(x), 1), self._max_chunk_size)
+        else:
+            chunk_size = self._max_chunk_size
+        if (chunk_size == self._chunk_size
+                or self._n_samples >= self._n_probes):
+            self._is_settled = True
+        self._chunk_size = chunk_size
+
+    def __call__(self):
+        return self._chunk_size
+
+
+class GuidedChunkSizer:
+    """Decreasing chunk size used by Map operations when 'chunk_size'
+    is set to "guided". Calling the object returns the length of the next chunk.
+
+    Each chunk takes a share of the remaining elements so chunks start
+    large and shrink toward the end of the input, letting all workers
+    finish at about the same time. The total length must be known upfront."""
+    def __init__(self, total, n_workers, min_chunk_size=1):
+        """Init.
+
+        [param]
+        - total: the number of elements to split
+        - n_workers: the number of workers sharing the elements
+        - min_chunk_size: lower bound for the chunk size"""
+        self._total = total
+        self._n_workers = n_workers
+        self._min_chunk_size = min_chunk_size
+        self._remaining = total
+
+    @property
+    def total(self):
+        return self._total
+
+    @property
+    def n_workers(self):
+        return self._n_workers
+
+    @property
+    def min_chunk_size(self):
+        return self._min_chunk_size
+
+    @property
+    def remaining(self):
+        return self._remaining
+
+    def __call__(self):
+        x = math.ceil(self._remaining / (2 * self._n_workers))
+        chunk_size = max(x, self._min_chunk_size, 1)
+        self._remaining = max(self._remaining - chunk_size, 0)
+        return chunk_size
+
+
 def split_map_task(target, *iterables, chunk_size=1):
     """
     Split a map task into subtasks that don't take any arguments.
@@ -120,13 +276,14 @@ def split_map_task(target, *iterables, chunk_size=1):
     [param]
     - target: the callable task
     - iterables: the map iterables to pass to target
-    - chunk_size: the max length of a chunk
+    - chunk_size: the max length of a chunk, or a callable
+        that returns the length of the next chunk
 
     [yield]
     Iteratively get a subtask that don't accept any arguments
     """
     for chunk in get_chunks(zip(*iterables), chunk_size):
-        yield functools.partial(_subtask, target, chunk)
+        yield get_subtask(target, chunk)
 
 
 def split_starmap_task(target, iterable, chunk_size=1):
@@ -136,13 +293,24 @@ def split_starmap_task(target, iterable, chunk_size=1):
     [param]
     - target: the callable task
     - iterable: a sequence of tuples each representing args to pass to target
-    - chunk_size: the max length of a chunk
+    - chunk_size: the max length of a chunk, or a callable
+        that returns the length of the next chunk
 
     [yield]
     Iteratively get a subtask that don't accept any arguments
     """
     for chunk in get_chunks(iterable, chunk_size):
-        yield functools.partial(_subtask, target, chunk)
+        yield get_subtask(target, chunk)
+
+
+def get_subtask(target, chunk):
+    """Private function !"""
+    return functools.partial(_subtask, target, chunk)
+
+
+def is_subtask(obj):
+    """Private function !"""
+    return type(obj) is functools.partial and obj.func is _subtask
 
 
 def _subtask(target, chunk):
@@ -1,5 +1,6 @@
 """The abstract base class for all pools is defined here,
 as well as the GlobalShutdown class."""
+import math
 import time
 import atexit
 import threading
@@ -7,9 +8,11 @@ import itertools
 import multiprocessing as mp
 from abc import ABC, abstractmethod
 from collections import deque
+from contextlib import contextmanager
+from queue import SimpleQueue, Empty as EmptyQueueError
 from asyncpal import errors
 from asyncpal import misc
-from asyncpal.future import Future, Status, as_done, FutureFilter
+from asyncpal.future import Future, Status, FutureFilter, MapJob
 from asyncpal.worker import WorkerType
 
 
@@ -28,7 +31,8 @@ class Pool(ABC):
                  init_kwargs, finalizer, final_args,
                  final_kwargs, max_tasks_per_worker,
                  task_queue, mp_task_queue=None,
-                 message_queue=None, mp_context=None):
+                 message_queue=None, mp_context=None,
+                 caller_runs=False):
         # constructor args and kwargs
         self._worker_type = WorkerType(worker_type)
         self._max_workers = max_workers
@@ -42,6 +46,7 @@ class Pool(ABC):
         self._finalizer = finalizer
         self._max_tasks_per_worker = max_tasks_per_worker
         self._mp_context = mp_context
+        self._caller_runs = caller_runs
         # task queue
         self._task_queue = task_queue
         self._mp_task_queue = mp_task_queue
@@ -58,6 +63,10 @@ class Pool(ABC):
         #
         self._workers = dict()
         self._inactive_workers = list()
+        # live and busy workers are counted as they change state
+        # so that spawn decisions don't have to scan all workers
+        self._n_workers = 0
+        self._busy_counter = self._create_counter()
         self._stored_futures = dict()
         self._is_broken = False
         self._cancelled_tasks = list()
@@ -66,6 +75,7 @@ class Pool(ABC):
         self._stored_exception = None
         self._monotonic_worker_count = 0
         self._monotonic_task_count = 0
+        self._batch_state = threading.local()
         self._setup()
 
     @property
@@ -129,6 +139,10 @@ class Pool(ABC):
     def mp_context(self):
         return self._mp_context
 
+    @property
+    def caller_runs(self):
+        return self._caller_runs
+
     @property
     def workers(self):
         with self._vars_lock:
@@ -168,7 +182,9 @@ class Pool(ABC):
     def run(self, target, /, *args, **kwargs):
         """
         Submit the task to the pool, and return
-        the result (or re-raise the exception raised by the callable)
+        the result (or re-raise the exception raised by the callable).
+        If the pool was created with the 'caller_runs' option and all
+        its workers are busy, the task is run in the calling thread.
 
         [param]
         - target: callable
@@ -184,7 +200,14 @@ class Pool(ABC):
             raise RuntimeError
         self._ensure_pool_integrity()
         with self._pool_lock:
-            return self._submit_task(target, *args, **kwargs).collect()
+            runs_here = self._caller_runs and self._is_saturated()
+        if runs_here:
+            return target(*args, **kwargs)
+        # the pool lock is released before waiting for the result
+        # so that other threads can keep submitting tasks meanwhile
+        target, args, kwargs = self._encode_task(target, args, kwargs)
+        future = self._submit_single(target, args, kwargs)
+        return future.collect()
 
     def submit(self, target, /, *args, **kwargs):
         """
@@ -204,11 +227,74 @@ class Pool(ABC):
         if self._is_closed.is_set():
             raise RuntimeError
         self._ensure_pool_integrity()
+        target, args, kwargs = self._encode_task(target, args, kwargs)
+        if self._is_batching():
+            with self._pool_lock:
+                return self._enqueue_task(target, args, kwargs)
+        return self._submit_single(target, args, kwargs)
+
+    def submit_many(self, target, iterable):
+        """
+        Submit many tasks to the pool at once, and return
+        a list of future objects. Joining inactive workers and
+        spawning new ones are done once for the whole lot
+        instead of once per task.
+
+        [param]
+        - target: callable
+        - iterable: sequence of args to pass to the target
+
+        [return]
+        Returns a list of future objects
+
+        [except]
+        - RuntimeError: raised when the pool is closed
+        - BrokenPoolError: raised when the pool is broken
+        """
+        if self._is_closed.is_set():
+            raise RuntimeError
+        self._ensure_pool_integrity()
+        tasks = [self._encode_task(target, args, dict()) for args in iterable]
         with self._pool_lock:
-            return self._submit_task(target, *args, **kwargs)
+            self._join_inactive_workers()
+            futures = [self._enqueue_task(*task) for task in tasks]
+            self._spawn_workers()
+            return futures
+
+    @contextmanager
+    def batch(self):
+        """
+        Context manager to submit many tasks with the `submit` method
+        while paying for the bookkeeping (joining inactive workers and
+        spawning new ones) only once, when the block exits.
+        Only the calls to `submit` made by the current thread are batched.
+
+        Note that existing workers start consuming the tasks right away,
+        but no new worker is spawned before the block exits, unless the
+        current thread waits for a future (e.g. with `collect`) inside the
+        block: pending tasks are then flushed so that the wait can't hang.
+
+        [except]
+        - RuntimeError: raised when the pool is closed
+        - BrokenPoolError: raised when the pool is broken
+        """
+        if self._is_closed.is_set():
+            raise RuntimeError
+        self._ensure_pool_integrity()
+        depth = getattr(self._batch_state, "depth", 0)
+        self._batch_state.depth = depth + 1
+        try:
+            yield self
+        finally:
+            self._batch_state.depth = depth
+            if depth == 0 and not self._is_closed.is_set():
+                with self._pool_lock:
+                    self._join_inactive_workers()
+                    self._spawn_workers()
 
     def map(self, target, *iterables, chunk_size=1, buffer_size=1,
-            keep_order=True, timeout=None):
+            keep_order=True, timeout=None, max_in_flight=None, feeder=False,
+            fail_fast=False):
         """
         Perform a Map operation lazily and return an iterator
         that iterates over the results.
@@ -217,25 +303,66 @@ class Pool(ABC):
         [param]
         - target: callable
         - iterables: iterables to pass to the target
-        - chunk_size: max length for a chunk
+        - chunk_size: max length for a chunk. Set it to "auto" to let the pool
+            adapt it to the measured duration of the first chunks, or to
+            "guided" to get decreasing chunk sizes (requires sized iterables)
         - buffer_size: the buffer_size. A bigger size will consume more memory
             but the overall operation will be faster
         - keep_order: whether the original order should be kept or not
         - timeout: None or a timeout (int or float) value in seconds
+        - max_in_flight: None or the max number of tasks (or chunks) running
+            or waiting in the pool. When set with keep_order, new tasks are
+            submitted while the head task runs, and results completed out of
+            order wait in a reorder buffer that holds up to
+            max(buffer_size, max_in_flight) results
+        - feeder: whether the input should be iterated and the tasks submitted
+            by a dedicated thread, so that a slow input iterator and slow
+            per-result work of the consumer overlap with the execution of
+            tasks. The feeder runs ahead of the consumer by at most
+            max(buffer_size, max_in_flight) tasks (or chunks)
+        - fail_fast: when keep_order is True, whether a remote exception
+            should be reraised as soon as it occurs instead of when its turn
+            comes in the original order. Unordered maps always behave this way
 
         [return]
-        Returns an iterator
+        Returns an iterator. Tasks that haven't started yet are cancelled when
+        the iterator is closed, or when it raises an exception
 
         [except]
         - RuntimeError: raised when the pool is closed
         - BrokenPoolError: raised when the pool is broken
+        - ValueError: raised when chunk_size is "guided" and the length
+            of the iterables is unknown, or when max_in_flight is below 1
         - Exception: any remote exception
         """
         if self._is_closed.is_set():
             raise RuntimeError
         self._ensure_pool_integrity()
+        if max_in_flight is not None and max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        if chunk_size == "auto":
+            chunk_size = misc.ChunkSizer()
+        elif chunk_size == "guided":
+            chunk_size = self._create_guided_sizer(iterables)
         with self._pool_lock:
-            if chunk_size == 1 and keep_order:
+            if feeder:
+                return self._map_lazy_with_feeder(target, zip(*iterables),
+                                                  chunk_size=chunk_size,
+                                                  keep_order=keep_order,
+                                                  max_in_flight=max_in_flight,
+                                                  buffer_size=buffer_size,
+                                                  fail_fast=fail_fast,
+                                                  timeout=timeout)
+            elif (max_in_flight is not None or fail_fast) and keep_order:
+                if max_in_flight is None:
+                    max_in_flight = buffer_size
+                return self._map_lazy_windowed(target, zip(*iterables),
+                                               chunk_size=chunk_size,
+                                               max_in_flight=max_in_flight,
+                                               buffer_size=buffer_size,
+                                               fail_fast=fail_fast,
+                                               timeout=timeout)
+            elif chunk_size == 1 and keep_order:
                 return self._map_lazy(target, zip(*iterables),
                                       buffer_size=buffer_size,
                                       timeout=timeout)
@@ -256,11 +383,11 @@ class Pool(ABC):
 
     def map_unordered(self, target, *iterables,
                       chunk_size=1, buffer_size=1,
-                      timeout=None):
+                      timeout=None, feeder=False):
         """Same as map with 'keep_order' set to False"""
         return self.map(target, *iterables, chunk_size=chunk_size,
                         buffer_size=buffer_size, keep_order=False,
-                        timeout=timeout)
+                        timeout=timeout, feeder=feeder)
 
     def map_all(self, target, *iterables, chunk_size=1,
                 keep_order=True, timeout=None):
@@ -273,21 +400,31 @@ class Pool(ABC):
         [param]
         - target: callable
         - iterables: iterables to pass to the target
-        - chunk_size: max length for a chunk
+        - chunk_size: max length for a chunk. Set it to "auto" to let the pool
+            adapt it to the measured duration of the first chunks, or to
+            "guided" to get decreasing chunk sizes (requires sized iterables)
         - keep_order: whether the original order should be kept or not
         - timeout: None or a timeout (int or float) value in seconds
 
         [return]
-        Returns an iterator that iterates over the results.
+        Returns a MapJob object that iterates over the results.
 
         [except]
         - RuntimeError: raised when the pool is closed
         - BrokenPoolError: raised when the pool is broken
+        - ValueError: raised when chunk_size is "guided" and the length
+            of the iterables is unknown
         - Exception: any remote exception
         """
         if self._is_closed.is_set():
             raise RuntimeError
         self._ensure_pool_integrity()
+        if chunk_size == "auto":
+            return self._map_eager_auto(target, zip(*iterables),
+                                        keep_order=keep_order,
+                                        timeout=timeout)
+        elif chunk_size == "guided":
+            chunk_size = self._create_guided_sizer(iterables)
         with self._pool_lock:
             if chunk_size == 1:
                 return self._map_eager(target, zip(*iterables),
@@ -306,7 +443,8 @@ class Pool(ABC):
                             keep_order=False, timeout=timeout)
 
     def starmap(self, target, iterable, chunk_size=1, buffer_size=1,
-                keep_order=True, timeout=None):
+                keep_order=True, timeout=None, max_in_flight=None,
+                feeder=False, fail_fast=False):
         """
         Perform a Starmap operation lazily and return an iterator
         that iterates over the results.
@@ -315,25 +453,67 @@ class Pool(ABC):
         [param]
         - target: callable
         - iterable: sequence of args to pass to the target
-        - chunk_size: max length for a chunk
+        - chunk_size: max length for a chunk. Set it to "auto" to let the pool
+            adapt it to the measured duration of the first chunks, or to
+            "guided" to get decreasing chunk sizes (requires sized iterables)
         - buffer_size: the buffer_size. A bigger size will consume more memory
             but the overall operation will be faster
         - keep_order: whether the original order should be kept or not
         - timeout: None or a timeout (int or float) value in seconds
+        - max_in_flight: None or the max number of tasks (or chunks) running
+            or waiting in the pool. When set with keep_order, new tasks are
+            submitted while the head task runs, and results completed out of
+            order wait in a reorder buffer that holds up to
+            max(buffer_size, max_in_flight) results
+        - feeder: whether the input should be iterated and the tasks submitted
+            by a dedicated thread, so that a slow input iterator and slow
+            per-result work of the consumer overlap with the execution of
+            tasks. The feeder runs ahead of the consumer by at most
+            max(buffer_size, max_in_flight) tasks (or chunks)
+        - fail_fast: when keep_order is True, whether a remote exception
+            should be reraised as soon as it occurs instead of when its turn
+            comes in the original order. Unordered maps always behave this way
 
         [return]
-        Returns an iterator that iterates over the results.
+        Returns an iterator that iterates over the results. Tasks that haven't
+        started yet are cancelled when the iterator is closed, or when it
+        raises an exception
 
         [except]
         - RuntimeError: raised when the pool is closed
         - BrokenPoolError: raised when the pool is broken
+        - ValueError: raised when chunk_size is "guided" and the length
+            of the iterables is unknown, or when max_in_flight is below 1
         - Exception: any remote exception
         """
         if self._is_closed.is_set():
             raise RuntimeError
         self._ensure_pool_integrity()
+        if max_in_flight is not None and max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        if chunk_size == "auto":
+            chunk_size = misc.ChunkSizer()
+        elif chunk_size == "guided":
+            chunk_size = self._create_guided_sizer((iterable, ))
         with self._pool_lock:
-            if chunk_size == 1 and keep_order:
+            if feeder:
+                return self._map_lazy_with_feeder(target, iterable,
+                                                  chunk_size=chunk_size,
+                                                  keep_order=keep_order,
+                                                  max_in_flight=max_in_flight,
+                                                  buffer_size=buffer_size,
+                                                  fail_fast=fail_fast,
+                                                  timeout=timeout)
+            elif (max_in_flight is not None or fail_fast) and keep_order:
+                if max_in_flight is None:
+                    max_in_flight = buffer_size
+                return self._map_lazy_windowed(target, iterable,
+                                               chunk_size=chunk_size,
+                                               max_in_flight=max_in_flight,
+                                               buffer_size=buffer_size,
+                                               fail_fast=fail_fast,
+                                               timeout=timeout)
+            elif chunk_size == 1 and keep_order:
                 return self._map_lazy(target, iterable,
                                       buffer_size=buffer_size,
                                       timeout=timeout)
@@ -353,11 +533,11 @@ class Pool(ABC):
                                                         timeout=timeout)
 
     def starmap_unordered(self, target, iterable, chunk_size=1,
-                          buffer_size=1, timeout=None):
+                          buffer_size=1, timeout=None, feeder=False):
         """Same as starmap with 'keep_order' set to False"""
         return self.starmap(target, iterable, chunk_size=chunk_size,
                             buffer_size=buffer_size, keep_order=False,
-                            timeout=timeout)
+                            timeout=timeout, feeder=feeder)
 
     def starmap_all(self, target, iterable, chunk_size=1,
                     keep_order=True, timeout=None):
@@ -370,21 +550,31 @@ class Pool(ABC):
         [param]
         - target: callable
         - iterable: sequence of args to pass to the target
-        - chunk_size: max length for a chunk
+        - chunk_size: max length for a chunk. Set it to "auto" to let the pool
+            adapt it to the measured duration of the first chunks, or to
+            "guided" to get decreasing chunk sizes (requires sized iterables)
         - keep_order: whether the original order should be kept or not
         - timeout: None or a timeout (int or float) value in seconds
 
         [return]
-        Returns an iterator that iterates over the results.
+        Returns a MapJob object that iterates over the results.
 
         [except]
         - RuntimeError: raised when the pool is closed
         - BrokenPoolError: raised when the pool is broken
+        - ValueError: raised when chunk_size is "guided" and the length
+            of the iterables is unknown
         - Exception: any remote exception
         """
         if self._is_closed.is_set():
             raise RuntimeError
         self._ensure_pool_integrity()
+        if chunk_size == "auto":
+            return self._map_eager_auto(target, iterable,
+                                        keep_order=keep_order,
+                                        timeout=timeout)
+        elif chunk_size == "guided":
+            chunk_size = self._create_guided_sizer((iterable, ))
         with self._pool_lock:
             if chunk_size == 1:
                 return self._map_eager(target, iterable,
@@ -422,9 +612,25 @@ class Pool(ABC):
         pool_class = self.__class__
         if self._worker_type == WorkerType.THREAD:
             name = "test_threadpool_" + str(int(time.time()))
+            kwargs["caller_runs"] = self._caller_runs
         else:
             name = "test_processpool_" + str(int(time.time()))
             kwargs["mp_context"] = self._mp_context
+            kwargs["notify_running"] = self._notify_running
+            kwargs["result_batch_size"] = self._result_batch_size
+            kwargs["result_flush_interval"] = self._result_flush_interval
+            kwargs["task_batch_size"] = self._task_batch_size
+            kwargs["transport"] = self._transport
+            kwargs["shm_threshold"] = self._shm_threshold
+            kwargs["serializer"] = self._serializer
+            kwargs["serialize_on_submit"] = self._serialize_on_submit
+            kwargs["lazy_results"] = self._lazy_results
+            kwargs["message_threads"] = len(self._message_queues)
+            kwargs["direct_dispatch"] = self._direct_dispatch
+            kwargs["prefetch"] = self._prefetch
+            kwargs["task_timeout"] = self._task_timeout
+            kwargs["crash_retries"] = self._crash_retries
+            kwargs["ring_size"] = self._ring_size
         kwargs["name"] = name
         with pool_class(**kwargs) as pool:
             it = range(10)
@@ -531,7 +737,9 @@ class Pool(ABC):
                 self._shutdown_filter_thread()
                 self._shutdown_message_thread()
             self._cleanup_stored_futures()
-            self._workers = dict()
+            with self._workers_lock:
+                self._workers = dict()
+                self._n_workers = 0
             self._is_terminated = True
             self._stored_exception = None
             GlobalShutdown.deregister(self.shutdown)
@@ -549,17 +757,19 @@ class Pool(ABC):
         self._filter_thread.start()
 
     def _spawn_workers(self, n=None):
-        if n is None:
-            n_workers = self._count_workers()
-            n_free_workers = self._count_free_workers()
-            n_tasks = self._count_pending_tasks()
-            max_n = self._max_workers - n_workers
-            n = max(0, min(max_n, n_tasks - n_free_workers))
         with self._workers_lock:
+            if n is None:
+                n_workers = self._n_workers
+                n_busy_workers = min(n_workers, self._get_busy_count())
+                n_free_workers = n_workers - n_busy_workers
+                n_tasks = self._count_pending_tasks()
+                max_n = self._max_workers - n_workers
+                n = max(0, min(max_n, n_tasks - n_free_workers))
             for _ in range(n):
                 self._monotonic_worker_count += 1
                 worker = self._create_worker()
                 self._workers[worker.worker_id] = worker
+                self._n_workers += 1
                 worker.run()
         return n
 
@@ -568,6 +778,25 @@ class Pool(ABC):
                 if self._worker_type == WorkerType.THREAD
                 else self._mp_context.RLock())
 
+    def _create_counter(self):
+        # process workers publish their state in their running slots,
+        # therefore they don't share a counter guarded by a lock
+        return (misc.Counter()
+                if self._worker_type == WorkerType.THREAD
+                else None)
+
+    def _get_busy_count(self):
+        if self._busy_counter is None:
+            return self._count_busy_workers()
+        return self._busy_counter.value
+
+    def _is_saturated(self):
+        with self._workers_lock:
+            n_workers = self._n_workers
+            if n_workers < self._max_workers:
+                return False
+            return self._get_busy_count() >= n_workers
+
     def _count_workers(self):
         with self._workers_lock:
             i = 0
@@ -612,118 +841,460 @@ class Pool(ABC):
         pass
 
     def _submit_task(self, target, *args, **kwargs):
+        return self._submit_task_with(target, args, kwargs)
+
+    def _submit_task_with(self, target, args, kwargs):
         self._join_inactive_workers()
+        future = self._enqueue_task(target, args, kwargs)
+        # ensure workers
+        self._spawn_workers()
+        return future
+
+    def _submit_single(self, target, args, kwargs):
+        # called by submit and run, out of the pool lock. ProcessPool
+        # overrides it to send the task right away to a worker
+        with self._pool_lock:
+            return self._submit_task_with(target, args, kwargs)
+
+    def _propagate_cancel(self, obj):
+        # called by Future.cancel and MapJob.cancel. ProcessPool
+        # overrides it to tell workers that hold the tasks
+        pass
+
+    def _encode_task(self, target, args, kwargs):
+        # called by the submitting thread, out of the pool lock.
+        # ProcessPool overrides it to serialize the task
+        return target, args, kwargs
+
+    def _enqueue_task(self, target, args, kwargs):
         self._monotonic_task_count += 1
-        task_id = self._monotonic_task_count
-        future = Future(self, task_id)
+        future = Future(self, self._monotonic_task_count)
         future.set_status(Status.PENDING)
+        self._put_task(future, target, args, kwargs)
+        return future
+
+    def _enqueue_job_task(self, job, target, args, size=1):
+        self._monotonic_task_count += 1
+        job_task = job._add_task(self._monotonic_task_count, size)
+        self._put_task(job_task, target, args, dict())
+        # cheap check (no lock) to skip spawn decisions once the pool is full
+        if self._n_workers < self._max_workers:
+            self._spawn_workers()
+
+    def _put_task(self, future, target, args, kwargs):
+        # 'future' is either a Future or a MapJobTask
         if self._worker_type == WorkerType.PROCESS:
             with self._futures_lock:
-                self._stored_futures[task_id] = future
+                self._stored_futures[future.task_id] = future
         task = (future, target, args, kwargs)
         self._task_queue.put(task)
-        # ensure workers
-        self._spawn_workers()
-        return future
+
+    def _create_guided_sizer(self, iterables):
+        try:
+            total = min(len(iterable) for iterable in iterables)
+        except TypeError:
+            msg = 'chunk_size="guided" requires iterables with a known length'
+            raise ValueError(msg) from None
+        return misc.GuidedChunkSizer(total, self._max_workers)
+
+    def _is_batching(self):
+        return getattr(self._batch_state, "depth", 0) > 0
+
+    def _flush_batch(self):
+        """Private method ! Called before a thread blocks on a future of this
+        pool. Inside a batch, the workers whose spawning was deferred might be
+        the ones the future is waiting for, so they are spawned right now"""
+        if not self._is_batching() or self._is_closed.is_set():
+            return
+        with self._pool_lock:
+            self._join_inactive_workers()
+            self._spawn_workers()
 
     def _map_lazy(self, target, iterable, buffer_size, timeout):
         countdown = misc.Countdown(timeout)
         buffer = deque()
-        for i, args in enumerate(iterable):
-            future = self._submit_task(target, *args)
-            buffer.append(future)
-            if i >= buffer_size - 1:
-                future = buffer.popleft()
+        try:
+            for i, args in enumerate(iterable):
+                future = self._submit_task(target, *args)
+                buffer.append(future)
+                if i >= buffer_size - 1:
+                    new_timeout = countdown.check()
+                    value = buffer[0].collect(new_timeout)
+                    buffer.popleft()
+                    yield value
+            # consume buffer
+            while buffer:
                 new_timeout = countdown.check()
-                yield future.collect(new_timeout)
-        # consume buffer
-        for future in buffer:
-            new_timeout = countdown.check()
-            yield future.collect(new_timeout)
+                value = buffer[0].collect(new_timeout)
+                buffer.popleft()
+                yield value
+        finally:
+            self._cancel_futures(buffer)
+
+    def _map_lazy_windowed(self, target, iterable, chunk_size,
+                           max_in_flight, buffer_size, fail_fast, timeout):
+        countdown = misc.Countdown(timeout)
+        sizer = chunk_size if isinstance(chunk_size, misc.ChunkSizer) else None
+        reorder_size = max(buffer_size, max_in_flight)
+        tasks = self._get_lazy_tasks(target, iterable, chunk_size)
+        done_queue = SimpleQueue()
+        window = deque()  # submitted futures, in input order
+        n_submitted = n_done = n_yielded = 0
+        is_exhausted = False
+        try:
+            while True:
+                if fail_fast:
+                    n_done += self._check_done_futures(done_queue)
+                # submit while both the in-flight window and the reorder
+                # buffer have room. A done future might be yielded before its
+                # notification is received, hence the clamping to the window
+                while (not is_exhausted
+                       and min(n_submitted - n_done, len(window)) < max_in_flight
+                       and n_done - n_yielded < reorder_size):
+                    task = next(tasks, None)
+                    if task is None:
+                        is_exhausted = True
+                        break
+                    future = self._submit_task(task[0], *task[1])
+                    future.add_callback(done_queue.put)
+                    window.append(future)
+                    n_submitted += 1
+                if not window:
+                    break
+                future = window[0]
+                if future.is_done:
+                    values = future.collect()
+                    window.popleft()
+                    n_yielded += 1
+                    if chunk_size == 1:
+                        yield values
+                        continue
+                    if sizer is not None:
+                        sizer.observe(future)
+                    for value in values:
+                        yield value
+                    continue
+                try:
+                    future = done_queue.get(timeout=countdown.check())
+                except EmptyQueueError:
+                    raise TimeoutError from None
+                n_done += 1
+                if fail_fast and future.is_failed:
+                    future.collect()
+        finally:
+            self._cancel_futures(window)
+
+    def _map_lazy_with_feeder(self, target, iterable, chunk_size, keep_order,
+                              max_in_flight, buffer_size, fail_fast, timeout):
+        countdown = misc.Countdown(timeout)
+        sizer = chunk_size if isinstance(chunk_size, misc.ChunkSizer) else None
+        tasks = self._get_lazy_tasks(target, iterable, chunk_size)
+        # the semaphore bounds how far the feeder runs ahead of the consumer
+        semaphore = threading.Semaphore(max(buffer_size, max_in_flight or 0))
+        stop_event = threading.Event()
+        done_queue = SimpleQueue()
+        pending = dict()  # submitted futures that aren't consumed yet
+        order = deque() if keep_order else None
+        thread_name = "asyncpal-{}-FeederThread".format(self._name)
+        thread = threading.Thread(name=thread_name, target=self._feed_tasks,
+                                  args=(tasks, semaphore, stop_event,
+                                        done_queue, pending, order),
+                                  daemon=True)
+        thread.start()
+        n_submitted, n_yielded = None, 0
+        try:
+            while n_submitted is None or n_yielded < n_submitted:
+                if fail_fast and keep_order:
+                    self._check_done_futures(done_queue)
+                if order and order[0].is_done:
+                    future = order.popleft()
+                else:
+                    try:
+                        item = done_queue.get(timeout=countdown.check())
+                    except EmptyQueueError:
+                        raise TimeoutError from None
+                    if isinstance(item, _FeederEnd):
+                        if item.exc is not None:
+                            raise item.exc
+                        n_submitted = item.n_submitted
+                        continue
+                    if keep_order:
+                        if fail_fast and item.is_failed:
+                            item.collect()
+                        continue
+                    future = item
+                values = future.collect()
+                del pending[future.task_id]
+                n_yielded += 1
+                semaphore.release()
+                if chunk_size == 1:
+                    yield values
+                    continue
+                if sizer is not None:
+                    sizer.observe(future)
+                for value in values:
+                    yield value
+        finally:
+            stop_event.set()
+            semaphore.release()
+            self._cancel_futures(tuple(pending.values()))
+
+    def _feed_tasks(self, tasks, semaphore, stop_event, done_queue,
+                    pending, order):
+        """Private method ! Run by the feeder thread of a lazy Map operation"""
+        n_submitted = 0
+        try:
+            for task in tasks:
+                semaphore.acquire()
+                if stop_event.is_set():
+                    break
+                # task ids and workers are updated under the pool lock,
+                # as for any other submission
+                with self._pool_lock:
+                    future = self._submit_task(task[0], *task[1])
+                pending[future.task_id] = future
+                if order is not None:
+                    order.append(future)
+                future.add_callback(done_queue.put)
+                n_submitted += 1
+                # the consumer might have stopped in the meantime
+                if stop_event.is_set():
+                    future.cancel()
+                    break
+        except BaseException as e:
+            done_queue.put(_FeederEnd(n_submitted, e))
+        else:
+            done_queue.put(_FeederEnd(n_submitted))
+
+    def _get_lazy_tasks(self, target, iterable, chunk_size):
+        if chunk_size == 1:
+            return ((target, args) for args in iterable)
+        return ((subtask, tuple()) for subtask
+                in misc.split_starmap_task(target, iterable,
+                                           chunk_size=chunk_size))
+
+    def _check_done_futures(self, done_queue):
+        """Consume the done futures available in 'done_queue' without blocking,
+        reraising the first remote exception. Returns the number of futures"""
+        n = 0
+        while True:
+            try:
+                future = done_queue.get_nowait()
+            except EmptyQueueError:
+                return n
+            if isinstance(future, _FeederEnd):
+                done_queue.put(future)  # left for the consumer
+                return n
+            n += 1
+            if future.is_failed:
+                future.collect()
+
+    def _cancel_futures(self, futures):
+        for future in futures:
+            if not future.is_done:
+                future.cancel()
 
     def _map_lazy_unordered(self, target, iterable, buffer_size, timeout):
         countdown = misc.Countdown(timeout)
         future_filter = FutureFilter()
-        for i, args in enumerate(iterable):
-            future = self._submit_task(target, *args)
-            future_filter.put(future)
-            if i >= buffer_size - 1:
-                new_timeout = countdown.check()
-                future = future_filter.get(timeout=new_timeout)
+        try:
+            for i, args in enumerate(iterable):
+                future = self._submit_task(target, *args)
+                future_filter.put(future)
+                if i >= buffer_size - 1:
+                    new_timeout = countdown.check()
+                    future = future_filter.get(timeout=new_timeout)
+                    yield future.collect()
+            new_timeout = countdown.check()
+            for future in future_filter.get_all(timeout=new_timeout):
                 yield future.collect()
-        new_timeout = countdown.check()
-        for future in future_filter.get_all(timeout=new_timeout):
-            yield future.collect()
+        finally:
+            self._cancel_futures(future_filter.futures)
 
     def _map_lazy_chunked(self, target, iterable, chunk_size,
                           buffer_size, timeout):
         countdown = misc.Countdown(timeout)
+        sizer = chunk_size if isinstance(chunk_size, misc.ChunkSizer) else None
         buffer = deque()
-        for i, subtask in enumerate(misc.split_starmap_task(target,
-                                                            iterable,
-                                                            chunk_size=chunk_size)):
-            future = self._submit_task(subtask)
-            buffer.append(future)
-            if i >= buffer_size - 1:
-                future = buffer.popleft()
+        try:
+            for i, subtask in enumerate(misc.split_starmap_task(target,
+                                                                iterable,
+                                                                chunk_size=chunk_size)):
+                future = self._submit_task(subtask)
+                buffer.append(future)
+                if i >= buffer_size - 1:
+                    new_timeout = countdown.check()
+                    values = buffer[0].collect(new_timeout)
+                    future = buffer.popleft()
+                    if sizer is not None:
+                        sizer.observe(future)
+                    for value in values:
+                        yield value
+            # consume buffer
+            while buffer:
                 new_timeout = countdown.check()
-                for value in future.collect(new_timeout):
+                values = buffer[0].collect(new_timeout)
+                buffer.popleft()
+                for value in values:
                     yield value
-        # consume buffer
-        for future in buffer:
-            new_timeout = countdown.check()
-            for value in future.collect(new_timeout):
-                yield value
+        finally:
+            self._cancel_futures(buffer)
 
     def _map_lazy_chunked_unordered(self, target, iterable, chunk_size,
                                     buffer_size, timeout):
         countdown = misc.Countdown(timeout)
+        sizer = chunk_size if isinstance(chunk_size, misc.ChunkSizer) else None
         future_filter = FutureFilter()
-        for i, subtask in enumerate(misc.split_starmap_task(target,
-                                                            iterable,
-                                                            chunk_size=chunk_size)):
-            future = self._submit_task(subtask)
-            future_filter.put(future)
-            if i >= buffer_size - 1:
-                new_timeout = countdown.check()
-                future = future_filter.get(timeout=new_timeout)
+        try:
+            for i, subtask in enumerate(misc.split_starmap_task(target,
+                                                                iterable,
+                                                                chunk_size=chunk_size)):
+                future = self._submit_task(subtask)
+                future_filter.put(future)
+                if i >= buffer_size - 1:
+                    new_timeout = countdown.check()
+                    future = future_filter.get(timeout=new_timeout)
+                    values = future.collect()
+                    if sizer is not None:
+                        sizer.observe(future)
+                    for value in values:
+                        yield value
+            new_timeout = countdown.check()
+            for future in future_filter.get_all(timeout=new_timeout):
                 for value in future.collect():
                     yield value
-        new_timeout = countdown.check()
-        for future in future_filter.get_all(timeout=new_timeout):
-            for value in future.collect():
-                yield value
+        finally:
+            self._cancel_futures(future_filter.futures)
 
     def _map_eager(self, target, iterable, keep_order, timeout):
-        futures = [self._submit_task(target, *args) for args in iterable]
-        return _collect_results(futures, keep_order=keep_order, timeout=timeout)
+        job = MapJob(self, keep_order=keep_order, timeout=timeout)
+        self._join_inactive_workers()
+        for args in iterable:
+            self._enqueue_job_task(job, target, args)
+        job._seal()
+        return job
 
     def _map_eager_chunked(self, target, iterable, chunk_size,
                            keep_order, timeout):
-        futures = list()
-        for subtask in misc.split_starmap_task(target, iterable,
-                                               chunk_size=chunk_size):
-            future = self._submit_task(subtask)
-            futures.append(future)
-        return _collect_batched_results(futures, timeout=timeout,
-                                        keep_order=keep_order)
+        job = MapJob(self, keep_order=keep_order, timeout=timeout,
+                     chunked=True)
+        self._join_inactive_workers()
+        for chunk in misc.get_chunks(iterable, chunk_size):
+            subtask = misc.get_subtask(target, chunk)
+            self._enqueue_job_task(job, subtask, tuple(), size=len(chunk))
+        job._seal()
+        return job
+
+    def _map_eager_auto(self, target, iterable, keep_order, timeout):
+        # the chunk size settles on the first chunks (the probes). A probe
+        # is in flight per worker so that no worker idles meanwhile, and
+        # the pool lock isn't held while waiting for them
+        job = MapJob(self, keep_order=keep_order, timeout=timeout,
+                     chunked=True)
+        countdown = misc.Countdown(timeout)
+        sizer = misc.ChunkSizer()
+        chunks = misc.get_chunks(iterable, sizer)
+        done_queue = SimpleQueue()
+        probes = dict()  # task_id: (future, job task) of the probes in flight
+        while not sizer.is_settled:
+            while len(probes) < self._max_workers:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                subtask = misc.get_subtask(target, chunk)
+                with self._pool_lock:
+                    future = self._submit_task(subtask)
+                    task = job._add_task(future.task_id, size=len(chunk))
+                # cancelling the job cancels the probes too
+                job._link_future(future)
+                future.add_callbacks((task.copy_outcome, done_queue.put))
+                probes[future.task_id] = (future, task)
+            if not probes:
+                break
+            try:
+                future = done_queue.get(timeout=countdown.check())
+            except EmptyQueueError as e:
+                # the job can't make it in time, the probes in flight are
+                # cancelled, the remaining chunks aren't enqueued and the
+                # job raises TimeoutError
+                for future, task in probes.values():
+                    future.cancel()
+                    try:
+                        task.set_exception(TimeoutError())
+                    except errors.InvalidStateError as e:
+                        pass  # the probe is done meanwhile
+                task = job._add_task(None, size=0)
+                task.set_exception(TimeoutError())
+                job._seal()
+                return job
+            del probes[future.task_id]
+            sizer.observe(future)
+        with self._pool_lock:
+            self._join_inactive_workers()
+            for chunk in chunks:
+                subtask = misc.get_subtask(target, chunk)
+                self._enqueue_job_task(job, subtask, tuple(), size=len(chunk))
+        job._seal()
+        return job
 
     def _filter_tasks(self):
-        while True:
-            task = self._task_queue.get(block=True, timeout=None)
-            if task is None:
-                break
-            future, target, args, kwargs = task
-            if future.cancel_flag:
-                future.set_status(Status.CANCELLED)
-                with self._futures_lock:
-                    del self._stored_futures[future.task_id]
-                continue
-            task = (future.task_id, target, args, kwargs)
-            self._mp_task_queue.put(task, block=True, timeout=None)
+        is_running = True
+        while is_running:
+            tasks = self._get_task_batch()
+            batch = list()
+            for task in tasks:
+                if task is None:
+                    is_running = False
+                    break
+                future, target, args, kwargs = task
+                if future.cancel_flag:
+                    future.set_status(Status.CANCELLED)
+                    with self._futures_lock:
+                        del self._stored_futures[future.task_id]
+                    continue
+                task = (future.task_id, target, args, kwargs)
+                try:
+                    task = self._prepare_task(task)
+                except Exception as e:
+                    # the task can't be encoded
+                    with self._futures_lock:
+                        del self._stored_futures[future.task_id]
+                    future.set_exception(e)
+                    continue
+                batch.append(task)
+            if batch:
+                # a batch is sent as a list, a lone task as a tuple
+                item = batch[0] if len(batch) == 1 else batch
+                self._mp_task_queue.put(item, block=True, timeout=None)
+            self._on_tasks_filtered(len(tasks) if is_running else len(tasks) - 1)
             # delete references to objects as they might be holden
             # for too long because self._tasks_queue.get is a blocking call
-            del task, future, target, args, kwargs
+            del tasks, batch
+            task = future = target = args = kwargs = item = None
+
+    def _on_tasks_filtered(self, n):
+        # called by the filter thread once the 'n' tasks it took
+        # from the task queue are sent to workers (or dropped)
+        pass
+
+    def _get_task_batch(self):
+        task = self._task_queue.get(block=True, timeout=None)
+        tasks = [task]
+        if task is None or self._task_batch_size < 2:
+            return tasks
+        # the pending tasks are shared among workers so that
+        # a single batch doesn't starve the other workers
+        n = (self._task_queue.qsize() + 1) / self._max_workers
+        n = min(self._task_batch_size, math.ceil(n))
+        while len(tasks) < n:
+            try:
+                task = self._task_queue.get_nowait()
+            except EmptyQueueError:
+                break
+            tasks.append(task)
+            if task is None:
+                break
+        return tasks
 
     def _on_worker_shutdown(self, worker_id):
         with self._workers_lock:
@@ -734,6 +1305,7 @@ class Pool(ABC):
             else:
                 self._inactive_workers.append(worker)
                 del self._workers[worker_id]
+                self._n_workers -= 1
         if not self._is_closed.is_set():
             self._spawn_workers()
 
@@ -746,6 +1318,7 @@ class Pool(ABC):
             else:
                 self._inactive_workers.append(worker)
                 del self._workers[worker_id]
+                self._n_workers -= 1
         with self._vars_lock:
             if self._stored_exception is None:
                 self._cancel_tasks()
@@ -794,12 +1367,13 @@ class Pool(ABC):
         tasks = list()
         task_ids = list()
         futures = list()
-        for task in misc.iterate_queue(self._mp_task_queue):
-            if task is None:
+        for item in misc.iterate_queue(self._mp_task_queue):
+            if item is None:
                 continue
-            task_id, target, args, kwargs = task
-            task_ids.append(task_id)
-            tasks.append((target, args, kwargs))
+            for task in (item if isinstance(item, list) else (item, )):
+                task_id, target, args, kwargs = task
+                task_ids.append(task_id)
+                tasks.append((target, args, kwargs))
         with self._futures_lock:
             for task_id in task_ids:
                 try:
@@ -865,18 +1439,10 @@ class Pool(ABC):
         self.shutdown()
 
     def __del__(self):
-        self.shutdown()
-
-
-def _collect_batched_results(futures, keep_order=True, timeout=None):
-    for future in as_done(futures, keep_order=keep_order, timeout=timeout):
-        for value in future.collect():
-            yield value
-
-
-def _collect_results(futures, keep_order=True, timeout=None):
-    for future in as_done(futures, keep_order=keep_order, timeout=timeout):
-        yield future.collect()
+        # the initialization might have failed (e.g., invalid arguments)
+        # before the pool got anything to shut down
+        if hasattr(self, "_is_closed"):
+            self.shutdown()
 
 
 class GlobalShutdown:
@@ -932,6 +1498,14 @@ class GlobalShutdown:
             return tuple(cls._handlers)
 
 
+class _FeederEnd:
+    """Sent by the feeder thread of a lazy Map operation once
+    the input is exhausted or when an exception occurred"""
+    def __init__(self, n_submitted, exc=None):
+        self.n_submitted = n_submitted
+        self.exc = exc
+
+
 def global_shutdown_runner():
     """Join the main thread then run the shutdown handlers registered by pools.
     Note that the main thread can only be joined when it stops."""
@@ -2,11 +2,19 @@
 TripleProcessPool, and QuadProcessPool are defined here"""
 import sys
 import threading
+import time
 import queue
+from multiprocessing.connection import wait as wait_connections
 from asyncpal import errors
 from asyncpal import misc
-from asyncpal.future import Status
-from asyncpal.worker.processworker import ProcessWorker, MessageTag
+from asyncpal.future import Future, Status, LazyResult
+from asyncpal.transport import (PipeReader, PipeWriter, RingReader,
+                                RingWriter, Ring, RING_SIZE, PipeDispatcher,
+                                PipeSelector, spill_payload, load_payload,
+                                release_segments, expose_buffers)
+from asyncpal.serializer import PickleSerializer
+from asyncpal.worker.processworker import (ProcessWorker, MessageTag,
+                                           STARTING)
 from asyncpal.pool import Pool, WorkerType, IDLE_TIMEOUT, MP_CONTEXT, WINDOWS_MAX_PROCESS_WORKERS
 
 
@@ -14,12 +22,25 @@ __all__ = ["ProcessPool", "SingleProcessPool", "DualProcessPool",
            "TripleProcessPool", "QuadProcessPool"]
 
 
+# number of slots of the table that tells workers which tasks are cancelled
+CANCEL_TABLE_SIZE = 4096
+
+# consecutive crashes of starting workers after which the pool gets broken
+MAX_STARTUP_CRASHES = 3
+
+
 class ProcessPool(Pool):
     """The ProcessPool class for parallelism."""
     def __init__(self, max_workers=None, *, name="ProcessPool",
                  idle_timeout=IDLE_TIMEOUT, initializer=None, init_args=None,
                  init_kwargs=None, finalizer=None, final_args=None,
-                 final_kwargs=None, max_tasks_per_worker=None, mp_context=None):
+                 final_kwargs=None, max_tasks_per_worker=None, mp_context=None,
+                 notify_running=True, result_batch_size=64,
+                 result_flush_interval=0.01, task_batch_size=64,
+                 transport="queue", shm_threshold=None, serializer=None,
+                 serialize_on_submit=False, lazy_results=False,
+                 message_threads=1, direct_dispatch=False, prefetch=None,
+                 task_timeout=None, crash_retries=0, ring_size=RING_SIZE):
         """
         Initialization.
 
@@ -42,6 +63,111 @@ class ProcessPool(Pool):
             before it closes.
         - mp_context: the multiprocessing context.
             Defaults to multiprocessing.get_context("spawn")
+        - notify_running: whether workers should send a message when a task
+            starts running. When set to False, the Status.RUNNING of a future
+            is only set right before its result, and durations stay accurate
+            since result messages carry the start instant
+        - result_batch_size: max number of results a worker buffers before
+            sending them to the pool as a single message. Set it to 1 to
+            disable batching. A worker always sends its buffered results
+            before it waits for new tasks
+        - result_flush_interval: None or the max time in seconds a result
+            can wait in the buffer of a worker. Anyway, the buffer is
+            flushed when it is full and before the worker waits for a task
+        - task_batch_size: max number of pending tasks sent at once to a worker.
+            A batch takes at most a 1/max_workers share of the pending tasks.
+            Set it to 1 to disable batching. Batching is always disabled
+            when max_tasks_per_worker is set
+        - transport: either "queue" or "pipe". With "queue", workers share
+            a multiprocessing Queue for tasks and a SimpleQueue for messages.
+            With "pipe", each worker gets its own pipes: the pool sends each
+            task (or batch) to the worker with the fewest outstanding ones
+            and a single thread waits on all message pipes. This avoids
+            the cross-process locks of shared queues with many workers.
+            The "shm" transport works like "pipe" but payloads are written
+            in shared memory rings (one per direction and per worker) and
+            the pipes only carry small notices. A payload that doesn't fit
+            in the free space of a ring is sent through the pipe.
+            Requires Python 3.8 or newer
+        - shm_threshold: None or a size in bytes. Top-level task arguments
+            and results that are bytes, bytearray, or contiguous memoryview
+            objects of at least this size are copied in a shared memory
+            segment, and only a handle is sent to the other side.
+            A memoryview argument is mapped on the shared memory (zero-copy)
+            while the task runs. Other payloads are copied once out of
+            the shared memory. Segments of arguments are released when
+            the future is done. Requires Python 3.8 or newer
+        - serializer: None or an instance of asyncpal.Serializer
+            (e.g., PickleSerializer or CloudpickleSerializer).
+            When set, tasks, results, exceptions, and the initializer
+            and finalizer of workers are encoded with this serializer
+            before being put in the queues. Buffers aren't sent out-of-band
+        - serialize_on_submit: bool. When True, a task is encoded by the
+            thread that calls `submit` or `submit_many` instead of the
+            filter thread, so that the encoding cost is spread among
+            the submitting threads and an error is raised from `submit`.
+            Defaults to a PickleSerializer when 'serializer' is None.
+            When 'shm_threshold' is set, the encoded task is spilled
+            as a whole. Tasks created by map methods are still encoded
+            by the filter thread
+        - lazy_results: bool. When True, the message thread stores the
+            serialized result in the future, and the result is decoded
+            on first access (`collect` or the `result` property) in the
+            thread of the reader. Defaults to a PickleSerializer when
+            'serializer' is None. Results of map methods, and results
+            spilled in shared memory (see 'shm_threshold'), are still
+            decoded by the message thread
+        - message_threads: number of threads that consume the messages of
+            workers (decoding results, updating futures, and running
+            callbacks). With the "queue" transport, the threads share
+            the message queue. With the "pipe" and "shm" transports,
+            each thread waits on the pipes of its own subset of workers.
+            Defaults to 1
+        - direct_dispatch: bool. When True, `submit` and `run` send the
+            task right away to the workers (skipping the filter thread)
+            if the filter thread holds no task and the transport has free
+            capacity. The task is encoded by the submitting thread.
+            With the "pipe" and "shm" transports, the task is written to
+            the pipe of an idle worker by the submitting thread, so that
+            a large task can't block it behind a busy worker. Otherwise,
+            or for tasks created by map methods, the filter thread
+            sends the task
+        - prefetch: None, an int, or "auto". Number of items (a task or
+            a batch of tasks, see 'task_batch_size') that each worker may
+            hold on top of the one it runs. With 0, a worker only gets an
+            item when it is free, which avoids queuing work behind a slow
+            task ("pipe" and "shm" transports only, since the shared
+            queue always holds an item). Larger values keep workers busy
+            with tiny tasks.
+            With "auto", the depth follows the durations of tasks so that
+            each worker holds a few milliseconds of work ("pipe" and "shm"
+            transports only). Defaults to None, that is 1 item per worker
+        - task_timeout: None or a duration in seconds. A worker that runs
+            a task for longer is killed and replaced: the future of this
+            task fails with TimeoutError, and the other tasks the worker
+            held are sent to other workers. The pool doesn't get broken.
+            Requires the "pipe" or "shm" transport, since killing a worker
+            that shares queues with other workers could corrupt them
+        - crash_retries: number of times the task run by a worker that
+            died unexpectedly (e.g., killed by the OOM killer, segfault,
+            or os._exit) is sent again to a worker, before its future
+            fails with WorkerCrashError. With the "pipe" and "shm"
+            transports, the death is noticed as soon as the message pipe
+            of the worker gets closed: the worker is replaced and its other
+            tasks are sent to other workers. With the "queue" transport,
+            a watchdog thread waits on the process sentinels, and since
+            the crashed worker might hold the locks of the shared queues,
+            the task fails and the pool gets broken. Thus, crash_retries
+            requires the "pipe" or "shm" transport. A worker that dies
+            before it is ready (e.g., in the initializer) is replaced
+            with any transport, unless more than MAX_STARTUP_CRASHES
+            workers die this way in a row, which breaks the pool.
+            Defaults to 0
+        - ring_size: size in bytes of each shared memory ring of the
+            "shm" transport (two rings per worker). Rings are mapped in
+            /dev/shm on Linux, which is often small (64 MiB by default
+            in Docker): a full /dev/shm makes a process crash with SIGBUS
+            instead of raising an error. Defaults to 2 MiB
         """
         if max_workers:
             if sys.platform == "win32" and max_workers > WINDOWS_MAX_PROCESS_WORKERS:
@@ -53,8 +179,40 @@ class ProcessPool(Pool):
         worker_type = WorkerType.PROCESS
         mp_context = MP_CONTEXT if mp_context is None else mp_context
         task_queue = queue.SimpleQueue()
-        mp_task_queue = mp_context.Queue(maxsize=max_workers+1)
-        message_queue = mp_context.SimpleQueue()
+        message_threads = max(message_threads, 1)
+        if prefetch == "auto" and transport == "queue":
+            msg = 'prefetch="auto" requires the "pipe" or "shm" transport'
+            raise ValueError(msg)
+        if prefetch == 0 and transport == "queue":
+            # the shared queue always holds at least one item
+            msg = 'prefetch=0 requires the "pipe" or "shm" transport'
+            raise ValueError(msg)
+        if task_timeout is not None and transport == "queue":
+            msg = 'task_timeout requires the "pipe" or "shm" transport'
+            raise ValueError(msg)
+        if crash_retries and transport == "queue":
+            msg = 'crash_retries requires the "pipe" or "shm" transport'
+            raise ValueError(msg)
+        # items a worker may hold, including the one it runs
+        max_outstanding = (2 if prefetch in (None, "auto")
+                           else max(prefetch, 0) + 1)
+        if transport == "queue":
+            # the shared queue holds the prefetched items of all workers
+            maxsize = max_workers * (max_outstanding - 1) + 1
+            mp_task_queue = mp_context.Queue(maxsize=maxsize)
+            # message threads share the message queue
+            message_queue = mp_context.SimpleQueue()
+            message_queues = [message_queue] * message_threads
+        elif transport in ("pipe", "shm"):
+            mp_task_queue = PipeDispatcher(max_workers, max_outstanding,
+                                           adaptive=prefetch == "auto")
+            # a selector per message thread, workers are spread among them
+            message_queues = [PipeSelector(mp_context)
+                              for _ in range(message_threads)]
+            message_queue = message_queues[0]
+        else:
+            msg = "Unknown transport: {}".format(transport)
+            raise ValueError(msg)
         super().__init__(worker_type, max_workers=max_workers, name=name,
                          idle_timeout=idle_timeout,
                          initializer=initializer, init_args=init_args,
@@ -63,49 +221,591 @@ class ProcessPool(Pool):
                          max_tasks_per_worker=max_tasks_per_worker,
                          task_queue=task_queue, mp_task_queue=mp_task_queue,
                          message_queue=message_queue, mp_context=mp_context)
+        self._notify_running = notify_running
+        self._result_batch_size = max(result_batch_size, 1)
+        self._result_flush_interval = result_flush_interval
+        self._task_batch_size = 1 if max_tasks_per_worker else max(task_batch_size, 1)
+        self._transport = transport
+        self._shm_threshold = shm_threshold
+        if (serialize_on_submit or lazy_results) and serializer is None:
+            serializer = PickleSerializer()
+        self._serializer = serializer
+        self._serialize_on_submit = serialize_on_submit
+        self._lazy_results = lazy_results
+        self._direct_dispatch = direct_dispatch
+        # tasks in the task queue or held by the filter thread
+        self._n_filtered_tasks = 0
+        self._filter_lock = threading.Lock()
+        self._prefetch = prefetch
+        self._task_timeout = task_timeout
+        self._supervisor_thread = None
+        self._supervisor_event = threading.Event()
+        self._crash_retries = max(crash_retries, 0)
+        self._ring_size = ring_size
+        # crashes per task_id, updated by the message threads, the watchdog
+        # and the supervisor. A lock of its own is used since join and
+        # shutdown hold the pool lock while the message threads drain results
+        self._crash_counts = dict()
+        self._crash_lock = threading.Lock()
+        self._startup_crashes = 0
+        # workers being replaced by the supervisor or after a crash
+        self._dying_workers = set()
+        self._watchdog_thread = None
+        self._watchdog_event = threading.Event()
+        self._watchdog_reader = self._watchdog_writer = None
+        # a cancelled task has its id written in the slot
+        # task_id % CANCEL_TABLE_SIZE, workers skip it
+        self._cancel_table = mp_context.RawArray("Q", CANCEL_TABLE_SIZE)
+        self._message_threads = list()
+        self._message_queues = message_queues
+        self._shared_segments = dict()
         self._spawn_filter_thread()
         self._spawn_message_thread()
+        if task_timeout is not None:
+            self._spawn_supervisor_thread()
+        if transport == "queue":
+            # with per-worker pipes, the EOF of the message
+            # pipe of a worker already tells that it died
+            self._spawn_watchdog_thread()
+
+    @property
+    def notify_running(self):
+        return self._notify_running
+
+    @property
+    def result_batch_size(self):
+        return self._result_batch_size
+
+    @property
+    def result_flush_interval(self):
+        return self._result_flush_interval
+
+    @property
+    def task_batch_size(self):
+        return self._task_batch_size
+
+    @property
+    def transport(self):
+        return self._transport
+
+    @property
+    def shm_threshold(self):
+        return self._shm_threshold
+
+    @property
+    def serializer(self):
+        return self._serializer
+
+    @property
+    def serialize_on_submit(self):
+        return self._serialize_on_submit
+
+    @property
+    def lazy_results(self):
+        return self._lazy_results
+
+    @property
+    def message_threads(self):
+        return len(self._message_queues)
+
+    @property
+    def direct_dispatch(self):
+        return self._direct_dispatch
+
+    @property
+    def prefetch(self):
+        return self._prefetch
+
+    @property
+    def task_timeout(self):
+        return self._task_timeout
+
+    @property
+    def crash_retries(self):
+        return self._crash_retries
+
+    @property
+    def ring_size(self):
+        return self._ring_size
 
     def _create_worker(self):
         worker_id = self._monotonic_worker_count
         worker_name = "asyncpal-{}-process-worker-{}".format(self._name, worker_id)
+        task_queue, message_queue = self._mp_task_queue, self._message_queue
+        if self._transport != "queue":
+            task_queue, message_queue = self._create_worker_pipes(worker_id)
+        # the id and start instant of the running task, and the state
+        running_slot = self._mp_context.RawArray("d", 3)
         with self._vars_lock:
-            worker = ProcessWorker(worker_id, worker_name, self._mp_task_queue,
-                                   self._message_queue,
+            worker = ProcessWorker(worker_id, worker_name, task_queue,
+                                   message_queue,
                                    self._idle_timeout, self._initializer,
                                    self._init_args, self._init_kwargs,
                                    self._finalizer, self._final_args,
                                    self._final_kwargs,
                                    self._max_tasks_per_worker,
-                                   self._mp_context)
+                                   self._busy_counter, self._mp_context,
+                                   self._notify_running,
+                                   self._result_batch_size,
+                                   self._result_flush_interval,
+                                   self._shm_threshold,
+                                   self._serializer,
+                                   self._cancel_table,
+                                   running_slot)
             return worker
 
+    def _create_worker_pipes(self, worker_id):
+        task_reader, task_writer = self._mp_context.Pipe(duplex=False)
+        message_reader, message_writer = self._mp_context.Pipe(duplex=False)
+        if self._transport == "shm":
+            task_ring = Ring(self._ring_size)
+            message_ring = Ring(self._ring_size)
+            task_reader = RingReader(task_reader, task_ring)
+            task_writer = RingWriter(task_writer, task_ring)
+            message_reader = RingReader(message_reader, message_ring)
+            message_writer = RingWriter(message_writer, message_ring)
+        else:
+            task_reader, task_writer = PipeReader(task_reader), PipeWriter(task_writer)
+            message_reader = PipeReader(message_reader)
+            message_writer = PipeWriter(message_writer)
+        self._mp_task_queue.register(worker_id, task_writer)
+        n = len(self._message_queues)
+        # the pool is told when the pipe gets closed, after its last message
+        eof_message = (MessageTag.CLOSED, worker_id)
+        self._message_queues[worker_id % n].register(message_reader,
+                                                     eof_message)
+        return task_reader, message_writer
+
+    def _on_worker_shutdown(self, worker_id):
+        if self._transport != "queue":
+            # tasks sent to this worker but not done are put back
+            # in the task queue before new workers get spawned
+            tasks = self._mp_task_queue.unregister(worker_id)
+            self._requeue_tasks(tasks)
+        super()._on_worker_shutdown(worker_id)
+        self._dying_workers.discard(worker_id)
+
+    def _on_worker_exception(self, worker_id, exc):
+        if self._transport != "queue":
+            # the pool is broken, tasks sent to this worker get cancelled
+            tasks = self._mp_task_queue.unregister(worker_id)
+            self._cancel_unregistered_tasks(tasks)
+        super()._on_worker_exception(worker_id, exc)
+        self._dying_workers.discard(worker_id)
+
+    def _on_worker_exit(self, worker_id):
+        # the message pipe of a worker got closed. Unless the worker
+        # sent SHUTDOWN or WORKER_EXCEPTION, it died unexpectedly
+        with self._workers_lock:
+            worker = self._workers.get(worker_id)
+            if worker is None or worker_id in self._dying_workers:
+                return
+            self._dying_workers.add(worker_id)
+        self._on_worker_crash(worker)
+
+    def _on_worker_crash(self, worker):
+        worker.join()
+        worker_id = worker.worker_id
+        exitcode = worker.process.exitcode
+        task_id, _, state = worker.running_slot
+        task_id = int(task_id)
+        if state == STARTING:
+            if self._count_startup_crash() > MAX_STARTUP_CRASHES:
+                # the initializer keeps crashing the new workers
+                msg = "Worker {} died before it was ready (exit code {})".format(worker_id, exitcode)
+                self._on_worker_exception(worker_id, errors.WorkerCrashError(msg))
+            else:
+                # the worker didn't touch the queues yet, even the shared
+                # ones, thus it is replaced whatever the transport
+                self._on_worker_shutdown(worker_id)
+            return
+        with self._crash_lock:
+            self._startup_crashes = 0
+        if task_id:
+            self._fail_crashed_task(task_id, exitcode)
+        if self._transport == "queue":
+            # the crashed worker might hold the locks of the shared queues
+            msg = "Worker {} died unexpectedly (exit code {})".format(worker_id, exitcode)
+            self._on_worker_exception(worker_id, errors.WorkerCrashError(msg))
+        else:
+            # the other tasks of the worker (and the crashed task if it
+            # is retried) are requeued and a new worker is spawned
+            self._on_worker_shutdown(worker_id)
+
+    def _count_startup_crash(self):
+        # crashes of starting workers are counted until
+        # a worker is known to have completed its startup
+        with self._workers_lock:
+            is_started = any(worker.running_slot[2] != STARTING
+                             for worker in self._workers.values())
+        with self._crash_lock:
+            if is_started:
+                self._startup_crashes = 0
+            self._startup_crashes += 1
+            return self._startup_crashes
+
+    def _fail_crashed_task(self, task_id, exitcode):
+        with self._crash_lock:
+            count = self._crash_counts.get(task_id, 0) + 1
+            if count <= self._crash_retries:
+                self._crash_counts[task_id] = count
+                return
+            self._crash_counts.pop(task_id, None)
+        with self._futures_lock:
+            future = self._stored_futures.pop(task_id, None)
+        if future is None:
+            return
+        msg = "The worker running this task died unexpectedly (exit code {})".format(exitcode)
+        future.set_exception(errors.WorkerCrashError(msg))
+        self._release_shared_segments(task_id)
+
+    def _count_pending_tasks(self):
+        n = super()._count_pending_tasks()
+        if self._transport != "queue":
+            # running tasks are still outstanding in the dispatcher
+            n = max(0, n - self._get_busy_count())
+        return n
+
+    def _requeue_tasks(self, tasks):
+        # encoded tasks are put back as is
+        for task_id, target, args, kwargs in tasks:
+            with self._futures_lock:
+                future = self._stored_futures.get(task_id)
+            if future is not None:
+                with self._filter_lock:
+                    self._n_filtered_tasks += 1
+                self._task_queue.put((future, target, args, kwargs))
+
+    def _cancel_unregistered_tasks(self, tasks):
+        with self._futures_lock:
+            for task in tasks:
+                task_id, target, args, kwargs = self._restore_task(task)
+                future = self._stored_futures.pop(task_id, None)
+                if future is None:
+                    continue
+                future.set_status(Status.CANCELLED)
+                self._cancelled_tasks.append((target, args, kwargs))
+                segments = self._shared_segments.pop(task_id, None)
+                if segments:
+                    release_segments(segments, unlink=True)
+
+    def _submit_single(self, target, args, kwargs):
+        if not self._direct_dispatch:
+            return super()._submit_single(target, args, kwargs)
+        with self._pool_lock:
+            self._join_inactive_workers()
+            self._monotonic_task_count += 1
+            future = Future(self, self._monotonic_task_count)
+            future.set_status(Status.PENDING)
+        with self._futures_lock:
+            self._stored_futures[future.task_id] = future
+        # the task is prepared out of the pool lock, by the submitting thread
+        try:
+            task = self._prepare_task((future.task_id, target, args, kwargs))
+        except BaseException as e:
+            with self._futures_lock:
+                del self._stored_futures[future.task_id]
+            raise e
+        # the task can't overtake the tasks queued or held by the filter
+        # thread. The tasks that this thread submitted earlier are counted
+        # until they are sent, so a stale count can't reorder them
+        is_sent = False
+        if not self._n_filtered_tasks:
+            try:
+                self._mp_task_queue.put(task, block=False)
+            except queue.Full:
+                pass
+            else:
+                is_sent = True
+        if not is_sent:
+            # no free capacity, the filter thread will send the task.
+            # Note that preparing a prepared task changes nothing
+            self._put_task(future, *task[1:])
+        # cheap check (no lock) to skip spawn decisions once the pool is full
+        if self._n_workers < self._max_workers:
+            self._spawn_workers()
+        return future
+
+    def _put_task(self, future, target, args, kwargs):
+        with self._filter_lock:
+            self._n_filtered_tasks += 1
+        super()._put_task(future, target, args, kwargs)
+
+    def _on_tasks_filtered(self, n):
+        with self._filter_lock:
+            self._n_filtered_tasks -= n
+
+    def _propagate_cancel(self, obj):
+        # 'obj' is either a Future or a MapJob. Tasks that reached
+        # the workers are skipped by the workers, the other ones
+        # are still cancelled by the filter thread
+        with self._futures_lock:
+            if isinstance(obj, Future):
+                future = self._stored_futures.get(obj.task_id)
+                task_ids = (obj.task_id, ) if future is obj else tuple()
+            else:
+                task_ids = [task_id for task_id, x
+                            in self._stored_futures.items()
+                            if getattr(x, "_job", None) is obj]
+        for task_id in task_ids:
+            self._cancel_table[task_id % CANCEL_TABLE_SIZE] = task_id
+
+    def _encode_task(self, target, args, kwargs):
+        # called by the submitting thread
+        if not self._serialize_on_submit:
+            return target, args, kwargs
+        payload = self._serializer.dumps((target, args, kwargs))
+        return None, payload, None
+
+    def _prepare_task(self, task):
+        # called by the filter thread
+        task_id, target, args, kwargs = task
+        if target is None:
+            # already encoded, the payload itself might be spilled
+            if self._shm_threshold is not None:
+                segments = list()
+                args = spill_payload(args, self._shm_threshold, segments)
+                if segments:
+                    with self._futures_lock:
+                        x = self._shared_segments.setdefault(task_id, list())
+                        x.extend(segments)
+            return task_id, None, args, None
+        if self._shm_threshold is not None:
+            segments = list()
+            args = tuple(spill_payload(x, self._shm_threshold, segments)
+                         for x in args)
+            kwargs = {k: spill_payload(v, self._shm_threshold, segments)
+                      for k, v in kwargs.items()}
+            if segments:
+                with self._futures_lock:
+                    self._shared_segments[task_id] = segments
+        if self._serializer is not None:
+            try:
+                payload = self._serializer.dumps((target, args, kwargs))
+            except BaseException as e:
+                self._release_shared_segments(task_id)
+                raise e
+            return task_id, None, payload, None
+        if self._transport != "queue":
+            # per-worker pipes can carry out-of-band buffers
+            args = expose_buffers(args)
+            kwargs = {k: expose_buffers(v) for k, v in kwargs.items()}
+            if misc.is_subtask(target):
+                # the args of a chunked map are held by the subtask
+                target = self._expose_subtask_buffers(target)
+        return task_id, target, args, kwargs
+
+    def _expose_subtask_buffers(self, subtask):
+        target, chunk = subtask.args
+        exposed = tuple(expose_buffers(args) for args in chunk)
+        for x, y in zip(chunk, exposed):
+            if x is not y:
+                return misc.get_subtask(target, exposed)
+        return subtask
+
+    def _restore_task(self, task):
+        # reverse the encoding done by _prepare_task
+        if self._serializer is None:
+            return task
+        task_id, _, payload, _ = task
+        target, args, kwargs = self._decode_payload(payload)
+        return task_id, target, args, kwargs
+
+    def _decode_payload(self, payload):
+        # decode a task for the cancelled_tasks property. A task that
+        # can't be decoded is kept encoded, with None as target
+        try:
+            return self._serializer.loads(load_payload(payload))
+        except Exception as e:
+            return None, payload, None
+
+    def _drain_task_queue(self):
+        tasks, futures = super()._drain_task_queue()
+        if self._serializer is not None:
+            # tasks encoded on submit, or requeued after
+            # the shutdown of a worker, are still encoded
+            tasks = [task if task[0] is not None
+                     else self._decode_payload(task[1]) for task in tasks]
+        return tasks, futures
+
+    def _drain_mp_task_queue(self):
+        tasks, futures = super()._drain_mp_task_queue()
+        if self._serializer is not None:
+            tasks = [self._decode_payload(args) for _, args, _ in tasks]
+        return tasks, futures
+
+    def _release_shared_segments(self, task_id=None):
+        with self._futures_lock:
+            if task_id is None:
+                segments = list()
+                for x in self._shared_segments.values():
+                    segments.extend(x)
+                self._shared_segments = dict()
+            else:
+                segments = self._shared_segments.pop(task_id, None)
+        if segments:
+            release_segments(segments, unlink=True)
+
+    def _cleanup_stored_futures(self):
+        super()._cleanup_stored_futures()
+        self._release_shared_segments()
+
+    def _spawn_supervisor_thread(self):
+        thread_name = "asyncpal-{}-SupervisorThread".format(self._name)
+        self._supervisor_thread = threading.Thread(name=thread_name,
+                                                   target=self._supervise_workers,
+                                                   daemon=True)
+        self._supervisor_thread.start()
+
+    def _shutdown_supervisor_thread(self):
+        self._supervisor_event.set()
+        self._supervisor_thread.join()
+        self._supervisor_thread = None
+
+    def _supervise_workers(self):
+        # special loop working inside a thread to kill
+        # the workers whose task exceeds the task_timeout
+        interval = min(max(self._task_timeout / 4, 0.001), 0.1)
+        while not self._supervisor_event.wait(interval):
+            with self._workers_lock:
+                workers = tuple(self._workers.values())
+            now = time.monotonic()
+            for worker in workers:
+                # the id is read before the start instant
+                task_id = int(worker.running_slot[0])
+                start_instant = worker.running_slot[1]
+                if task_id and now - start_instant > self._task_timeout:
+                    self._expire_task(worker, task_id)
+
+    def _expire_task(self, worker, task_id):
+        with self._workers_lock:
+            if worker.worker_id in self._dying_workers:
+                return
+            self._dying_workers.add(worker.worker_id)
+        worker.kill()
+        worker.join()
+        with self._futures_lock:
+            future = self._stored_futures.pop(task_id, None)
+        if future is not None:
+            # the future is claimed, its result can't be set meanwhile
+            msg = "Task exceeded the task_timeout of {} seconds".format(self._task_timeout)
+            future.set_exception(TimeoutError(msg))
+            self._release_shared_segments(task_id)
+        # the other tasks of the worker are requeued
+        # and a new worker is spawned
+        self._on_worker_shutdown(worker.worker_id)
+
+    def _spawn_watchdog_thread(self):
+        # the pipe wakes the watchdog up to wait on new sentinels
+        pipe = self._mp_context.Pipe(duplex=False)
+        self._watchdog_reader, self._watchdog_writer = pipe
+        thread_name = "asyncpal-{}-WatchdogThread".format(self._name)
+        self._watchdog_thread = threading.Thread(name=thread_name,
+                                                 target=self._watch_workers,
+                                                 daemon=True)
+        self._watchdog_thread.start()
+
+    def _shutdown_watchdog_thread(self):
+        self._watchdog_event.set()
+        self._wake_watchdog()
+        self._watchdog_thread.join()
+        self._watchdog_thread = None
+        self._watchdog_reader.close()
+        self._watchdog_writer.close()
+
+    def _wake_watchdog(self):
+        try:
+            self._watchdog_writer.send_bytes(b"")
+        except OSError as e:
+            pass
+
+    def _watch_workers(self):
+        # special loop working inside a thread to detect the workers
+        # that die without sending SHUTDOWN or WORKER_EXCEPTION
+        exited = set()  # workers whose SHUTDOWN message is on its way
+        while not self._watchdog_event.is_set():
+            with self._workers_lock:
+                workers = {worker.process.sentinel: worker
+                           for worker in self._workers.values()
+                           if worker.worker_id not in exited}
+                exited.intersection_update(self._workers.keys())
+            conns = list(workers.keys())
+            conns.append(self._watchdog_reader)
+            for conn in wait_connections(conns):
+                if conn is self._watchdog_reader:
+                    self._watchdog_reader.recv_bytes()
+                    continue
+                worker = workers[conn]
+                worker.join()
+                if worker.process.exitcode == 0:
+                    exited.add(worker.worker_id)
+                    continue
+                with self._workers_lock:
+                    if (worker.worker_id not in self._workers
+                            or worker.worker_id in self._dying_workers):
+                        continue
+                    self._dying_workers.add(worker.worker_id)
+                self._on_worker_crash(worker)
+
+    def _spawn_workers(self, n=None):
+        n = super()._spawn_workers(n)
+        if n and self._watchdog_thread is not None:
+            # the watchdog waits on the sentinels of new workers too
+            self._wake_watchdog()
+        return n
+
+    def _shutdown_message_thread(self):
+        if self._supervisor_thread is not None:
+            # stopped once workers are joined, so that
+            # a runaway task can't block the shutdown
+            self._shutdown_supervisor_thread()
+        if self._watchdog_thread is not None:
+            self._shutdown_watchdog_thread()
+        # one sentinel per thread
+        for message_queue in self._message_queues:
+            message_queue.put(None)
+        for thread in self._message_threads:
+            thread.join()
+        self._message_threads = list()
+        if self._transport != "queue":
+            for message_queue in self._message_queues:
+                message_queue.close()
+
     def _spawn_message_thread(self):
-        thread_name = "asyncpal-{}-MessageThread".format(self._name)
-        self._message_thread = threading.Thread(name=thread_name,
-                                                target=self._consume_message_queue,
-                                                daemon=False)
-        self._message_thread.start()
+        for i, message_queue in enumerate(self._message_queues):
+            thread_name = "asyncpal-{}-MessageThread".format(self._name)
+            if i:
+                thread_name = "{}-{}".format(thread_name, i)
+            thread = threading.Thread(name=thread_name,
+                                      target=self._consume_message_queue,
+                                      args=(message_queue, ), daemon=False)
+            self._message_threads.append(thread)
+            thread.start()
 
-    def _consume_message_queue(self):
+    def _consume_message_queue(self, message_queue):
         # special loop working inside a thread to support
         # Process Workers by consuming/dispatching the messages
         # they put in the message_queue
         while True:
-            message = self._message_queue.get()
+            message = message_queue.get()
             if message is None:
                 break
             try:
                 tag = message[0]
                 if tag in (MessageTag.RUNNING, MessageTag.RESULT,
-                           MessageTag.EXCEPTION):
+                           MessageTag.EXCEPTION, MessageTag.CANCELLED):
                     self._update_future(message)
+                elif tag == MessageTag.BATCH:
+                    for x in message[1]:
+                        self._update_future(x)
                 elif tag == MessageTag.SHUTDOWN:
                     self._on_worker_shutdown(message[1])
                 elif tag == MessageTag.WORKER_EXCEPTION:
                     worker_id, exc_wrapper = message[1:]
                     exc = exc_wrapper.unwrap()
                     self._on_worker_exception(worker_id, exc)
+                elif tag == MessageTag.CLOSED:
+                    self._on_worker_exit(message[1])
                 else:
                     msg = "Invalid message tag: {}".format(tag)
                     e = errors.Error(msg)
@@ -124,20 +824,68 @@ class ProcessPool(Pool):
         # that works only for Process Workers to dispatch results/notifs
         tag, task_id = message[0:2]
         with self._futures_lock:
-            future = self._stored_futures[task_id]
+            if tag == MessageTag.RUNNING:
+                future = self._stored_futures.get(task_id)
+            else:
+                # the future is claimed before the result gets decoded,
+                # the supervisor or the watchdog might claim it too
+                future = self._stored_futures.pop(task_id, None)
+        if future is None:
+            # with many message threads, a RUNNING message might be
+            # consumed after the result. A timed out task, or the task
+            # of a crashed worker, is already done
+            return
+        duration = None
         if tag == MessageTag.RUNNING:
             instant = message[2]
-            future.set_status(Status.RUNNING, instant)
+            try:
+                future.set_status(Status.RUNNING, instant)
+            except errors.InvalidStateError as e:
+                pass
+        elif tag == MessageTag.CANCELLED:
+            # skipped by the worker
+            future.set_status(Status.CANCELLED)
         elif tag == MessageTag.RESULT:
-            result, instant = message[2:]
-            future.set_result(result, instant)
+            result, start_instant, instant = message[2:]
+            if not self._notify_running:
+                future.set_status(Status.RUNNING, start_instant)
+            try:
+                if self._serializer is not None:
+                    result = self._decode_result(future, result)
+                if self._shm_threshold is not None:
+                    result = load_payload(result, unlink=True)
+            except Exception as e:
+                future.set_exception(e, instant)
+            else:
+                future.set_result(result, instant)
+            duration = instant - start_instant
         elif tag == MessageTag.EXCEPTION:
-            exc_wrapper, instant = message[2:]
-            exc = exc_wrapper.unwrap()
+            exc_wrapper, start_instant, instant = message[2:]
+            if not self._notify_running:
+                future.set_status(Status.RUNNING, start_instant)
+            try:
+                if self._serializer is not None:
+                    exc_wrapper = self._serializer.loads(exc_wrapper)
+                exc = exc_wrapper.unwrap()
+            except Exception as e:
+                exc = e
             future.set_exception(exc, instant)
-        if tag in (MessageTag.RESULT, MessageTag.EXCEPTION):
-            with self._futures_lock:
-                del self._stored_futures[task_id]
+            duration = instant - start_instant
+        if tag != MessageTag.RUNNING:
+            if self._crash_counts:
+                with self._crash_lock:
+                    self._crash_counts.pop(task_id, None)
+            if self._transport != "queue":
+                self._mp_task_queue.task_done(task_id, duration)
+            if self._shared_segments:
+                self._release_shared_segments(task_id)
+
+    def _decode_result(self, future, result):
+        if (self._lazy_results and self._shm_threshold is None
+                and type(future) is Future):
+            # decoded on first access, by the thread of the reader
+            return LazyResult(result, self._serializer.loads)
+        return self._serializer.loads(result)
 
     def __reduce__(self):
         msg = "A pool object cannot be pickled"
@@ -149,7 +897,13 @@ class SingleProcessPool(ProcessPool):
     def __init__(self, *, name="SingleProcessPool",
                  idle_timeout=IDLE_TIMEOUT, initializer=None, init_args=None,
                  init_kwargs=None, finalizer=None, final_args=None,
-                 final_kwargs=None, max_tasks_per_worker=None, mp_context=None):
+                 final_kwargs=None, max_tasks_per_worker=None, mp_context=None,
+                 notify_running=True, result_batch_size=64,
+                 result_flush_interval=0.01, task_batch_size=64,
+                 transport="queue", shm_threshold=None, serializer=None,
+                 serialize_on_submit=False, lazy_results=False,
+                 message_threads=1, direct_dispatch=False, prefetch=None,
+                 task_timeout=None, crash_retries=0, ring_size=RING_SIZE):
         max_workers = 1
         super().__init__(max_workers=max_workers, name=name,
                          idle_timeout=idle_timeout,
@@ -157,7 +911,18 @@ class SingleProcessPool(ProcessPool):
                          init_kwargs=init_kwargs, finalizer=finalizer,
                          final_args=final_args, final_kwargs=final_kwargs,
                          max_tasks_per_worker=max_tasks_per_worker,
-                         mp_context=mp_context)
+                         mp_context=mp_context, notify_running=notify_running,
+                         result_batch_size=result_batch_size,
+                         result_flush_interval=result_flush_interval,
+                         task_batch_size=task_batch_size,
+                         transport=transport, shm_threshold=shm_threshold,
+                         serializer=serializer,
+                         serialize_on_submit=serialize_on_submit,
+                         lazy_results=lazy_results,
+                         message_threads=message_threads,
+                         direct_dispatch=direct_dispatch,
+                         prefetch=prefetch, task_timeout=task_timeout,
+                         crash_retries=crash_retries, ring_size=ring_size)
 
 
 class DualProcessPool(ProcessPool):
@@ -165,7 +930,13 @@ class DualProcessPool(ProcessPool):
     def __init__(self, *, name="DualProcessPool",
                  idle_timeout=IDLE_TIMEOUT, initializer=None, init_args=None,
                  init_kwargs=None, finalizer=None, final_args=None,
-                 final_kwargs=None, max_tasks_per_worker=None, mp_context=None):
+                 final_kwargs=None, max_tasks_per_worker=None, mp_context=None,
+                 notify_running=True, result_batch_size=64,
+                 result_flush_interval=0.01, task_batch_size=64,
+                 transport="queue", shm_threshold=None, serializer=None,
+                 serialize_on_submit=False, lazy_results=False,
+                 message_threads=1, direct_dispatch=False, prefetch=None,
+                 task_timeout=None, crash_retries=0, ring_size=RING_SIZE):
         max_workers = 2
         super().__init__(max_workers=max_workers, name=name,
                          idle_timeout=idle_timeout,
@@ -173,7 +944,18 @@ class DualProcessPool(ProcessPool):
                          init_kwargs=init_kwargs, finalizer=finalizer,
                          final_args=final_args, final_kwargs=final_kwargs,
                          max_tasks_per_worker=max_tasks_per_worker,
-                         mp_context=mp_context)
+                         mp_context=mp_context, notify_running=notify_running,
+                         result_batch_size=result_batch_size,
+                         result_flush_interval=result_flush_interval,
+                         task_batch_size=task_batch_size,
+                         transport=transport, shm_threshold=shm_threshold,
+                         serializer=serializer,
+                         serialize_on_submit=serialize_on_submit,
+                         lazy_results=lazy_results,
+                         message_threads=message_threads,
+                         direct_dispatch=direct_dispatch,
+                         prefetch=prefetch, task_timeout=task_timeout,
+                         crash_retries=crash_retries, ring_size=ring_size)
 
 
 class TripleProcessPool(ProcessPool):
@@ -181,7 +963,13 @@ class TripleProcessPool(ProcessPool):
     def __init__(self, *, name="TripleProcessPool",
                  idle_timeout=IDLE_TIMEOUT, initializer=None, init_args=None,
                  init_kwargs=None, finalizer=None, final_args=None,
-                 final_kwargs=None, max_tasks_per_worker=None, mp_context=None):
+                 final_kwargs=None, max_tasks_per_worker=None, mp_context=None,
+                 notify_running=True, result_batch_size=64,
+                 result_flush_interval=0.01, task_batch_size=64,
+                 transport="queue", shm_threshold=None, serializer=None,
+                 serialize_on_submit=False, lazy_results=False,
+                 message_threads=1, direct_dispatch=False, prefetch=None,
+                 task_timeout=None, crash_retries=0, ring_size=RING_SIZE):
         max_workers = 3
         super().__init__(max_workers=max_workers, name=name,
                          idle_timeout=idle_timeout,
@@ -189,7 +977,18 @@ class TripleProcessPool(ProcessPool):
                          init_kwargs=init_kwargs, finalizer=finalizer,
                          final_args=final_args, final_kwargs=final_kwargs,
                          max_tasks_per_worker=max_tasks_per_worker,
-                         mp_context=mp_context)
+                         mp_context=mp_context, notify_running=notify_running,
+                         result_batch_size=result_batch_size,
+                         result_flush_interval=result_flush_interval,
+                         task_batch_size=task_batch_size,
+                         transport=transport, shm_threshold=shm_threshold,
+                         serializer=serializer,
+                         serialize_on_submit=serialize_on_submit,
+                         lazy_results=lazy_results,
+                         message_threads=message_threads,
+                         direct_dispatch=direct_dispatch,
+                         prefetch=prefetch, task_timeout=task_timeout,
+                         crash_retries=crash_retries, ring_size=ring_size)
 
 
 class QuadProcessPool(ProcessPool):
@@ -197,7 +996,13 @@ class QuadProcessPool(ProcessPool):
     def __init__(self, *, name="QuadProcessPool",
                  idle_timeout=IDLE_TIMEOUT, initializer=None, init_args=None,
                  init_kwargs=None, finalizer=None, final_args=None,
-                 final_kwargs=None, max_tasks_per_worker=None, mp_context=None):
+                 final_kwargs=None, max_tasks_per_worker=None, mp_context=None,
+                 notify_running=True, result_batch_size=64,
+                 result_flush_interval=0.01, task_batch_size=64,
+                 transport="queue", shm_threshold=None, serializer=None,
+                 serialize_on_submit=False, lazy_results=False,
+                 message_threads=1, direct_dispatch=False, prefetch=None,
+                 task_timeout=None, crash_retries=0, ring_size=RING_SIZE):
         max_workers = 4
         super().__init__(max_workers=max_workers, name=name,
                          idle_timeout=idle_timeout,
@@ -205,4 +1010,15 @@ class QuadProcessPool(ProcessPool):
                          init_kwargs=init_kwargs, finalizer=finalizer,
                          final_args=final_args, final_kwargs=final_kwargs,
                          max_tasks_per_worker=max_tasks_per_worker,
-                         mp_context=mp_context)
+                         mp_context=mp_context, notify_running=notify_running,
+                         result_batch_size=result_batch_size,
+                         result_flush_interval=result_flush_interval,
+                         task_batch_size=task_batch_size,
+                         transport=transport, shm_threshold=shm_threshold,
+                         serializer=serializer,
+                         serialize_on_submit=serialize_on_submit,
+                         lazy_results=lazy_results,
+                         message_threads=message_threads,
+                         direct_dispatch=direct_dispatch,
+                         prefetch=prefetch, task_timeout=task_timeout,
+                         crash_retries=crash_retries, ring_size=ring_size)
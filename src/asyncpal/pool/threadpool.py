@@ -15,7 +15,8 @@ class ThreadPool(Pool):
     def __init__(self, max_workers=None, *, name="ThreadPool",
                  idle_timeout=IDLE_TIMEOUT, initializer=None, init_args=None,
                  init_kwargs=None, finalizer=None, final_args=None,
-                 final_kwargs=None, max_tasks_per_worker=None):
+                 final_kwargs=None, max_tasks_per_worker=None,
+                 caller_runs=False):
         """
         Initialization.
 
@@ -35,6 +36,9 @@ class ThreadPool(Pool):
         - final_kwargs: keyword arguments (dict) to pass to the finalizer
         - max_tasks_per_worker: Maximum number of tasks a worker is allowed to do
             before it closes.
+        - caller_runs: if True, the `run` method executes the task in the
+            calling thread when all workers are busy and the pool can't grow.
+            Handy for tiny tasks that would otherwise wait in the queue.
         """
         if max_workers is None or max_workers <= 0:
             x = misc.get_cpu_count() + 5
@@ -48,7 +52,7 @@ class ThreadPool(Pool):
                          finalizer=finalizer, final_args=final_args,
                          final_kwargs=final_kwargs,
                          max_tasks_per_worker=max_tasks_per_worker,
-                         task_queue=task_queue)
+                         task_queue=task_queue, caller_runs=caller_runs)
 
     def _create_worker(self):
         worker_id = self._monotonic_worker_count
@@ -59,7 +63,8 @@ class ThreadPool(Pool):
                                   self._init_args, self._init_kwargs,
                                   self._finalizer, self._final_args,
                                   self._final_kwargs, self._max_tasks_per_worker,
-                                  self._on_worker_shutdown, self._on_worker_exception)
+                                  self._busy_counter, self._on_worker_shutdown,
+                                  self._on_worker_exception)
             return worker
 
 
@@ -68,7 +73,8 @@ class SingleThreadPool(ThreadPool):
     def __init__(self, *, name="SingleThreadPool", idle_timeout=IDLE_TIMEOUT,
                  initializer=None, init_args=None,
                  init_kwargs=None, finalizer=None, final_args=None,
-                 final_kwargs=None, max_tasks_per_worker=None):
+                 final_kwargs=None, max_tasks_per_worker=None,
+                 caller_runs=False):
         max_workers = 1
         super().__init__(max_workers=max_workers, name=name,
                          idle_timeout=idle_timeout,
@@ -76,7 +82,8 @@ class SingleThreadPool(ThreadPool):
                          init_args=init_args, init_kwargs=init_kwargs,
                          finalizer=finalizer, final_args=final_args,
                          final_kwargs=final_kwargs,
-                         max_tasks_per_worker=max_tasks_per_worker)
+                         max_tasks_per_worker=max_tasks_per_worker,
+                         caller_runs=caller_runs)
 
 
 class DualThreadPool(ThreadPool):
@@ -84,7 +91,8 @@ class DualThreadPool(ThreadPool):
     def __init__(self, *, name="DualThreadPool", idle_timeout=IDLE_TIMEOUT,
                  initializer=None, init_args=None,
                  init_kwargs=None, finalizer=None, final_args=None,
-                 final_kwargs=None, max_tasks_per_worker=None):
+                 final_kwargs=None, max_tasks_per_worker=None,
+                 caller_runs=False):
         max_workers = 2
         super().__init__(max_workers=max_workers, name=name,
                          idle_timeout=idle_timeout,
@@ -92,7 +100,8 @@ class DualThreadPool(ThreadPool):
                          init_args=init_args, init_kwargs=init_kwargs,
                          finalizer=finalizer, final_args=final_args,
                          final_kwargs=final_kwargs,
-                         max_tasks_per_worker=max_tasks_per_worker)
+                         max_tasks_per_worker=max_tasks_per_worker,
+                         caller_runs=caller_runs)
 
 
 class TripleThreadPool(ThreadPool):
@@ -100,7 +109,8 @@ class TripleThreadPool(ThreadPool):
     def __init__(self, *, name="TripleThreadPool", idle_timeout=IDLE_TIMEOUT,
                  initializer=None, init_args=None,
                  init_kwargs=None, finalizer=None, final_args=None,
-                 final_kwargs=None, max_tasks_per_worker=None):
+                 final_kwargs=None, max_tasks_per_worker=None,
+                 caller_runs=False):
         max_workers = 3
         super().__init__(max_workers=max_workers, name=name,
                          idle_timeout=idle_timeout,
@@ -108,7 +118,8 @@ class TripleThreadPool(ThreadPool):
                          init_args=init_args, init_kwargs=init_kwargs,
                          finalizer=finalizer, final_args=final_args,
                          final_kwargs=final_kwargs,
-                         max_tasks_per_worker=max_tasks_per_worker)
+                         max_tasks_per_worker=max_tasks_per_worker,
+                         caller_runs=caller_runs)
 
 
 class QuadThreadPool(ThreadPool):
@@ -116,7 +127,8 @@ class QuadThreadPool(ThreadPool):
     def __init__(self, *, name="QuadThreadPool", idle_timeout=IDLE_TIMEOUT,
                  initializer=None, init_args=None,
                  init_kwargs=None, finalizer=None, final_args=None,
-                 final_kwargs=None, max_tasks_per_worker=None):
+                 final_kwargs=None, max_tasks_per_worker=None,
+                 caller_runs=False):
         max_workers = 4
         super().__init__(max_workers=max_workers, name=name,
                          idle_timeout=idle_timeout,
@@ -124,4 +136,5 @@ class QuadThreadPool(ThreadPool):
                          init_args=init_args, init_kwargs=init_kwargs,
                          finalizer=finalizer, final_args=final_args,
                          final_kwargs=final_kwargs,
-                         max_tasks_per_worker=max_tasks_per_worker)
+                         max_tasks_per_worker=max_tasks_per_worker,
+                         caller_runs=caller_runs)
@@ -0,0 +1,105 @@
+"""Serializers that a ProcessPool can use to encode tasks,
+results, and the initializer and finalizer of its workers"""
+import copyreg
+import io
+import pickle
+from multiprocessing.reduction import ForkingPickler
+try:
+    import cloudpickle
+except ImportError:  # pragma: no cover
+    cloudpickle = None
+
+
+__all__ = ["Serializer", "PickleSerializer", "CloudpickleSerializer"]
+
+
+class Serializer:
+    """A pair of dumps and loads functions.
+    Note that a serializer is sent to each process worker, therefore
+    the functions should be picklable (e.g., module-level functions)"""
+    def __init__(self, dumps, loads):
+        """
+        Initialization.
+
+        [param]
+        - dumps: function that accepts an object and returns bytes
+        - loads: function that accepts a bytes-like object and returns an object
+        """
+        self._dumps_func = dumps
+        self._loads_func = loads
+
+    def dumps(self, obj):
+        """Serialize an object and return a bytes-like object"""
+        return self._dumps_func(obj)
+
+    def loads(self, data):
+        """Deserialize a bytes-like object and return an object"""
+        return self._loads_func(data)
+
+
+class PickleSerializer(Serializer):
+    """Serializer based on the stdlib pickle with
+    the reducers registered for multiprocessing"""
+    def __init__(self, protocol=None):
+        """
+        Initialization.
+
+        [param]
+        - protocol: the pickle protocol. Defaults to pickle.DEFAULT_PROTOCOL
+        """
+        self._protocol = protocol
+        self._dispatch_table = None
+        super().__init__(None, None)
+
+    @property
+    def protocol(self):
+        return self._protocol
+
+    def dumps(self, obj):
+        if self._dispatch_table is None:
+            self._dispatch_table = copyreg.dispatch_table.copy()
+            self._dispatch_table.update(ForkingPickler._extra_reducers)
+        file = io.BytesIO()
+        pickler = pickle.Pickler(file, self._protocol)
+        pickler.dispatch_table = self._dispatch_table
+        pickler.dump(obj)
+        return file.getvalue()
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+    def __getstate__(self):
+        # the dispatch table is rebuilt in the worker
+        state = self.__dict__.copy()
+        state["_dispatch_table"] = None
+        return state
+
+
+class CloudpickleSerializer(Serializer):
+    """Serializer based on cloudpickle, to send lambdas, closures,
+    and functions defined interactively. Requires cloudpickle"""
+    def __init__(self, protocol=None):
+        """
+        Initialization.
+
+        [param]
+        - protocol: the pickle protocol. Defaults to cloudpickle.DEFAULT_PROTOCOL
+
+        [except]
+        - ImportError: raised when cloudpickle isn't installed
+        """
+        if cloudpickle is None:
+            msg = "CloudpickleSerializer requires cloudpickle"
+            raise ImportError(msg)
+        self._protocol = protocol
+        super().__init__(None, None)
+
+    @property
+    def protocol(self):
+        return self._protocol
+
+    def dumps(self, obj):
+        return cloudpickle.dumps(obj, self._protocol)
+
+    def loads(self, data):
+        return pickle.loads(data)
@@ -0,0 +1,764 @@
+"""Transports used by a ProcessPool to exchange tasks
+and messages with its workers over per-worker pipes"""
+import copyreg
+import io
+import pickle
+import struct
+import threading
+from collections import deque
+from multiprocessing.connection import wait as wait_connections
+from multiprocessing.reduction import ForkingPickler
+from queue import Empty as EmptyQueueError, Full as FullQueueError
+from asyncpal import errors, misc
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # pragma: no cover
+    shared_memory = None  # Python < 3.8
+
+
+__all__ = []
+
+
+# default size in bytes of a shared memory ring. Two rings are mapped
+# per worker, in a /dev/shm that is often small (64 MiB in Docker)
+RING_SIZE = 2**21
+# min size in bytes of a buffer pickled out-of-band
+OUT_OF_BAND_SIZE = 2**20
+# seconds of work that the adaptive prefetch keeps queued per worker
+PREFETCH_WINDOW = 0.005
+# max prefetch depth of the adaptive prefetch
+MAX_PREFETCH = 16
+
+
+class PipeReader:
+    """Private class !
+
+    Queue-like reading end of a pipe, used by a process worker
+    to get its tasks, and by the pool to get messages"""
+    def __init__(self, conn):
+        self._conn = conn
+
+    @property
+    def conn(self):
+        return self._conn
+
+    def recv(self):
+        obj = self._recv_object()
+        if type(obj) is OutOfBandFrame:
+            data = self._recv_part()
+            buffers = [self._recv_part(size) for size in obj.sizes]
+            obj = ForkingPickler.loads(data, buffers=buffers)
+        return obj
+
+    def get(self, block=True, timeout=None):
+        if not block:
+            timeout = 0
+        try:
+            if not self._conn.poll(timeout):
+                raise EmptyQueueError
+            return self.recv()
+        except (EOFError, OSError) as e:
+            # the pool closed the pipe, the worker should stop
+            return None
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def empty(self):
+        try:
+            return not self._conn.poll(0)
+        except (EOFError, OSError) as e:
+            return False
+
+    def close(self):
+        self._conn.close()
+
+    def detach(self):
+        """Close the connection held by the pool for a child end"""
+        self._conn.close()
+
+    def _recv_object(self):
+        """Private method !"""
+        return ForkingPickler.loads(self._conn.recv_bytes())
+
+    def _recv_part(self, size=None):
+        """Private method !"""
+        if size is None:
+            return self._conn.recv_bytes()
+        buffer = bytearray(size)
+        self._conn.recv_bytes_into(buffer)
+        return buffer
+
+
+class PipeWriter:
+    """Private class !
+
+    Queue-like writing end of a pipe, used by the pool to send tasks,
+    and by a process worker to send its messages. Sends are serialized
+    with a thread lock as a worker might send messages from more
+    than one thread"""
+    def __init__(self, conn):
+        self._conn = conn
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self):
+        return self._conn
+
+    def put(self, obj):
+        with self._lock:
+            self._send(obj)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def detach(self):
+        """Close the connection held by the pool for a child end"""
+        self._conn.close()
+
+    def _send(self, obj):
+        """Private method !"""
+        data, buffers = dumps(obj)
+        if buffers:
+            # large buffers follow the pickle data instead of being
+            # copied in it
+            sizes = tuple(len(x) for x in buffers)
+            self._send_part(dumps(OutOfBandFrame(sizes))[0])
+            self._send_part(data)
+            for buffer in buffers:
+                self._send_part(buffer)
+        else:
+            self._send_part(data)
+
+    def _send_part(self, data):
+        """Private method !"""
+        self._conn.send_bytes(data)
+
+    def __getstate__(self):
+        return self._conn
+
+    def __setstate__(self, state):
+        self._conn = state
+        self._lock = threading.Lock()
+
+
+class RingReader(PipeReader):
+    """Private class !
+
+    Reading end of a pipe whose payloads are stored in a shared memory
+    ring. The pipe only carries small notices that locate a payload
+    in the ring, or a payload that couldn't fit in the ring"""
+    def __init__(self, conn, ring):
+        super().__init__(conn)
+        self._ring = ring
+
+    def close(self):
+        super().close()
+        self._ring.close()
+
+    def _recv_object(self):
+        """Private method !"""
+        data = self._conn.recv_bytes()
+        if data[:1] == _RING_NOTICE:
+            return self._ring.read(*_NOTICE.unpack_from(data, 1))
+        return ForkingPickler.loads(memoryview(data)[1:])
+
+    def _recv_part(self, size=None):
+        """Private method !"""
+        data = self._conn.recv_bytes()
+        if data[:1] == _RING_NOTICE:
+            # the part is copied as the ring space gets reused
+            return self._ring.copy(*_NOTICE.unpack_from(data, 1))
+        return bytearray(memoryview(data)[1:])
+
+    def __getstate__(self):
+        return self._conn, self._ring
+
+    def __setstate__(self, state):
+        self._conn, self._ring = state
+
+
+class RingWriter(PipeWriter):
+    """Private class !
+
+    Writing end of a pipe whose payloads are stored in a shared memory
+    ring. A payload is sent through the pipe when the ring hasn't
+    enough free space for it"""
+    def __init__(self, conn, ring):
+        super().__init__(conn)
+        self._ring = ring
+
+    def close(self):
+        super().close()
+        self._ring.close()
+
+    def _send_part(self, data):
+        """Private method !"""
+        notice = self._ring.write(data)
+        if notice is None:
+            self._conn.send_bytes(_INLINE_PAYLOAD + data)
+        else:
+            self._conn.send_bytes(_RING_NOTICE + _NOTICE.pack(*notice))
+
+    def __getstate__(self):
+        return self._conn, self._ring
+
+    def __setstate__(self, state):
+        self._conn, self._ring = state
+        self._lock = threading.Lock()
+
+
+class Ring:
+    """Private class !
+
+    Single-producer single-consumer ring of bytes in shared memory.
+    A payload is never split: when it can't fit before the end of
+    the ring, it is written at the start and the gap is skipped.
+    The producer keeps its head locally and notifies the consumer
+    with (offset, size, advance) notices. The consumer publishes
+    its tail in the first bytes of the segment.
+
+    The process that creates the ring owns it and unlinks it on close.
+    Copies of the ring sent to another process attach to the segment"""
+    def __init__(self, size=RING_SIZE, name=None):
+        if shared_memory is None:
+            msg = "Shared memory requires Python 3.8 or newer"
+            raise errors.Error(msg)
+        self._is_owner = name is None
+        if self._is_owner:
+            self._shm = shared_memory.SharedMemory(create=True,
+                                                   size=size + _RING_HEADER)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self._size = size
+        self._head = 0
+        self._buf = self._shm.buf
+        self._tail = self._buf[:8].cast("Q")
+        if self._is_owner:
+            self._tail[0] = 0
+        self._is_closed = False
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def size(self):
+        return self._size
+
+    def write(self, data):
+        """Copy data in the ring and return an (offset, size, advance)
+        notice, or None when there isn't enough free space"""
+        n = len(data)
+        position = self._head % self._size
+        gap = self._size - position if position + n > self._size else 0
+        free = self._size - (self._head - self._tail[0])
+        if n + gap > free:
+            return None
+        offset = _RING_HEADER + (0 if gap else position)
+        self._buf[offset:offset+n] = data
+        self._head += n + gap
+        return offset, n, n + gap
+
+    def read(self, offset, size, advance):
+        """Unpickle the payload located by a notice"""
+        with self._buf[offset:offset+size] as data:
+            obj = ForkingPickler.loads(data)
+        self._tail[0] += advance
+        return obj
+
+    def copy(self, offset, size, advance):
+        """Return a copy (bytearray) of the payload located by a notice"""
+        data = bytearray(self._buf[offset:offset+size])
+        self._tail[0] += advance
+        return data
+
+    def close(self):
+        if self._is_closed:
+            return
+        self._is_closed = True
+        self._tail.release()
+        self._buf = self._tail = None
+        self._shm.close()
+        if self._is_owner:
+            unlink_segment(self._shm)
+
+    def __getstate__(self):
+        return self._shm.name, self._size
+
+    def __setstate__(self, state):
+        name, size = state
+        self.__init__(size, name)
+
+
+class OutOfBandFrame:
+    """Private class !
+
+    Announces a pickle whose large buffers are sent
+    separately, right after the pickle data"""
+    __slots__ = ("sizes", )
+
+    def __init__(self, sizes):
+        self.sizes = sizes
+
+    def __getstate__(self):
+        return self.sizes
+
+    def __setstate__(self, state):
+        self.sizes = state
+
+
+def dumps(obj):
+    """Private function !
+
+    Pickle an object and return the pickle data with a list of
+    out-of-band buffers. With the protocol 5, buffers of at least
+    OUT_OF_BAND_SIZE bytes (bytearray, numpy arrays, ...) aren't
+    copied in the pickle data, they are returned as raw memoryviews.
+    See 'expose_buffers' for bytearrays"""
+    if _PICKLE_PROTOCOL < 5:
+        return ForkingPickler.dumps(obj), ()
+    buffers = list()
+
+    def buffer_callback(buffer):
+        # a true value means that the buffer is pickled in-band
+        with buffer.raw() as view:
+            if view.nbytes < OUT_OF_BAND_SIZE:
+                return True
+        buffers.append(buffer.raw())
+        return False
+
+    file = io.BytesIO()
+    # ForkingPickler doesn't accept the buffer_callback argument,
+    # therefore a Pickler gets its reducers
+    pickler = pickle.Pickler(file, _PICKLE_PROTOCOL,
+                             buffer_callback=buffer_callback)
+    pickler.dispatch_table = _get_dispatch_table()
+    pickler.dump(obj)
+    return file.getbuffer(), buffers
+
+
+def _get_dispatch_table():
+    """Private function !
+
+    Return the reducers of ForkingPickler. The table is built once,
+    and again only if a reducer got registered since then"""
+    global _DISPATCH_TABLE
+    key = (len(copyreg.dispatch_table), len(ForkingPickler._extra_reducers))
+    cached_key, dispatch_table = _DISPATCH_TABLE
+    if cached_key != key:
+        dispatch_table = copyreg.dispatch_table.copy()
+        dispatch_table.update(ForkingPickler._extra_reducers)
+        _DISPATCH_TABLE = key, dispatch_table
+    return dispatch_table
+
+
+def expose_buffers(obj):
+    """Private function !
+
+    Wrap a large bytearray, or the large bytearrays of a list or tuple,
+    in PickleBuffer objects so that 'dumps' pickles them out-of-band.
+    They are unpickled as bytearrays. Note that the pickler always
+    copies bytearrays in the pickle data otherwise"""
+    if _PICKLE_PROTOCOL < 5:
+        return obj
+    cls = type(obj)
+    if cls is bytearray:
+        return _expose_buffer(obj)
+    if cls is list or cls is tuple:
+        for x in obj:
+            if type(x) is bytearray and len(x) >= OUT_OF_BAND_SIZE:
+                return cls(_expose_buffer(x) for x in obj)
+    return obj
+
+
+def _expose_buffer(obj):
+    """Private function !"""
+    if type(obj) is bytearray and len(obj) >= OUT_OF_BAND_SIZE:
+        return pickle.PickleBuffer(obj)
+    return obj
+
+
+class SharedPayload:
+    """Private class !
+
+    Handle of a bytes-like payload stored in a shared memory segment"""
+    __slots__ = ("name", "size", "kind", "format", "shape")
+
+    def __init__(self, name, size, kind, format="B", shape=None):
+        self.name = name
+        self.size = size
+        self.kind = kind
+        self.format = format
+        self.shape = shape
+
+    def __getstate__(self):
+        return self.name, self.size, self.kind, self.format, self.shape
+
+    def __setstate__(self, state):
+        self.name, self.size, self.kind, self.format, self.shape = state
+
+
+def spill_payload(obj, threshold, segments):
+    """Private function !
+
+    Copy a bytes, bytearray, or contiguous memoryview object of at least
+    'threshold' bytes in a new shared memory segment and return its handle.
+    The segment is appended to the 'segments' list. Other objects are
+    returned as is"""
+    kind = _SPILLABLE_TYPES.get(type(obj))
+    if kind is None:
+        return obj
+    with memoryview(obj) as view:
+        if view.nbytes < threshold or not view.c_contiguous:
+            return obj
+        if shared_memory is None:
+            msg = "Shared memory requires Python 3.8 or newer"
+            raise errors.Error(msg)
+        shm = shared_memory.SharedMemory(create=True, size=max(view.nbytes, 1))
+        with view.cast("B") as data:
+            shm.buf[:view.nbytes] = data
+        payload = SharedPayload(shm.name, view.nbytes, kind,
+                                view.format, view.shape)
+    shm.close()
+    segments.append(shm)
+    return payload
+
+
+def load_payload(obj, segments=None, unlink=False):
+    """Private function !
+
+    Return the object whose handle is 'obj', or 'obj' itself if it isn't
+    a SharedPayload. When a 'segments' list is given, a memoryview is
+    mapped on the shared memory (zero-copy) and its segment is appended
+    to the list. Otherwise, the payload is copied and the segment is
+    closed, then unlinked if 'unlink' is True"""
+    if not isinstance(obj, SharedPayload):
+        return obj
+    shm = shared_memory.SharedMemory(name=obj.name)
+    view = shm.buf[:obj.size]
+    if obj.kind == "memoryview" and segments is not None:
+        segments.append(shm)
+        return _cast_view(view, obj)
+    try:
+        if obj.kind == "bytes":
+            value = bytes(view)
+        elif obj.kind == "bytearray":
+            value = bytearray(view)
+        else:
+            value = _cast_view(memoryview(bytearray(view)), obj)
+    finally:
+        view.release()
+        shm.close()
+        if unlink:
+            unlink_segment(shm)
+    return value
+
+
+def release_segments(segments, unlink=False):
+    """Private function !
+
+    Close shared memory segments, and unlink them if 'unlink' is True.
+    A segment whose memory is still referenced stays mapped until a later
+    call finds it free"""
+    retained = [shm for shm in segments if not _close_segment(shm)]
+    if unlink:
+        for shm in segments:
+            unlink_segment(shm)
+    if not retained and not _RETAINED_SEGMENTS:
+        return
+    with _RETAINED_LOCK:
+        # the views on segments retained earlier might be gone by now
+        _RETAINED_SEGMENTS[:] = [shm for shm in _RETAINED_SEGMENTS
+                                 if not _close_segment(shm)]
+        _RETAINED_SEGMENTS.extend(retained)
+
+
+def _close_segment(shm):
+    """Private function !"""
+    try:
+        shm.close()
+    except BufferError as e:
+        return False
+    return True
+
+
+def unlink_segment(shm):
+    """Private function !"""
+    try:
+        shm.unlink()
+    except FileNotFoundError as e:
+        pass
+
+
+class PipeDispatcher:
+    """Private class !
+
+    Stands in for the multiprocessing task queue of a ProcessPool.
+    Each item (a task or a batch of tasks) is sent to an idle worker
+    over the pipe of this worker. Items are queued behind busy workers
+    only when the pool can't grow anymore, and a worker can't hold
+    more than 'max_outstanding' items. Therefore the 'put' method blocks
+    until a worker is available. When 'block' is False, the item is only
+    sent to an idle worker (so that writing it can't block on a full pipe),
+    else queue.Full is raised. Outstanding tasks are released with
+    'task_done' and the tasks of a worker that stopped are returned
+    by 'unregister'. When 'adaptive' is True, 'max_outstanding' follows
+    the durations of tasks reported to 'task_done': workers hold about
+    PREFETCH_WINDOW seconds of work on top of their running item"""
+    def __init__(self, max_workers, max_outstanding=2, adaptive=False):
+        self._max_workers = max_workers
+        self._max_outstanding = max(max_outstanding, 1)
+        self._adaptive = adaptive
+        self._mean_duration = None
+        self._channels = dict()
+        self._owners = dict()
+        self._condition = threading.Condition(threading.Lock())
+        self._n_waiting = 0
+        self._is_closed = False
+
+    @property
+    def max_outstanding(self):
+        return self._max_outstanding
+
+    @property
+    def adaptive(self):
+        return self._adaptive
+
+    def register(self, worker_id, writer):
+        with self._condition:
+            self._channels[worker_id] = _Channel(writer)
+            self._condition.notify_all()
+
+    def unregister(self, worker_id):
+        """Remove the channel of a worker and return
+        the tasks that this worker didn't complete"""
+        with self._condition:
+            channel = self._channels.pop(worker_id, None)
+            if channel is None:
+                return list()
+            for task_id in channel.tasks:
+                self._owners.pop(task_id, None)
+            self._condition.notify_all()
+        channel.close()
+        return list(channel.tasks.values())
+
+    def task_done(self, task_id, duration=None):
+        with self._condition:
+            if self._adaptive and duration is not None:
+                self._adapt(duration)
+            worker_id = self._owners.pop(task_id, None)
+            channel = self._channels.get(worker_id)
+            if channel is None:
+                return
+            del channel.tasks[task_id]
+            # a worker runs its tasks in the order they were sent
+            channel.items[0] -= 1
+            if not channel.items[0]:
+                channel.items.popleft()
+                self._condition.notify()
+
+    def put(self, item, block=True, timeout=None):
+        if item is None:
+            self._stop_worker()
+            return
+        tasks = item if isinstance(item, list) else (item, )
+        with self._condition:
+            # waiting tasks are counted as pending so that
+            # the pool can spawn a worker for them
+            self._n_waiting += len(tasks)
+            try:
+                while True:
+                    if self._is_closed:
+                        return
+                    worker_id, channel = self._select_channel(not block)
+                    if channel is not None:
+                        break
+                    if not block:
+                        raise FullQueueError
+                    self._condition.wait()
+            finally:
+                self._n_waiting -= len(tasks)
+            for task in tasks:
+                self._owners[task[0]] = worker_id
+                channel.tasks[task[0]] = task
+            channel.items.append(len(tasks))
+        # the item is sent outside the condition so that a large item
+        # doesn't block the message thread that releases outstanding tasks
+        channel.send(item)
+
+    def get_nowait(self):
+        # tasks sent to a worker can't be taken back
+        raise EmptyQueueError
+
+    def qsize(self):
+        # outstanding tasks, including the ones that are running
+        with self._condition:
+            return self._n_waiting + len(self._owners)
+
+    def close(self):
+        with self._condition:
+            self._is_closed = True
+            channels = tuple(self._channels.values())
+            self._condition.notify_all()
+        for channel in channels:
+            channel.close()
+
+    def join_thread(self):
+        pass
+
+    def _select_channel(self, idle_only=False):
+        """Private method !"""
+        selected = None, None
+        n = self._max_outstanding
+        n_channels = 0
+        for worker_id, channel in self._channels.items():
+            if channel.is_stopping:
+                continue
+            if not channel.items:
+                return worker_id, channel
+            n_channels += 1
+            if len(channel.items) < n:
+                n = len(channel.items)
+                selected = worker_id, channel
+        if idle_only or n_channels < self._max_workers:
+            return None, None
+        return selected
+
+    def _adapt(self, duration):
+        """Private method !"""
+        # exponential moving average of the durations
+        mean = self._mean_duration
+        mean = duration if mean is None else 0.8 * mean + 0.2 * duration
+        self._mean_duration = mean
+        prefetch = MAX_PREFETCH
+        if mean > 0:
+            prefetch = min(int(PREFETCH_WINDOW / mean), MAX_PREFETCH)
+        if prefetch + 1 > self._max_outstanding:
+            self._condition.notify_all()
+        self._max_outstanding = prefetch + 1
+
+    def _stop_worker(self):
+        """Private method !"""
+        with self._condition:
+            for channel in self._channels.values():
+                if not channel.is_stopping:
+                    channel.is_stopping = True
+                    break
+            else:
+                return
+        channel.send(None)
+
+
+class PipeSelector:
+    """Private class !
+
+    Stands in for the multiprocessing message queue of a ProcessPool.
+    The 'get' method waits on the message pipes of all workers at once.
+    A pipe is forgotten as soon as its worker closed it, and its
+    'eof_message' (if any) is returned after the messages it carried"""
+    def __init__(self, mp_context):
+        self._readers = dict()
+        self._eof_messages = dict()
+        self._ready = deque()
+        self._lock = threading.Lock()
+        self._wake_reader, self._wake_writer = mp_context.Pipe(duplex=False)
+
+    def register(self, reader, eof_message=None):
+        with self._lock:
+            self._readers[reader.conn] = reader
+            if eof_message is not None:
+                self._eof_messages[reader.conn] = eof_message
+        self._wake()
+
+    def put(self, obj):
+        self._ready.append(obj)
+        self._wake()
+
+    def get(self):
+        while True:
+            try:
+                return self._ready.popleft()
+            except IndexError as e:
+                pass
+            with self._lock:
+                readers = dict(self._readers)
+            conns = list(readers.keys())
+            conns.append(self._wake_reader)
+            for conn in wait_connections(conns):
+                if conn is self._wake_reader:
+                    self._wake_reader.recv_bytes()
+                    continue
+                reader = readers[conn]
+                try:
+                    # messages already in the pipe are read at once
+                    self._ready.append(reader.recv())
+                    while conn.poll(0):
+                        self._ready.append(reader.recv())
+                except (EOFError, OSError) as e:
+                    with self._lock:
+                        del self._readers[conn]
+                        eof_message = self._eof_messages.pop(conn, None)
+                    reader.close()
+                    if eof_message is not None:
+                        self._ready.append(eof_message)
+
+    def close(self):
+        with self._lock:
+            readers = tuple(self._readers.values())
+            self._readers = dict()
+            self._eof_messages = dict()
+        for reader in readers:
+            reader.close()
+        self._wake_reader.close()
+        self._wake_writer.close()
+
+    def _wake(self):
+        """Private method !"""
+        try:
+            self._wake_writer.send_bytes(b"")
+        except OSError as e:
+            pass
+
+
+def _cast_view(view, payload):
+    """Private function !"""
+    if payload.format == "B" and payload.shape == (payload.size, ):
+        return view
+    return view.cast(payload.format, payload.shape)
+
+
+class _Channel:
+    """Private class !"""
+    def __init__(self, writer):
+        self.writer = writer
+        self.items = deque()  # number of outstanding tasks per item
+        self.tasks = dict()  # outstanding tasks indexed by task_id
+        self.is_stopping = False
+
+    def send(self, item):
+        try:
+            self.writer.put(item)
+        except (OSError, ValueError) as e:
+            # the worker is gone. Its outstanding tasks
+            # are given back when it gets unregistered
+            misc.LOGGER.debug("Failed to send an item to a worker",
+                              exc_info=True)
+
+    def close(self):
+        self.writer.close()
+
+
+_PICKLE_PROTOCOL = min(pickle.HIGHEST_PROTOCOL, 5)
+_SPILLABLE_TYPES = {bytes: "bytes", bytearray: "bytearray",
+                    memoryview: "memoryview"}
+# reducers used by 'dumps', with the sizes of the tables they come from
+_DISPATCH_TABLE = None, None
+# segments still referenced by a memoryview when they got released
+_RETAINED_SEGMENTS = list()
+_RETAINED_LOCK = threading.Lock()
+_RING_HEADER = 64
+_RING_NOTICE = b"R"
+_INLINE_PAYLOAD = b"I"
+_NOTICE = struct.Struct("QQQ")
@@ -14,7 +14,7 @@ class Worker(ABC):
                  task_queue, idle_timeout,
                  initializer, init_args, init_kwargs,
                  finalizer, final_args, final_kwargs,
-                 max_tasks_per_worker):
+                 max_tasks_per_worker, busy_counter):
         self._worker_type = worker_type
         self._worker_id = worker_id
         self._worker_name = worker_name
@@ -27,6 +27,7 @@ class Worker(ABC):
         self._final_args = final_args
         self._final_kwargs = final_kwargs
         self._max_tasks_per_worker = max_tasks_per_worker
+        self._busy_counter = busy_counter
 
     @property
     def worker_type(self):
@@ -76,6 +77,10 @@ class Worker(ABC):
     def max_tasks_per_worker(self):
         return self._max_tasks_per_worker
 
+    @property
+    def busy_counter(self):
+        return self._busy_counter
+
     @abstractmethod
     def run(self):
         pass
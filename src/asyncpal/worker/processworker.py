@@ -1,34 +1,54 @@
 import time
+import threading
 from enum import Enum, unique
 from queue import Empty as EmptyQueueError
 from asyncpal import errors, misc
 from asyncpal.worker import Worker, WorkerType
+from asyncpal.transport import (PipeReader, PipeWriter, spill_payload,
+                                load_payload, release_segments,
+                                expose_buffers)
 
 __all__ = []
 
 @unique
 class MessageTag(Enum):
-    RUNNING = 1  # tag, task_id
-    RESULT = 2  # tag, task_id, result, duration
-    EXCEPTION = 3  # tag, task_id, exception
+    RUNNING = 1  # tag, task_id, start instant
+    RESULT = 2  # tag, task_id, result, start instant, end instant
+    EXCEPTION = 3  # tag, task_id, exception, start instant, end instant
     WORKER_EXCEPTION = 4  # tag, worker_id, exception
     SHUTDOWN = 5  # tag, worker_id
+    BATCH = 6  # tag, list of RESULT, EXCEPTION, and CANCELLED messages
+    CANCELLED = 7  # tag, task_id
+    CLOSED = 8  # tag, worker_id (sent by the pool when a message pipe closes)
+
+
+# states of a worker stored in its running slot
+STARTING, READY, BUSY = 0, 1, 2
 
 
 class ProcessWorker(Worker):
     def __init__(self, worker_id, worker_name, task_queue, message_queue,
                  idle_timeout, initializer, init_args, init_kwargs, finalizer,
                  final_args, final_kwargs, max_tasks_per_worker,
-                 mp_context):
+                 busy_counter, mp_context, notify_running=True,
+                 result_batch_size=1, result_flush_interval=None,
+                 shm_threshold=None, serializer=None, cancel_table=None,
+                 running_slot=None):
         super().__init__(WorkerType.PROCESS, worker_id, worker_name,
                          task_queue, idle_timeout, initializer,
                          init_args, init_kwargs, finalizer, final_args,
-                         final_kwargs, max_tasks_per_worker)
+                         final_kwargs, max_tasks_per_worker, busy_counter)
         self._message_queue = message_queue
         self._mp_context = mp_context
+        self._notify_running = notify_running
+        self._result_batch_size = result_batch_size
+        self._result_flush_interval = result_flush_interval
+        self._shm_threshold = shm_threshold
+        self._serializer = serializer
+        self._cancel_table = cancel_table
+        self._running_slot = running_slot
         self._process = None
         self._mutex = self._mp_context.RLock()
-        self._is_busy_event = self._mp_context.Event()
 
     @property
     def message_queue(self):
@@ -38,19 +58,62 @@ class ProcessWorker(Worker):
     def process(self):
         return self._process
 
+    @property
+    def notify_running(self):
+        return self._notify_running
+
+    @property
+    def result_batch_size(self):
+        return self._result_batch_size
+
+    @property
+    def result_flush_interval(self):
+        return self._result_flush_interval
+
+    @property
+    def shm_threshold(self):
+        return self._shm_threshold
+
+    @property
+    def serializer(self):
+        return self._serializer
+
+    @property
+    def cancel_table(self):
+        return self._cancel_table
+
+    @property
+    def running_slot(self):
+        """None or a shared array holding the id and the start instant
+        of the running task, and the state of the worker (STARTING,
+        READY, or BUSY). The id is 0 between tasks"""
+        return self._running_slot
+
     def run(self):
         with self._mutex:
             if self._process is not None:
                 return False
+            initializer = (self._initializer, self._init_args, self._init_kwargs)
+            finalizer = (self._finalizer, self._final_args, self._final_kwargs)
+            if self._serializer is not None:
+                # the initializer and the finalizer are sent encoded
+                initializer = (self._serializer.dumps(initializer), None, None)
+                finalizer = (self._serializer.dumps(finalizer), None, None)
             args = (self._worker_id, self._worker_name, self._task_queue,
-                    self._message_queue, self._idle_timeout, self._initializer,
-                    self._init_args, self._init_kwargs, self._finalizer,
-                    self._final_args, self._final_kwargs,
-                    self._max_tasks_per_worker, self._is_busy_event)
+                    self._message_queue, self._idle_timeout, *initializer,
+                    *finalizer, self._max_tasks_per_worker,
+                    self._notify_running, self._result_batch_size,
+                    self._result_flush_interval, self._shm_threshold,
+                    self._serializer, self._cancel_table,
+                    self._running_slot)
             self._process = self._mp_context.Process(name=self._worker_name,
                                                      target=runner, args=args,
                                                      daemon=False)
             self._process.start()
+            # the child ends of per-worker pipes belong to the process now
+            for x in (self._task_queue, self._message_queue):
+                if isinstance(x, (PipeReader, PipeWriter)):
+                    x.detach()
             return True
 
     def is_alive(self):
@@ -60,7 +123,18 @@ class ProcessWorker(Worker):
             return self._process.is_alive()
 
     def is_busy(self):
-        return self._is_busy_event.is_set()
+        # the running slot is written by the worker process only,
+        # so reading it needs no lock
+        if self._running_slot is None:
+            return False
+        return self._running_slot[2] == BUSY
+
+    def kill(self):
+        # the mutex isn't acquired since another thread
+        # might be joining this worker while holding it
+        process = self._process
+        if process is not None:
+            process.kill()
 
     def join(self, timeout=None):
         with self._mutex:
@@ -73,68 +147,243 @@ class ProcessWorker(Worker):
 def runner(worker_id, worker_name, task_queue, message_queue, idle_timeout,
            initializer, init_args, init_kwargs,
            finalizer, final_args, final_kwargs,
-           max_tasks_per_worker, is_busy_event):
+           max_tasks_per_worker, notify_running=True, result_batch_size=1,
+           result_flush_interval=None, shm_threshold=None, serializer=None,
+           cancel_table=None, running_slot=None):
+    batcher = None
+    if result_batch_size > 1:
+        batcher = MessageBatcher(message_queue, result_batch_size,
+                                 result_flush_interval)
     try:
+        if serializer is not None:
+            initializer, init_args, init_kwargs = serializer.loads(initializer)
+            finalizer, final_args, final_kwargs = serializer.loads(finalizer)
         if initializer is not None:
             run_initializer(worker_name, initializer, *init_args, **init_kwargs)
+        if running_slot is not None:
+            running_slot[2] = READY
         loop(task_queue, message_queue, idle_timeout,
-             max_tasks_per_worker, is_busy_event)
+             max_tasks_per_worker, notify_running, batcher, shm_threshold,
+             serializer, cancel_table, running_slot)
         if finalizer is not None:
             run_finalizer(worker_name, finalizer, *final_args, **final_kwargs)
     except BaseException as e:
         misc.LOGGER.critical("Exception in worker", exc_info=True)
-        is_busy_event.clear()
+        if batcher is not None:
+            batcher.close()
         exc = misc.RemoteExceptionWrapper(e)
         e.__traceback__ = e.__cause__ = e.__context__ = None
         msg = (MessageTag.WORKER_EXCEPTION, worker_id, exc)  # WORKER ERROR
         message_queue.put(msg)
     else:
-        is_busy_event.clear()
+        if batcher is not None:
+            batcher.close()
         msg = (MessageTag.SHUTDOWN, worker_id)  # SHUTDOWN
         message_queue.put(msg)
+    # release per-worker pipes and the shared memory they might use
+    for x in (task_queue, message_queue):
+        if isinstance(x, (PipeReader, PipeWriter)):
+            x.close()
 
 
 def loop(task_queue, message_queue, idle_timeout,
-         max_tasks_per_worker, is_busy_event):
+         max_tasks_per_worker, notify_running=True, batcher=None,
+         shm_threshold=None, serializer=None, cancel_table=None,
+         running_slot=None):
     task_count = 0
+    send_result = message_queue.put if batcher is None else batcher.put
+    # per-worker pipes can carry out-of-band buffers
+    is_pipe = isinstance(message_queue, PipeWriter)
     while True:
         if max_tasks_per_worker and max_tasks_per_worker == task_count:
             break
         try:
-            task = task_queue.get(block=True, timeout=idle_timeout)
+            task = get_task(task_queue, idle_timeout, batcher)
         except EmptyQueueError as e:
             break
         if task is None:
             break
-        is_busy_event.set()
-        run_task(task, message_queue)
-        is_busy_event.clear()
+        if running_slot is not None:
+            running_slot[2] = BUSY
+        if isinstance(task, list):  # batch of tasks
+            for x in task:
+                run_task(x, message_queue, notify_running, send_result,
+                         shm_threshold, is_pipe, serializer, cancel_table,
+                         running_slot)
+            task_count += len(task)
+        else:
+            run_task(task, message_queue, notify_running, send_result,
+                     shm_threshold, is_pipe, serializer, cancel_table,
+                     running_slot)
+            task_count += 1
+        if running_slot is not None:
+            running_slot[2] = READY
         # task_queue.get might block too long, not giving time to free resource
         # pointed to by 'task', therefore let's free resource as soon as possible
         # by deleting 'task'
         del task
-        task_count += 1
 
 
-def run_task(task, message_queue):
+def run_task(task, message_queue, notify_running=True, send_result=None,
+             shm_threshold=None, out_of_band=False, serializer=None,
+             cancel_table=None, running_slot=None):
     task_id, target, args, kwargs = task
+    send_result = message_queue.put if send_result is None else send_result
+    # the pool writes the id of a cancelled task in its slot
+    if (cancel_table is not None
+            and cancel_table[task_id % len(cancel_table)] == task_id):
+        send_result((MessageTag.CANCELLED, task_id))
+        return
+    start_instant = time.monotonic()
+    if running_slot is not None:
+        # the start instant is written first, it is read after the id
+        running_slot[1] = start_instant
+        running_slot[0] = task_id
     # SET RUNNING STATUS
-    msg = (MessageTag.RUNNING, task_id, time.monotonic())
-    message_queue.put(msg)
+    if notify_running:
+        msg = (MessageTag.RUNNING, task_id, start_instant)
+        message_queue.put(msg)
+    segments = list()
+    result = None
     try:
+        if serializer is not None:
+            if shm_threshold is not None:
+                args = load_payload(args)
+            target, args, kwargs = serializer.loads(args)
+        if shm_threshold is not None:
+            # large payloads spilled in shared memory by the pool
+            args = tuple(load_payload(x, segments) for x in args)
+            kwargs = {k: load_payload(v, segments) for k, v in kwargs.items()}
         result = target(*args, **kwargs)
+        if shm_threshold is not None:
+            result = spill_payload(result, shm_threshold, list())
+        if serializer is not None:
+            result = serializer.dumps(result)
+        elif out_of_band:
+            result = expose_buffers(result)
     except BaseException as e:
         # SET EXCEPTION
         exc = misc.RemoteExceptionWrapper(e)
         e.__traceback__ = e.__cause__ = e.__context__ = None
+        if serializer is not None:
+            exc = encode_exception(exc, serializer)
         msg = (MessageTag.EXCEPTION, task_id, exc,
-               time.monotonic())
-        message_queue.put(msg)
+               start_instant, time.monotonic())
+        send_result(msg)
     else:
         # SET RESULT
         msg = (MessageTag.RESULT, task_id, result,
-               time.monotonic())
-        message_queue.put(msg)
+               start_instant, time.monotonic())
+        send_result(msg)
+    finally:
+        # views on shared memory are dropped before their segments get
+        # closed. The pool unlinks the segments once the future is done
+        args = kwargs = result = msg = None
+        release_segments(segments)
+        if running_slot is not None:
+            running_slot[0] = 0
+
+
+def encode_exception(exc, serializer):
+    """Private function !"""
+    try:
+        return serializer.dumps(exc)
+    except BaseException as e:
+        # the exception itself can't be serialized
+        exc = misc.RemoteExceptionWrapper(e)
+        e.__traceback__ = e.__cause__ = e.__context__ = None
+        return serializer.dumps(exc)
+
+
+def get_task(task_queue, timeout, batcher=None):
+    """Private function !
+
+    Get the next item of the task queue. Buffered results are flushed
+    right before blocking, since another worker might take the item
+    that a mere check of the queue found"""
+    if batcher is not None:
+        try:
+            return task_queue.get(block=False)
+        except EmptyQueueError as e:
+            batcher.flush()
+    return task_queue.get(block=True, timeout=timeout)
+
+
+class MessageBatcher:
+    """Buffers the RESULT and EXCEPTION messages of a process worker
+    and puts them in the message queue as a single BATCH message.
+    The batch is flushed when it is full, when its first message has waited
+    for 'flush_interval' seconds, or when the flush method is called"""
+    def __init__(self, message_queue, batch_size, flush_interval=None):
+        self._message_queue = message_queue
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._messages = list()
+        self._first_instant = None
+        self._cond = threading.Condition(threading.Lock())
+        self._is_closed = False
+        self._is_flusher_idle = False
+        self._thread = None
+        if flush_interval is not None:
+            self._thread = threading.Thread(target=self._run_flusher,
+                                            daemon=True)
+            self._thread.start()
+
+    @property
+    def batch_size(self):
+        return self._batch_size
+
+    @property
+    def flush_interval(self):
+        return self._flush_interval
+
+    def put(self, message):
+        with self._cond:
+            self._messages.append(message)
+            if len(self._messages) >= self._batch_size:
+                self._flush()
+            elif len(self._messages) == 1:
+                self._first_instant = time.monotonic()
+                # the flusher is only woken up when it sleeps indefinitely,
+                # otherwise it already polls the batch periodically
+                if self._is_flusher_idle:
+                    self._is_flusher_idle = False
+                    self._cond.notify()
+
+    def flush(self):
+        with self._cond:
+            self._flush()
+
+    def close(self):
+        with self._cond:
+            self._flush()
+            self._is_closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _flush(self):
+        if not self._messages:
+            return
+        messages, self._messages = self._messages, list()
+        if len(messages) == 1:
+            self._message_queue.put(messages[0])
+        else:
+            self._message_queue.put((MessageTag.BATCH, messages))
+
+    def _run_flusher(self):
+        with self._cond:
+            while not self._is_closed:
+                if not self._messages:
+                    self._is_flusher_idle = True
+                    self._cond.wait()
+                    continue
+                age = time.monotonic() - self._first_instant
+                if age >= self._flush_interval:
+                    self._flush()
+                    self._cond.wait(self._flush_interval)
+                else:
+                    self._cond.wait(self._flush_interval - age)
 
 
 def run_initializer(worker_name, initializer, *init_args, **init_kwargs):
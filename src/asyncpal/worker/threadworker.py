@@ -10,11 +10,11 @@ __all__ = []
 class ThreadWorker(Worker):
     def __init__(self, worker_id, worker_name, task_queue, idle_timeout, initializer,
                  init_args, init_kwargs, finalizer, final_args, final_kwargs,
-                 max_tasks_per_worker, on_shutdown, on_exception):
+                 max_tasks_per_worker, busy_counter, on_shutdown, on_exception):
         super().__init__(WorkerType.THREAD, worker_id, worker_name,
                          task_queue, idle_timeout, initializer,
                          init_args, init_kwargs, finalizer, final_args, final_kwargs,
-                         max_tasks_per_worker)
+                         max_tasks_per_worker, busy_counter)
         self._on_shutdown = on_shutdown
         self._on_exception = on_exception
         self._thread = None
@@ -41,7 +41,7 @@ class ThreadWorker(Worker):
                     self._initializer, self._init_args, self._init_kwargs,
                     self._finalizer, self._final_args, self._final_kwargs,
                     self._max_tasks_per_worker, self._is_busy_event,
-                    self._on_shutdown, self._on_exception)
+                    self._busy_counter, self._on_shutdown, self._on_exception)
             self._thread = threading.Thread(name=self._worker_name, target=runner,
                                             args=args, daemon=False)
             self._thread.start()
@@ -68,11 +68,12 @@ def runner(worker_id, worker_name, task_queue, idle_timeout,
            initializer, init_args, init_kwargs,
            finalizer, final_args, final_kwargs,
            max_tasks_per_worker, is_busy_event,
-           on_shutdown, on_exception):
+           busy_counter, on_shutdown, on_exception):
     try:
         if initializer is not None:
             run_initializer(worker_name, initializer, *init_args, **init_kwargs)
-        loop(task_queue, idle_timeout, max_tasks_per_worker, is_busy_event)
+        loop(task_queue, idle_timeout, max_tasks_per_worker,
+             is_busy_event, busy_counter)
         if finalizer is not None:
             run_finalizer(worker_name, finalizer, *final_args, **final_kwargs)
     except BaseException as e:
@@ -84,7 +85,8 @@ def runner(worker_id, worker_name, task_queue, idle_timeout,
         on_shutdown(worker_id)
 
 
-def loop(task_queue, idle_timeout, max_tasks_per_worker, is_busy_event):
+def loop(task_queue, idle_timeout, max_tasks_per_worker,
+         is_busy_event, busy_counter):
     task_count = 0
     while True:
         if max_tasks_per_worker and max_tasks_per_worker == task_count:
@@ -96,7 +98,9 @@ def loop(task_queue, idle_timeout, max_tasks_per_worker, is_busy_event):
         if task is None:
             break
         is_busy_event.set()
+        misc.update_counter(busy_counter, 1)
         run_task(task)
+        misc.update_counter(busy_counter, -1)
         is_busy_event.clear()
         # task_queue.get might block too long, not giving time to free resource
         # pointed to by 'task', therefore let's free resource as soon as possible
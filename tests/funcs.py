@@ -1,4 +1,10 @@
+import gc
+import os
+import sys
 import time
+import pickle
+import signal
+from contextlib import contextmanager
 
 
 def divide(a, b, sleep=0):
@@ -19,8 +25,74 @@ def square(x, sleep=0):
     return x**2
 
 
+def get_type_name(obj):
+    return type(obj).__name__
+
+
+def identity(obj):
+    return obj
+
+
+def create_bytearray(size, fail=False):
+    if fail:
+        raise ValueError(bytearray(size))
+    return bytearray(size)
+
+
+def loads_but_ints(data):
+    obj = pickle.loads(data)
+    if isinstance(obj, int):
+        raise ValueError(obj)
+    return obj
+
+
+def loads_slowly(data):
+    obj = pickle.loads(data)
+    if obj == "slow":
+        time.sleep(1)
+    return obj
+
+
+def wait_for_path(path, x, timeout=10):
+    # blocks the worker until the test creates the file
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path) and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return x
+
+
+def crash(exitcode=1):
+    os._exit(exitcode)
+
+
+def kill_self():
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def crash_once(path, x):
+    # crashes the first time, the file remembers it
+    if not os.path.exists(path):
+        with open(path, "w"):
+            pass
+        os._exit(1)
+    return x
+
+
 def get_worker_exception(pool):
     try:
         pool.check()
     except Exception as e:
         return e
+
+
+@contextmanager
+def catch_unraisable():
+    # collects the exceptions ignored in __del__ methods
+    unraisables = list()
+    hook = sys.unraisablehook
+    sys.unraisablehook = unraisables.append
+    try:
+        yield unraisables
+        gc.collect()
+    finally:
+        sys.unraisablehook = hook
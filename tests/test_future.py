@@ -1,7 +1,9 @@
 import unittest
 import time
+import threading
 from asyncpal import ThreadPool, errors, misc
-from asyncpal.future import as_done, wait, collect, Future, FutureFilter
+from asyncpal.future import (as_done, wait, collect, Future, FutureFilter,
+                             Status, LazyResult, MapJob)
 from tests import funcs
 
 
@@ -424,6 +426,47 @@ class TestFuture(unittest.TestCase):
             self.assertEqual(1, future.task_id)
             self.assertEqual(42, future.collect())
 
+    def test_waiting_for_unfinished_future(self):
+        future = Future(None, 1)
+        future.set_status(Status.PENDING)
+        timer = threading.Timer(0.05, future.set_result, args=(42, ))
+        timer.start()
+        self.assertFalse(future.wait(timeout=0))
+        self.assertEqual(42, future.collect(timeout=5))
+        timer.join()
+
+    def test_set_result_twice(self):
+        future = Future(None, 1)
+        future.set_result(42)
+        with self.assertRaises(errors.InvalidStateError):
+            future.set_result(42)
+        with self.assertRaises(errors.InvalidStateError):
+            future.set_status(Status.RUNNING)
+
+    def test_lazy_result(self):
+        decoded = list()
+        def loads(data):
+            decoded.append(data)
+            return data * 2
+        future = Future(None, 1)
+        future.set_result(LazyResult(21, loads))
+        self.assertEqual(0, len(decoded))
+        self.assertEqual(42, future.collect())
+        self.assertEqual(42, future.result)
+        self.assertEqual([21], decoded)
+
+    def test_lazy_result_decoding_error(self):
+        def loads(data):
+            raise ValueError(data)
+        future = Future(None, 1)
+        future.set_result(LazyResult(21, loads))
+        with self.assertRaises(ValueError):
+            future.collect()
+        self.assertTrue(future.is_failed)
+        self.assertIs(Status.FAILED, future.status)
+        self.assertIsInstance(future.exception, ValueError)
+        self.assertIsNone(future.result)
+
 
 class TestFutureFilter(unittest.TestCase):
 
@@ -553,6 +596,86 @@ class TestFutureFilter(unittest.TestCase):
             self.assertEqual(expected, r)
 
 
+class TestMapJob(unittest.TestCase):
+
+    def test_len_and_random_access(self):
+        with ThreadPool(max_workers=4) as pool:
+            job = pool.map_all(funcs.square, range(10))
+            self.assertEqual(10, len(job))
+            self.assertEqual(81, job[9])
+            self.assertEqual(81, job[-1])
+            self.assertEqual(16, job[4])
+            with self.assertRaises(IndexError):
+                job[10]
+
+    def test_len_and_random_access_with_chunks(self):
+        with ThreadPool(max_workers=4) as pool:
+            job = pool.map_all(funcs.square, range(10), chunk_size=3)
+            self.assertEqual(10, len(job))
+            self.assertEqual(81, job[9])
+            self.assertEqual(25, job[5])
+            self.assertEqual(tuple(map(funcs.square, range(10))), job.collect())
+
+    def test_progress(self):
+        with ThreadPool(max_workers=4) as pool:
+            job = pool.map_all(funcs.square, range(10), chunk_size=3)
+            self.assertTrue(job.wait(timeout=5))
+            self.assertTrue(job.is_done)
+            self.assertEqual(10, job.count_done())
+            self.assertEqual(1.0, job.progress)
+
+    def test_unordered_iteration(self):
+        with ThreadPool(max_workers=4) as pool:
+            job = pool.map_all(funcs.square, range(3), (0.1, 0.06, 0.02),
+                               keep_order=False)
+            self.assertEqual((4, 1, 0), tuple(job))
+            # the job can be iterated again
+            self.assertEqual((4, 1, 0), tuple(job))
+
+    def test_next(self):
+        # map_all used to return a generator
+        with ThreadPool(max_workers=4) as pool:
+            job = pool.map_all(funcs.square, range(3))
+            self.assertEqual(0, next(job))
+            self.assertEqual(1, next(job))
+            self.assertEqual(4, next(job))
+            with self.assertRaises(StopIteration):
+                next(job)
+            job = pool.starmap_all(funcs.add, ((1, 2), (3, 4)))
+            self.assertEqual((3, 7), tuple(next(job) for _ in range(2)))
+
+    def test_remote_exception(self):
+        with ThreadPool(max_workers=4) as pool:
+            job = pool.map_all(funcs.divide, (1, 2, 3), (1, 0, 1))
+            self.assertEqual(1, job[0])
+            self.assertEqual(3, job[2])
+            with self.assertRaises(ZeroDivisionError):
+                job[1]
+            with self.assertRaises(ZeroDivisionError):
+                tuple(job)
+
+    def test_cancel(self):
+        with ThreadPool(max_workers=1) as pool:
+            job = pool.map_all(funcs.square, range(5), [0.05 for _ in range(5)])
+            job.cancel()
+            self.assertTrue(job.cancel_flag)
+            self.assertTrue(job.wait(timeout=5))
+            with self.assertRaises(errors.CancelledError):
+                job[4]
+
+    def test_cancel_linked_futures(self):
+        # the probes of "auto" chunks are futures linked to the job
+        job = MapJob(None)
+        future = Future(None, 1)
+        job._link_future(future)
+        job.cancel()
+        self.assertTrue(future.cancel_flag)
+        # a future linked to a cancelled job is cancelled right away
+        future = Future(None, 2)
+        job._link_future(future)
+        self.assertTrue(future.cancel_flag)
+
+
 def dummy_callback_1(future):
     pass
 
@@ -19,7 +19,11 @@ class TestImports(unittest.TestCase):
             from asyncpal import QuadProcessPool
             from asyncpal import Future
             from asyncpal import FutureFilter
+            from asyncpal import MapJob
             from asyncpal import Countdown
+            from asyncpal import Serializer
+            from asyncpal import PickleSerializer
+            from asyncpal import CloudpickleSerializer
             # import functions
             from asyncpal import as_done
             from asyncpal import wait
@@ -40,6 +44,7 @@ class TestImports(unittest.TestCase):
             from asyncpal import FinalizerError
             from asyncpal import InvalidStateError
             from asyncpal import CancelledError
+            from asyncpal import WorkerCrashError
         except ImportError:
             self.assertTrue(False)
 
@@ -64,6 +64,11 @@ class TestGetChunksFunction(unittest.TestCase):
                     raise Exception
             i += 1
 
+    def test_with_callable_chunk_size(self):
+        sizes = iter((1, 2, 3))
+        r = tuple(misc.get_chunks(range(6), chunk_size=lambda: next(sizes)))
+        self.assertEqual(((0, ), (1, 2), (3, 4, 5)), r)
+
 
 class TestEnsureArgsKwargs(unittest.TestCase):
 
@@ -140,6 +145,21 @@ class TestAddFunction(unittest.TestCase):
                 self.assertEqual(x+x, r)
 
 
+class TestUpdateCounterFunction(unittest.TestCase):
+
+    def test_with_thread_counter(self):
+        counter = misc.Counter()
+        misc.update_counter(counter, 2)
+        misc.update_counter(counter, -1)
+        self.assertEqual(1, counter.value)
+
+    def test_with_process_counter(self):
+        counter = MP_CONTEXT.Value("i", 0)
+        misc.update_counter(counter, 2)
+        misc.update_counter(counter, -1)
+        self.assertEqual(1, counter.value)
+
+
 class TestCountdownClass(unittest.TestCase):
 
     def test_with_null_timeout(self):
@@ -168,6 +188,58 @@ class TestCountdownClass(unittest.TestCase):
         self.assertGreater(r, 0)
 
 
+class TestChunkSizerClass(unittest.TestCase):
+
+    def test_initial_chunk_size(self):
+        sizer = misc.ChunkSizer()
+        self.assertEqual(1, sizer())
+        self.assertFalse(sizer.is_settled)
+
+    def test_with_tiny_tasks(self):
+        sizer = misc.ChunkSizer(overhead_ratio=0.1, max_chunk_size=4096)
+        # 1 ms of overhead for a task that takes 10 µs per element
+        sizer.update(1, overhead=0.001, task_duration=0.00001)
+        self.assertEqual(1000, sizer())
+
+    def test_with_long_tasks(self):
+        sizer = misc.ChunkSizer(overhead_ratio=0.1)
+        sizer.update(1, overhead=0.001, task_duration=1)
+        self.assertEqual(1, sizer())
+        self.assertTrue(sizer.is_settled)
+
+    def test_max_chunk_size(self):
+        sizer = misc.ChunkSizer(max_chunk_size=64)
+        sizer.update(10, overhead=0.001, task_duration=0)
+        self.assertEqual(64, sizer())
+
+    def test_overhead_floor(self):
+        sizer = misc.ChunkSizer(overhead_ratio=0.1, n_probes=3)
+        sizer.update(10, overhead=0.001, task_duration=0.001)
+        self.assertEqual(100, sizer())
+        sizer.update(100, overhead=0.5, task_duration=0.02)  # queued chunk
+        self.assertEqual(67, sizer())
+        self.assertFalse(sizer.is_settled)
+        sizer.update(100, overhead=0.002, task_duration=0.01)
+        self.assertTrue(sizer.is_settled)
+
+
+class TestGuidedChunkSizerClass(unittest.TestCase):
+
+    def test_decreasing_chunk_sizes(self):
+        sizer = misc.GuidedChunkSizer(100, n_workers=4)
+        r = tuple(len(chunk) for chunk in misc.get_chunks(range(100), sizer))
+        self.assertEqual(100, sum(r))
+        self.assertEqual(13, r[0])
+        self.assertEqual(1, r[-1])
+        self.assertEqual(sorted(r, reverse=True), list(r))
+
+    def test_min_chunk_size(self):
+        sizer = misc.GuidedChunkSizer(100, n_workers=4, min_chunk_size=5)
+        r = tuple(len(chunk) for chunk in misc.get_chunks(range(100), sizer))
+        self.assertEqual(100, sum(r))
+        self.assertTrue(all(x >= 5 for x in r[:-1]))
+
+
 class TestSplitMapTask(unittest.TestCase):
 
     def test_without_chunk_size(self):
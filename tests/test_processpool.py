@@ -1,11 +1,24 @@
+import os
 import unittest
 import time
+import tempfile
+import queue
+from unittest import mock
 import itertools
-from asyncpal import errors
+import pickle
+import threading
+from asyncpal import errors, misc
+from asyncpal.future import Status, LazyResult
+from asyncpal import transport
+from asyncpal.transport import Ring
 from tests import funcs
 from asyncpal import (ProcessPool, SingleProcessPool,
                       DualProcessPool, TripleProcessPool,
-                      QuadProcessPool)
+                      QuadProcessPool, Serializer, PickleSerializer,
+                      CloudpickleSerializer, Countdown)
+from asyncpal.serializer import cloudpickle
+from asyncpal.pool.processpool import MAX_STARTUP_CRASHES
+from asyncpal.worker.processworker import get_task
 
 
 class TestWorkers(unittest.TestCase):
@@ -201,6 +214,49 @@ class TestSubmitMethod(unittest.TestCase):
             pool.submit(funcs.add, 1, 2)
 
 
+class TestSubmitManyMethod(unittest.TestCase):
+
+    def test_submit_many_to_pool(self):
+        with ProcessPool(max_workers=4) as pool:
+            futures = pool.submit_many(funcs.add, zip(range(10), range(10)))
+            r = tuple(future.collect() for future in futures)
+            expected = tuple(itertools.starmap(funcs.add, zip(range(10), range(10))))
+            self.assertEqual(expected, r)
+            self.assertLessEqual(pool.count_workers(), 4)
+
+    def test_submit_many_to_closed_pool(self):
+        with ProcessPool() as pool:
+            pass
+        with self.assertRaises(RuntimeError):
+            pool.submit_many(funcs.add, [(1, 2)])
+
+
+class TestBatchMethod(unittest.TestCase):
+
+    def test_batch(self):
+        with ProcessPool(max_workers=4) as pool:
+            with pool.batch():
+                futures = [pool.submit(funcs.add, i, i) for i in range(10)]
+                self.assertEqual(0, pool.count_workers())
+            r = tuple(future.collect() for future in futures)
+            expected = tuple(map(funcs.add, range(10), range(10)))
+            self.assertEqual(expected, r)
+            self.assertLessEqual(pool.count_workers(), 4)
+
+    def test_collect_inside_batch(self):
+        with ProcessPool(max_workers=2) as pool:
+            with pool.batch():
+                future = pool.submit(funcs.add, 1, 2)
+                self.assertEqual(3, future.collect(timeout=30))
+
+    def test_batch_with_closed_pool(self):
+        with ProcessPool() as pool:
+            pass
+        with self.assertRaises(RuntimeError):
+            with pool.batch():
+                pass
+
+
 class TestProperties(unittest.TestCase):
 
     def test_closed_property(self):
@@ -236,6 +292,18 @@ class TestLazyMapMethod(unittest.TestCase):
             self.assertEqual(expected, r)
             self.assertLessEqual(pool.count_workers(), 2)
 
+    def test_with_auto_chunk_size(self):
+        with ProcessPool(max_workers=4) as pool:
+            r = tuple(pool.map(funcs.square, range(100), chunk_size="auto"))
+            expected = tuple(map(funcs.square, range(100)))
+            self.assertEqual(expected, r)
+
+    def test_with_guided_chunk_size(self):
+        with ProcessPool(max_workers=4) as pool:
+            r = tuple(pool.map(funcs.square, range(100), chunk_size="guided"))
+            expected = tuple(map(funcs.square, range(100)))
+            self.assertEqual(expected, r)
+
     def test_with_buffer_size(self):
         # as processes aren't as reactive as threads, one extra process
         # might be spawn, that's why instead of 3 (the buffer size),
@@ -257,6 +325,30 @@ class TestLazyMapMethod(unittest.TestCase):
             self.assertEqual(expected, r)
             self.assertLessEqual(pool.count_workers(), 3)
 
+    def test_with_max_in_flight(self):
+        with ProcessPool(max_workers=4) as pool:
+            sleeps = (0.3, 0, 0, 0, 0, 0)
+            r = tuple(pool.map(funcs.square, range(6), sleeps,
+                               max_in_flight=2, buffer_size=4))
+            expected = tuple(map(funcs.square, range(6)))
+            self.assertEqual(expected, r)
+
+    def test_with_feeder(self):
+        with ProcessPool(max_workers=4) as pool:
+            r = tuple(pool.map(funcs.square, range(10), buffer_size=2,
+                               feeder=True))
+            expected = tuple(map(funcs.square, range(10)))
+            self.assertEqual(expected, r)
+
+    def test_with_fail_fast(self):
+        with ProcessPool(max_workers=4) as pool:
+            pool.spawn_max_workers()
+            t = time.monotonic()
+            with self.assertRaises(ZeroDivisionError):
+                tuple(pool.map(funcs.divide, (1, 1, 1), (1, 1, 0),
+                               (1, 1, 0), buffer_size=3, fail_fast=True))
+            self.assertLess(time.monotonic() - t, 0.9)
+
     def test_with_unexpired_timeout(self):
         with ProcessPool(max_workers=4) as pool:
             r = tuple(pool.map(funcs.square, range(10), timeout=1))
@@ -288,6 +380,19 @@ class TestEagerMapMethod(unittest.TestCase):
             self.assertEqual(expected, r)
             self.assertLessEqual(pool.count_workers(), 2)
 
+    def test_with_auto_chunk_size(self):
+        with ProcessPool(max_workers=4) as pool:
+            r = tuple(pool.map_all(funcs.square, range(100), chunk_size="auto"))
+            expected = tuple(map(funcs.square, range(100)))
+            self.assertEqual(expected, r)
+
+    def test_with_guided_chunk_size(self):
+        with ProcessPool(max_workers=4) as pool:
+            job = pool.map_all(funcs.square, range(100), chunk_size="guided")
+            expected = tuple(map(funcs.square, range(100)))
+            self.assertEqual(expected, tuple(job))
+            self.assertEqual(100, len(job))
+
     def test_with_unordered_result(self):
         with ProcessPool(max_workers=4) as pool:
             r = tuple(pool.map_all(funcs.square, range(3),
@@ -311,6 +416,14 @@ class TestEagerMapMethod(unittest.TestCase):
                                    [0.02 for _ in range(5)],  # sleep for 0.01 s
                                    timeout=0.01))
 
+    def test_job_handle(self):
+        with ProcessPool(max_workers=4) as pool:
+            job = pool.map_all(funcs.square, range(10), chunk_size=3)
+            self.assertEqual(10, len(job))
+            self.assertEqual(81, job[9])
+            self.assertEqual(tuple(map(funcs.square, range(10))), job.collect())
+            self.assertEqual(1.0, job.progress)
+
 
 class TestLazyStarmapMethod(unittest.TestCase):
 
@@ -328,6 +441,13 @@ class TestLazyStarmapMethod(unittest.TestCase):
             self.assertEqual(expected, r)
             self.assertLessEqual(pool.count_workers(), 2)
 
+    def test_with_auto_chunk_size(self):
+        with ProcessPool(max_workers=4) as pool:
+            r = tuple(pool.starmap(funcs.add, zip(range(100), range(100)),
+                                   chunk_size="auto"))
+            expected = tuple(itertools.starmap(funcs.add, zip(range(100), range(100))))
+            self.assertEqual(expected, r)
+
     def test_with_buffer_size(self):
         # as processes aren't as reactive as threads, one extra process
         # might be spawn, that's why instead of 3 (the buffer size),
@@ -381,6 +501,13 @@ class TestEagerStarmapMethod(unittest.TestCase):
             self.assertEqual(expected, r)
             self.assertLessEqual(pool.count_workers(), 2)
 
+    def test_with_auto_chunk_size(self):
+        with ProcessPool(max_workers=4) as pool:
+            r = tuple(pool.starmap_all(funcs.add, zip(range(100), range(100)),
+                                       chunk_size="auto"))
+            expected = tuple(itertools.starmap(funcs.add, zip(range(100), range(100))))
+            self.assertEqual(expected, r)
+
     def test_with_unordered_result(self):
         with ProcessPool(max_workers=4) as pool:
             r = tuple(pool.starmap_all(funcs.add, zip(range(3), range(3),
@@ -512,6 +639,869 @@ class TestMaxTasksByWorker(unittest.TestCase):
             self.assertEqual(0, pool.count_workers())
 
 
+class TestResultMessages(unittest.TestCase):
+
+    def test_without_notify_running(self):
+        with ProcessPool(max_workers=2, notify_running=False) as pool:
+            future = pool.submit(funcs.square, 4, sleep=0.1)
+            self.assertEqual(16, future.collect())
+            self.assertEqual(Status.COMPLETED, future.status)
+            pending_duration, task_duration = future.duration
+            self.assertGreaterEqual(task_duration, 0.1)
+            self.assertGreaterEqual(pending_duration, task_duration)
+
+    def test_with_batched_results(self):
+        with ProcessPool(max_workers=2, result_batch_size=8) as pool:
+            futures = pool.submit_many(funcs.square, ((x, ) for x in range(100)))
+            r = tuple(future.collect() for future in futures)
+            self.assertEqual(tuple(map(funcs.square, range(100))), r)
+
+    def test_with_unbatched_results(self):
+        with ProcessPool(max_workers=2, result_batch_size=1) as pool:
+            r = tuple(pool.map(funcs.square, range(10)))
+            self.assertEqual(tuple(map(funcs.square, range(10))), r)
+
+    def test_flush_interval(self):
+        with ProcessPool(max_workers=1, result_flush_interval=0.05) as pool:
+            with pool.batch():
+                future_a = pool.submit(funcs.square, 2)
+                future_b = pool.submit(funcs.square, 3, sleep=2)
+            self.assertEqual(4, future_a.collect(timeout=1))
+            self.assertFalse(future_b.is_done)
+
+    def test_flush_before_blocking(self):
+        # without flush interval, buffered results are flushed
+        # whenever the worker is about to wait for a task
+        task_queue = queue.Queue()
+        batcher = mock.Mock()
+        task_queue.put("task")
+        self.assertEqual("task", get_task(task_queue, 1, batcher))
+        self.assertEqual(0, batcher.flush.call_count)
+        with self.assertRaises(queue.Empty):
+            get_task(task_queue, 0.01, batcher)
+        self.assertEqual(1, batcher.flush.call_count)
+        with ProcessPool(max_workers=2, result_batch_size=8,
+                         result_flush_interval=None) as pool:
+            self.assertEqual(4, pool.submit(funcs.square, 2).collect(timeout=5))
+
+
+class TestTaskBatches(unittest.TestCase):
+
+    def test_with_batched_tasks(self):
+        with ProcessPool(max_workers=2, task_batch_size=16) as pool:
+            futures = pool.submit_many(funcs.square, ((x, ) for x in range(100)))
+            r = tuple(future.collect() for future in futures)
+            self.assertEqual(tuple(map(funcs.square, range(100))), r)
+
+    def test_with_unbatched_tasks(self):
+        with ProcessPool(max_workers=2, task_batch_size=1) as pool:
+            futures = pool.submit_many(funcs.square, ((x, ) for x in range(10)))
+            r = tuple(future.collect() for future in futures)
+            self.assertEqual(tuple(map(funcs.square, range(10))), r)
+
+    def test_with_max_tasks_per_worker(self):
+        with ProcessPool(max_workers=2, max_tasks_per_worker=2) as pool:
+            self.assertEqual(1, pool.task_batch_size)
+            futures = pool.submit_many(funcs.square, ((x, ) for x in range(10)))
+            r = tuple(future.collect() for future in futures)
+            self.assertEqual(tuple(map(funcs.square, range(10))), r)
+
+    def test_cancelled_tasks_on_shutdown(self):
+        pool = ProcessPool(max_workers=1, task_batch_size=4)
+        futures = pool.submit_many(funcs.square, ((x, 0.01) for x in range(50)))
+        pool.shutdown()
+        n_done = sum(1 for future in futures if future.is_completed)
+        n_cancelled = sum(1 for future in futures if future.is_cancelled)
+        self.assertEqual(50, n_done + n_cancelled)
+
+
+class TestPipeTransport(unittest.TestCase):
+
+    def test_with_invalid_transport(self):
+        with funcs.catch_unraisable() as unraisables:
+            with self.assertRaises(ValueError):
+                ProcessPool(transport="socket")
+        self.assertEqual([], unraisables)
+
+    def test_submit_and_map(self):
+        with ProcessPool(max_workers=2, transport="pipe") as pool:
+            self.assertEqual("pipe", pool.transport)
+            self.assertEqual(3, pool.submit(funcs.add, 1, 2).collect())
+            r = tuple(pool.map(funcs.square, range(100), chunk_size=4))
+            self.assertEqual(tuple(map(funcs.square, range(100))), r)
+            futures = pool.submit_many(funcs.square, ((x, ) for x in range(100)))
+            r = tuple(future.collect() for future in futures)
+            self.assertEqual(tuple(map(funcs.square, range(100))), r)
+
+    def test_join_then_reuse(self):
+        with ProcessPool(max_workers=2, transport="pipe") as pool:
+            pool.spawn_max_workers()
+            pool.join()
+            self.assertEqual(0, pool.count_workers())
+            self.assertEqual(4, pool.submit(funcs.square, 2).collect())
+
+    def test_with_max_tasks_per_worker(self):
+        # outstanding tasks of a worker that closes are sent to a new one
+        with ProcessPool(max_workers=2, max_tasks_per_worker=2,
+                         transport="pipe") as pool:
+            futures = pool.submit_many(funcs.square, ((x, 0.01) for x in range(20)))
+            r = tuple(future.collect() for future in futures)
+            self.assertEqual(tuple(map(funcs.square, range(20))), r)
+
+    def test_with_broken_initializer(self):
+        with ProcessPool(initializer=funcs.divide, init_args=(1, 0),
+                         transport="pipe") as pool:
+            with self.assertRaises(errors.CancelledError):
+                pool.submit(funcs.add, 1, 2).collect()
+            with self.assertRaises(errors.InitializerError):
+                pool.check()
+
+    def test_cancelled_tasks_on_shutdown(self):
+        pool = ProcessPool(max_workers=1, transport="pipe")
+        futures = pool.submit_many(funcs.square, ((x, 0.01) for x in range(50)))
+        pool.shutdown()
+        n_done = sum(1 for future in futures if future.is_completed)
+        n_cancelled = sum(1 for future in futures if future.is_cancelled)
+        self.assertEqual(50, n_done + n_cancelled)
+
+
+class TestShmTransport(unittest.TestCase):
+
+    def test_ring(self):
+        data = pickle.dumps(b"x" * 10)
+        n = len(data)
+        ring = Ring(size=3*n + n//2)
+        try:
+            a = ring.write(data)
+            b = ring.write(data)
+            c = ring.write(data)
+            # not enough free space
+            self.assertIsNone(ring.write(data))
+            self.assertEqual(b"x" * 10, ring.read(*a))
+            # the payload can't fit before the end of the ring,
+            # therefore it is written at the start of the ring
+            d = ring.write(data)
+            self.assertEqual(a[0], d[0])
+            for notice in (b, c, d):
+                self.assertEqual(b"x" * 10, ring.read(*notice))
+        finally:
+            ring.close()
+
+    def test_submit_and_map(self):
+        with ProcessPool(max_workers=2, transport="shm") as pool:
+            self.assertEqual("shm", pool.transport)
+            self.assertEqual(3, pool.submit(funcs.add, 1, 2).collect())
+            r = tuple(pool.map(funcs.square, range(100), chunk_size=4))
+            self.assertEqual(tuple(map(funcs.square, range(100))), r)
+
+    def test_ring_size(self):
+        data = b"x" * 10000
+        with ProcessPool(max_workers=1, transport="shm",
+                         ring_size=4096) as pool:
+            self.assertEqual(4096, pool.ring_size)
+            # small payloads use the ring, large ones the pipe
+            self.assertEqual(3, pool.submit(funcs.add, 1, 2).collect())
+            self.assertEqual(data + data, pool.submit(funcs.add, data, data).collect())
+            pool.test()
+
+    def test_with_large_payloads(self):
+        data = b"x" * 2**20
+        with ProcessPool(max_workers=2, transport="shm") as pool:
+            futures = pool.submit_many(funcs.add, ((data, data) for _ in range(40)))
+            for future in futures:
+                self.assertEqual(data + data, future.collect())
+
+
+class TestOutOfBandBuffers(unittest.TestCase):
+
+    def test_dumps(self):
+        size = transport.OUT_OF_BAND_SIZE
+        obj = transport.expose_buffers([bytearray(size), bytearray(10),
+                                        b"x" * size])
+        data, buffers = transport.dumps(obj)
+        # small buffers and bytes objects are pickled in-band
+        self.assertEqual(1, len(buffers))
+        self.assertEqual(size, len(buffers[0]))
+        r = pickle.loads(data, buffers=[bytearray(x) for x in buffers])
+        self.assertEqual([bytearray(size), bytearray(10), b"x" * size], r)
+        self.assertIs(bytearray, type(r[0]))
+
+    def test_expose_buffers(self):
+        size = transport.OUT_OF_BAND_SIZE
+        obj = bytearray(size)
+        self.assertIsInstance(transport.expose_buffers(obj), pickle.PickleBuffer)
+        obj = (1, bytearray(10))
+        self.assertIs(obj, transport.expose_buffers(obj))
+
+    def test_dispatch_table(self):
+        # the table is built once, and again when a reducer is registered
+        table = transport._get_dispatch_table()
+        self.assertIs(table, transport._get_dispatch_table())
+        reducer = lambda obj: (Countdown, ())
+        with mock.patch.dict(transport.ForkingPickler._extra_reducers,
+                             {Countdown: reducer}):
+            new_table = transport._get_dispatch_table()
+            self.assertIsNot(table, new_table)
+            self.assertIs(reducer, new_table[Countdown])
+
+    def test_chunked_map(self):
+        # the args held by a subtask are pickled out-of-band
+        size = transport.OUT_OF_BAND_SIZE
+        with ProcessPool(max_workers=1, transport="pipe") as pool:
+            chunk = ((bytearray(size), ), (bytearray(10), ))
+            task = (1, misc.get_subtask(len, chunk), tuple(), dict())
+            subtask = pool._prepare_task(task)[1]
+            data, buffers = transport.dumps(subtask)
+            self.assertEqual(1, len(buffers))
+            subtask = pickle.loads(data, buffers=[bytearray(x) for x in buffers])
+            self.assertEqual([size, 10], subtask())
+            r = tuple(pool.map(len, (bytearray(size), bytearray(10)),
+                               chunk_size=2))
+            self.assertEqual((size, 10), r)
+
+    def test_with_pipe_and_shm_transports(self):
+        size = transport.OUT_OF_BAND_SIZE
+        for name in ("pipe", "shm"):
+            with self.subTest(transport=name):
+                with ProcessPool(max_workers=2, transport=name) as pool:
+                    r = pool.submit(funcs.create_bytearray, size).collect()
+                    self.assertEqual(bytearray(size), r)
+                    # chunked map
+                    r = tuple(pool.map(funcs.create_bytearray, (size, 10, size),
+                                       chunk_size=2))
+                    self.assertEqual((bytearray(size), bytearray(10),
+                                      bytearray(size)), r)
+                    # remote exception
+                    future = pool.submit(funcs.create_bytearray, size, True)
+                    with self.assertRaises(ValueError):
+                        future.collect()
+                    # task argument
+                    r = pool.submit(len, bytearray(size)).collect()
+                    self.assertEqual(size, r)
+
+
+class TestSharedMemorySpill(unittest.TestCase):
+
+    def test_arguments(self):
+        with ProcessPool(max_workers=1, shm_threshold=1000) as pool:
+            self.assertEqual(1000, pool.shm_threshold)
+            for obj in (b"x" * 2000, bytearray(2000), memoryview(b"x" * 2000),
+                        b"x" * 10):
+                r = pool.submit(funcs.get_type_name, obj).collect()
+                self.assertEqual(type(obj).__name__, r)
+            r = pool.submit(funcs.get_type_name, obj=b"x" * 2000).collect()
+            self.assertEqual("bytes", r)
+
+    def test_retained_segments(self):
+        # a segment still referenced by a memoryview is closed
+        # by a later release, once the memoryview is gone
+        segments = list()
+        payload = transport.spill_payload(memoryview(b"x" * 2000), 1000, segments)
+        view = transport.load_payload(payload, segments)
+        transport.release_segments(segments[1:])
+        self.assertEqual(1, len(transport._RETAINED_SEGMENTS))
+        view.release()
+        transport.release_segments(segments[:1], unlink=True)
+        self.assertEqual(0, len(transport._RETAINED_SEGMENTS))
+
+    def test_results(self):
+        with ProcessPool(max_workers=1, shm_threshold=1000) as pool:
+            for obj in (b"x" * 2000, bytearray(2000), b"x" * 10):
+                r = pool.submit(funcs.identity, obj).collect()
+                self.assertIs(type(obj), type(r))
+                self.assertEqual(obj, r)
+            obj = memoryview(bytearray(range(200)) * 10).cast("H")
+            r = pool.submit(funcs.identity, obj).collect()
+            self.assertEqual("H", r.format)
+            self.assertEqual(obj.tolist(), r.tolist())
+
+    def test_with_map(self):
+        data = [bytes([x]) * 2000 for x in range(20)]
+        with ProcessPool(max_workers=2, shm_threshold=1000,
+                         transport="pipe") as pool:
+            r = tuple(pool.map(funcs.identity, data))
+            self.assertEqual(tuple(data), r)
+
+
+class TestSerializer(unittest.TestCase):
+
+    def test_pickle_serializer(self):
+        serializer = PickleSerializer(protocol=2)
+        self.assertEqual(2, serializer.protocol)
+        with ProcessPool(max_workers=2, serializer=serializer,
+                         initializer=funcs.add, init_args=(1, 2),
+                         finalizer=funcs.add, final_args=(1, 2)) as pool:
+            self.assertIs(serializer, pool.serializer)
+            self.assertEqual(3, pool.submit(funcs.add, 1, b=2).collect())
+            r = tuple(pool.map(funcs.square, range(100), chunk_size=4))
+            self.assertEqual(tuple(map(funcs.square, range(100))), r)
+            # remote exception
+            with self.assertRaises(ZeroDivisionError):
+                pool.submit(funcs.divide, 1, 0).collect()
+            # an argument that can't be serialized
+            future = pool.submit(funcs.identity, threading.Lock())
+            with self.assertRaises(TypeError):
+                future.collect()
+            pool.test()
+
+    def test_custom_serializer(self):
+        serializer = Serializer(pickle.dumps, pickle.loads)
+        for name in ("queue", "pipe", "shm"):
+            with self.subTest(transport=name):
+                with ProcessPool(max_workers=2, transport=name,
+                                 shm_threshold=1000,
+                                 serializer=serializer) as pool:
+                    data = b"x" * 2000
+                    r = pool.submit(funcs.add, data, data).collect()
+                    self.assertEqual(data + data, r)
+                    futures = pool.submit_many(funcs.square, ((x, ) for x in range(50)))
+                    r = tuple(future.collect() for future in futures)
+                    self.assertEqual(tuple(map(funcs.square, range(50))), r)
+
+    def test_broken_initializer(self):
+        serializer = PickleSerializer()
+        with ProcessPool(initializer=funcs.divide, init_args=(1, 0),
+                         serializer=serializer) as pool:
+            with self.assertRaises(errors.CancelledError):
+                pool.submit(funcs.add, 1, 2).collect()
+            with self.assertRaises(errors.BrokenPoolError):
+                pool.submit(funcs.add, 1, 2)
+
+    def test_cancelled_tasks(self):
+        pool = ProcessPool(max_workers=1, serializer=PickleSerializer())
+        for _ in range(10):
+            pool.submit(funcs.add, 1, 2, sleep=0.01)
+        pool.shutdown()
+        for target, args, kwargs in pool.cancelled_tasks:
+            self.assertIs(funcs.add, target)
+            self.assertEqual((1, 2), args)
+            self.assertEqual({"sleep": 0.01}, kwargs)
+
+    def test_cancelled_requeued_tasks(self):
+        # tasks sent back to the task queue after the
+        # shutdown of a worker are encoded
+        pool = ProcessPool(max_workers=1, transport="pipe", prefetch=4,
+                           max_tasks_per_worker=1,
+                           serializer=PickleSerializer())
+        futures = [pool.submit(funcs.add, 1, 2, sleep=0.3) for _ in range(10)]
+        futures[0].wait(10)
+        time.sleep(0.1)
+        pool.shutdown()
+        self.assertTrue(pool.cancelled_tasks)
+        for target, args, kwargs in pool.cancelled_tasks:
+            self.assertIs(funcs.add, target)
+            self.assertEqual((1, 2), args)
+            self.assertEqual({"sleep": 0.3}, kwargs)
+
+    @unittest.skipUnless(cloudpickle, "requires cloudpickle")
+    def test_cloudpickle_serializer(self):
+        serializer = CloudpickleSerializer()
+        with ProcessPool(max_workers=2, serializer=serializer) as pool:
+            r = pool.submit(lambda x: x * 2, 21).collect()
+            self.assertEqual(42, r)
+
+    @unittest.skipIf(cloudpickle, "cloudpickle is installed")
+    def test_cloudpickle_serializer_without_cloudpickle(self):
+        with self.assertRaises(ImportError):
+            CloudpickleSerializer()
+
+
+class TestSerializeOnSubmit(unittest.TestCase):
+
+    def test_submit(self):
+        with ProcessPool(max_workers=2, serialize_on_submit=True) as pool:
+            self.assertTrue(pool.serialize_on_submit)
+            self.assertIsInstance(pool.serializer, PickleSerializer)
+            self.assertEqual(3, pool.submit(funcs.add, 1, b=2).collect())
+            with mock.patch.object(pool, "_encode_task",
+                                   wraps=pool._encode_task) as encode_task:
+                self.assertEqual(3, pool.run(funcs.add, 1, b=2))
+            encode_task.assert_called_once()
+            futures = pool.submit_many(funcs.square, ((x, ) for x in range(50)))
+            r = tuple(future.collect() for future in futures)
+            self.assertEqual(tuple(map(funcs.square, range(50))), r)
+            r = tuple(pool.map(funcs.square, range(50), chunk_size=4))
+            self.assertEqual(tuple(map(funcs.square, range(50))), r)
+            with pool.batch():
+                future = pool.submit(funcs.add, 1, 2)
+            self.assertEqual(3, future.collect())
+            pool.test()
+
+    def test_error_raised_from_submit(self):
+        with ProcessPool(max_workers=1, serialize_on_submit=True) as pool:
+            with self.assertRaises(TypeError):
+                pool.submit(funcs.identity, threading.Lock())
+            with self.assertRaises(TypeError):
+                pool.submit_many(funcs.identity, ((threading.Lock(), ), ))
+            with self.assertRaises(TypeError):
+                pool.run(funcs.identity, threading.Lock())
+            self.assertEqual(3, pool.submit(funcs.add, 1, 2).collect())
+
+    def test_with_transports_and_shm_threshold(self):
+        data = b"x" * 2000
+        for name in ("queue", "pipe", "shm"):
+            with self.subTest(transport=name):
+                with ProcessPool(max_workers=2, transport=name,
+                                 shm_threshold=1000, max_tasks_per_worker=3,
+                                 serialize_on_submit=True) as pool:
+                    futures = [pool.submit(funcs.add, data, data)
+                               for _ in range(10)]
+                    for future in futures:
+                        self.assertEqual(data + data, future.collect())
+
+    def test_cancelled_tasks(self):
+        pool = ProcessPool(max_workers=1, serialize_on_submit=True)
+        for _ in range(10):
+            pool.submit(funcs.add, 1, 2, sleep=0.01)
+        pool.shutdown()
+        for target, args, kwargs in pool.cancelled_tasks:
+            self.assertIs(funcs.add, target)
+            self.assertEqual((1, 2), args)
+            self.assertEqual({"sleep": 0.01}, kwargs)
+
+
+class TestLazyResults(unittest.TestCase):
+
+    def test_submit(self):
+        with ProcessPool(max_workers=2, lazy_results=True) as pool:
+            self.assertTrue(pool.lazy_results)
+            self.assertIsInstance(pool.serializer, PickleSerializer)
+            future = pool.submit(funcs.add, 1, 2)
+            future.wait()
+            self.assertIsInstance(future._result, LazyResult)
+            self.assertEqual(3, future.result)
+            self.assertEqual(3, future.collect())
+            futures = pool.submit_many(funcs.square, ((x, ) for x in range(50)))
+            r = tuple(future.collect() for future in futures)
+            self.assertEqual(tuple(map(funcs.square, range(50))), r)
+            r = tuple(pool.map(funcs.square, range(50), chunk_size=4))
+            self.assertEqual(tuple(map(funcs.square, range(50))), r)
+            with self.assertRaises(ZeroDivisionError):
+                pool.submit(funcs.divide, 1, 0).collect()
+            pool.test()
+
+    def test_with_shm_threshold(self):
+        data = b"x" * 2000
+        with ProcessPool(max_workers=1, shm_threshold=1000,
+                         lazy_results=True) as pool:
+            self.assertEqual(data + data, pool.submit(funcs.add, data, data).collect())
+
+    def test_decoding_error(self):
+        serializer = Serializer(pickle.dumps, funcs.loads_but_ints)
+        with ProcessPool(max_workers=1, serializer=serializer,
+                         lazy_results=True) as pool:
+            future = pool.submit(funcs.add, 1, 2)
+            future.wait()
+            # the decoding error fails the future
+            self.assertTrue(future.is_failed)
+            self.assertFalse(future.is_completed)
+            self.assertIsInstance(future.exception, ValueError)
+            with self.assertRaises(ValueError):
+                future.collect()
+            self.assertEqual("ab", pool.submit(funcs.add, "a", "b").collect())
+
+
+class TestMessageThreads(unittest.TestCase):
+
+    def test_with_transports(self):
+        for name in ("queue", "pipe", "shm"):
+            with self.subTest(transport=name):
+                with ProcessPool(max_workers=2, transport=name,
+                                 message_threads=3) as pool:
+                    self.assertEqual(3, pool.message_threads)
+                    names = [x.name for x in threading.enumerate()
+                             if x.name.startswith("asyncpal-{}-MessageThread".format(pool.name))]
+                    self.assertEqual(3, len(names))
+                    futures = pool.submit_many(funcs.square, ((x, ) for x in range(200)))
+                    r = tuple(future.collect() for future in futures)
+                    self.assertEqual(tuple(map(funcs.square, range(200))), r)
+                    r = tuple(pool.map(funcs.square, range(100), chunk_size=4))
+                    self.assertEqual(tuple(map(funcs.square, range(100))), r)
+                    with self.assertRaises(ZeroDivisionError):
+                        pool.submit(funcs.divide, 1, 0).collect()
+                    pool.test()
+                self.assertFalse(any(x.name in names for x in threading.enumerate()))
+
+    def test_callbacks(self):
+        done = list()
+        with ProcessPool(max_workers=2, message_threads=2,
+                         result_batch_size=1) as pool:
+            futures = pool.submit_many(funcs.square, ((x, ) for x in range(50)))
+            for future in futures:
+                future.add_callback(done.append)
+            for future in futures:
+                future.wait()
+        self.assertEqual(50, len(done))
+        for future in futures:
+            self.assertTrue(future.is_completed)
+
+
+class TestDirectDispatch(unittest.TestCase):
+
+    def test_with_transports(self):
+        for name in ("queue", "pipe", "shm"):
+            with self.subTest(transport=name):
+                with ProcessPool(max_workers=2, transport=name,
+                                 direct_dispatch=True) as pool:
+                    self.assertTrue(pool.direct_dispatch)
+                    pool.spawn_max_workers()
+                    for x in range(20):
+                        self.assertEqual(x**2, pool.submit(funcs.square, x).collect())
+                    futures = [pool.submit(funcs.square, x) for x in range(100)]
+                    r = tuple(future.collect() for future in futures)
+                    self.assertEqual(tuple(map(funcs.square, range(100))), r)
+                    r = tuple(pool.map(funcs.square, range(100), chunk_size=4))
+                    self.assertEqual(tuple(map(funcs.square, range(100))), r)
+                    pool.test()
+
+    def test_with_serializer(self):
+        with ProcessPool(max_workers=1, transport="pipe", shm_threshold=1000,
+                         serializer=PickleSerializer(),
+                         direct_dispatch=True) as pool:
+            pool.spawn_max_workers()
+            data = b"x" * 2000
+            futures = [pool.submit(funcs.add, data, data) for _ in range(10)]
+            for future in futures:
+                self.assertEqual(data + data, future.collect())
+            with self.assertRaises(TypeError):
+                pool.submit(funcs.identity, threading.Lock())
+            self.assertEqual(3, pool.submit(funcs.add, 1, 2).collect())
+
+    def test_order_is_kept(self):
+        # a task sent directly doesn't overtake
+        # a task held by the filter thread
+        with ProcessPool(max_workers=1, transport="pipe",
+                         direct_dispatch=True) as pool:
+            pool.spawn_max_workers()
+            release = threading.Event()
+            prepare_task = pool._prepare_task
+
+            def prepare_task_slowly(task):
+                if threading.current_thread() is pool._filter_thread:
+                    release.wait(10)
+                return prepare_task(task)
+
+            with mock.patch.object(pool, "_prepare_task", prepare_task_slowly):
+                busy = pool.submit(funcs.square, 2, 0.2)
+                # the worker is busy, the filter thread takes the task
+                held = pool.submit(time.monotonic)
+                self.assertEqual(4, busy.collect(10))
+                # the worker is idle again
+                future = pool.submit(time.monotonic)
+                release.set()
+                self.assertLess(held.collect(10), future.collect(10))
+            self.assertEqual(0, pool._n_filtered_tasks)
+
+    def test_non_blocking_put(self):
+        # without blocking, only an idle worker gets an item
+        dispatcher = transport.PipeDispatcher(1, max_outstanding=2)
+        writer = mock.Mock()
+        dispatcher.register(1, writer)
+        dispatcher.put((1, None, None, None), block=False)
+        with self.assertRaises(queue.Full):
+            dispatcher.put((2, None, None, None), block=False)
+        # a blocking put still uses the prefetch slot
+        dispatcher.put((2, None, None, None))
+        self.assertEqual(2, writer.put.call_count)
+        dispatcher.task_done(1)
+        dispatcher.task_done(2)
+        dispatcher.put((3, None, None, None), block=False)
+        self.assertEqual(3, writer.put.call_count)
+
+    def test_waiting_tasks_are_counted(self):
+        dispatcher = transport.PipeDispatcher(1, max_outstanding=1)
+        dispatcher.register(1, mock.Mock())
+        dispatcher.put((1, None, None, None))
+        thread = threading.Thread(target=dispatcher.put,
+                                  args=((2, None, None, None), ))
+        thread.start()
+        countdown = Countdown(10)
+        while dispatcher.qsize() != 2 and countdown.check():
+            time.sleep(0.01)
+        # a failed put doesn't reset the count of the waiting put
+        with self.assertRaises(queue.Full):
+            dispatcher.put((3, None, None, None), block=False)
+        self.assertEqual(2, dispatcher.qsize())
+        dispatcher.close()
+        thread.join()
+
+    def test_cancelled_tasks_on_shutdown(self):
+        pool = ProcessPool(max_workers=1, transport="pipe", direct_dispatch=True)
+        futures = [pool.submit(funcs.square, x, 0.01) for x in range(20)]
+        pool.shutdown()
+        n_done = sum(1 for future in futures if future.is_completed)
+        n_cancelled = sum(1 for future in futures if future.is_cancelled)
+        self.assertEqual(20, n_done + n_cancelled)
+
+
+class TestPrefetch(unittest.TestCase):
+
+    def test_with_transports(self):
+        for name in ("queue", "pipe", "shm"):
+            for prefetch in (0, 1, 4, "auto"):
+                if name == "queue" and prefetch in (0, "auto"):
+                    continue
+                with self.subTest(transport=name, prefetch=prefetch):
+                    with ProcessPool(max_workers=2, transport=name,
+                                     prefetch=prefetch) as pool:
+                        self.assertEqual(prefetch, pool.prefetch)
+                        futures = pool.submit_many(funcs.square, ((x, ) for x in range(100)))
+                        r = tuple(future.collect() for future in futures)
+                        self.assertEqual(tuple(map(funcs.square, range(100))), r)
+                        r = tuple(pool.map(funcs.square, range(100), chunk_size=4))
+                        self.assertEqual(tuple(map(funcs.square, range(100))), r)
+
+    def test_auto_prefetch_with_queue_transport(self):
+        with funcs.catch_unraisable() as unraisables:
+            with self.assertRaises(ValueError):
+                ProcessPool(transport="queue", prefetch="auto")
+        self.assertEqual([], unraisables)
+
+    def test_zero_prefetch_with_queue_transport(self):
+        with funcs.catch_unraisable() as unraisables:
+            with self.assertRaises(ValueError):
+                ProcessPool(transport="queue", prefetch=0)
+        self.assertEqual([], unraisables)
+
+    def test_adaptive_dispatcher(self):
+        dispatcher = transport.PipeDispatcher(2, adaptive=True)
+        self.assertTrue(dispatcher.adaptive)
+        # tiny tasks
+        for i in range(20):
+            dispatcher.task_done(i, 0.00001)
+        self.assertEqual(transport.MAX_PREFETCH + 1, dispatcher.max_outstanding)
+        # slow tasks
+        for i in range(20):
+            dispatcher.task_done(i, 1)
+        self.assertEqual(1, dispatcher.max_outstanding)
+
+
+class TestCancelTable(unittest.TestCase):
+
+    def test_cancel_tasks_held_by_workers(self):
+        for name in ("queue", "pipe", "shm"):
+            with self.subTest(transport=name):
+                with tempfile.TemporaryDirectory() as tmp_dir, \
+                        ProcessPool(max_workers=1, transport=name, prefetch=8,
+                                    task_batch_size=1) as pool:
+                    gate = os.path.join(tmp_dir, "gate")
+                    pool.spawn_max_workers()
+                    # the worker is blocked by the first task
+                    first = pool.submit(funcs.wait_for_path, gate, 4)
+                    futures = [pool.submit(funcs.square, x) for x in range(8)]
+                    self._wait_held_tasks(pool, first, 8)
+                    for future in futures:
+                        future.cancel()
+                    open(gate, "w").close()
+                    self.assertEqual(4, first.collect(10))
+                    # the tasks were skipped by the worker
+                    for future in futures:
+                        future.wait(10)
+                        self.assertTrue(future.is_cancelled)
+                    self.assertEqual(9, pool.submit(funcs.square, 3).collect(10))
+
+    def test_cancel_map_job(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                ProcessPool(max_workers=1, transport="pipe", prefetch=8,
+                            task_batch_size=1) as pool:
+            gate = os.path.join(tmp_dir, "gate")
+            pool.spawn_max_workers()
+            first = pool.submit(funcs.wait_for_path, gate, 4)
+            job = pool.map_all(funcs.square, range(8))
+            self._wait_held_tasks(pool, first, 8)
+            job.cancel()
+            open(gate, "w").close()
+            self.assertEqual(4, first.collect(10))
+            with self.assertRaises(errors.CancelledError):
+                tuple(job)
+
+    def _wait_held_tasks(self, pool, first, n):
+        # wait for the first task to run and for the next
+        # ones to leave the filter thread
+        countdown = Countdown(10)
+        while countdown.check():
+            try:
+                n_held = pool._mp_task_queue.qsize()
+            except NotImplementedError as e:  # macOS
+                n_held = n
+            if pool.transport != "queue":
+                n_held -= 1  # the running task is still outstanding
+            if first.is_running and pool._task_queue.empty() and n_held == n:
+                return
+            time.sleep(0.01)
+        self.fail("the tasks didn't reach the worker")
+
+    def test_cancel_done_future(self):
+        with ProcessPool(max_workers=1) as pool:
+            future = pool.submit(funcs.square, 2)
+            self.assertEqual(4, future.collect())
+            future.cancel()
+            self.assertTrue(future.is_completed)
+
+
+class TestTaskTimeout(unittest.TestCase):
+
+    def test_with_transports(self):
+        for name in ("pipe", "shm"):
+            with self.subTest(transport=name):
+                with ProcessPool(max_workers=2, transport=name,
+                                 task_timeout=0.5) as pool:
+                    self.assertEqual(0.5, pool.task_timeout)
+                    slow = pool.submit(funcs.square, 2, 60)
+                    futures = [pool.submit(funcs.square, x, 0.01) for x in range(20)]
+                    with self.assertRaises(TimeoutError):
+                        slow.collect(10)
+                    r = tuple(future.collect(10) for future in futures)
+                    self.assertEqual(tuple(map(funcs.square, range(20))), r)
+                    # the worker got replaced and the pool isn't broken
+                    self.assertIsNone(funcs.get_worker_exception(pool))
+                    self.assertEqual(9, pool.submit(funcs.square, 3).collect(10))
+                    # the killed worker no longer counts as busy
+                    time.sleep(0.1)
+                    self.assertEqual(0, pool._get_busy_count())
+
+    def test_with_map(self):
+        with ProcessPool(max_workers=1, transport="pipe", prefetch=4,
+                         task_timeout=0.5) as pool:
+            it = pool.map(funcs.square, (1, 2, 3), (0, 60, 0))
+            self.assertEqual(1, next(it))
+            with self.assertRaises(TimeoutError):
+                next(it)
+            self.assertEqual(9, pool.submit(funcs.square, 3).collect(10))
+
+    def test_shutdown_with_runaway_task(self):
+        pool = ProcessPool(max_workers=1, transport="pipe", task_timeout=0.5)
+        future = pool.submit(funcs.square, 2, 60)
+        start = time.monotonic()
+        pool.shutdown()
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertTrue(future.is_done)
+
+    def test_expiry_while_decoding_result(self):
+        # the supervisor claims the future while the message
+        # thread decodes its result, the pool must not break
+        serializer = Serializer(pickle.dumps, funcs.loads_slowly)
+        with ProcessPool(max_workers=1, transport="pipe", task_timeout=60,
+                         serializer=serializer) as pool:
+            future = pool.submit(funcs.identity, "slow")
+            countdown = Countdown(10)
+            while not future.is_running and countdown.check():
+                time.sleep(0.01)
+            # the result is being decoded for 1 second
+            time.sleep(0.3)
+            with pool._futures_lock:
+                claimed = pool._stored_futures.pop(future.task_id, None)
+            if claimed is not None:
+                claimed.set_exception(TimeoutError())
+            future.wait(10)
+            self.assertTrue(future.is_done)
+            self.assertEqual(9, pool.submit(funcs.square, 3).collect(10))
+            self.assertIsNone(funcs.get_worker_exception(pool))
+
+    def test_with_queue_transport(self):
+        with funcs.catch_unraisable() as unraisables:
+            with self.assertRaises(ValueError):
+                ProcessPool(transport="queue", task_timeout=1)
+        self.assertEqual([], unraisables)
+
+
+class TestWorkerCrash(unittest.TestCase):
+
+    def test_with_transports(self):
+        for name in ("pipe", "shm"):
+            for target in (funcs.crash, funcs.kill_self):
+                with self.subTest(transport=name, target=target.__name__):
+                    with ProcessPool(max_workers=2, transport=name) as pool:
+                        self.assertEqual(0, pool.crash_retries)
+                        crashed = pool.submit(target)
+                        futures = [pool.submit(funcs.square, x, 0.01)
+                                   for x in range(20)]
+                        with self.assertRaises(errors.WorkerCrashError):
+                            crashed.collect(10)
+                        r = tuple(future.collect(10) for future in futures)
+                        self.assertEqual(tuple(map(funcs.square, range(20))), r)
+                        # the worker got replaced and the pool isn't broken
+                        self.assertIsNone(funcs.get_worker_exception(pool))
+                        self.assertEqual(9, pool.submit(funcs.square, 3).collect(10))
+                        time.sleep(0.1)
+                        self.assertEqual(0, pool._get_busy_count())
+
+    def test_held_tasks_are_requeued(self):
+        with ProcessPool(max_workers=1, transport="pipe", prefetch=4) as pool:
+            crashed = pool.submit(funcs.crash)
+            futures = [pool.submit(funcs.square, x) for x in range(8)]
+            with self.assertRaises(errors.WorkerCrashError):
+                crashed.collect(10)
+            r = tuple(future.collect(10) for future in futures)
+            self.assertEqual(tuple(map(funcs.square, range(8))), r)
+
+    def test_crash_retries(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "crashed")
+            with ProcessPool(max_workers=1, transport="pipe",
+                             crash_retries=1) as pool:
+                self.assertEqual(1, pool.crash_retries)
+                future = pool.submit(funcs.crash_once, path, 42)
+                self.assertEqual(42, future.collect(10))
+                # retries are exhausted
+                future = pool.submit(funcs.crash)
+                with self.assertRaises(errors.WorkerCrashError):
+                    future.collect(10)
+                self.assertEqual(9, pool.submit(funcs.square, 3).collect(10))
+
+    def test_crash_before_ready(self):
+        # the worker is replaced, whatever the transport
+        for name in ("queue", "pipe", "shm"):
+            with self.subTest(transport=name):
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    path = os.path.join(tmp_dir, "crashed")
+                    with ProcessPool(max_workers=1, transport=name,
+                                     initializer=funcs.crash_once,
+                                     init_args=(path, None)) as pool:
+                        futures = [pool.submit(funcs.square, x)
+                                   for x in range(4)]
+                        r = tuple(future.collect(10) for future in futures)
+                        self.assertEqual((0, 1, 4, 9), r)
+                        self.assertIsNone(funcs.get_worker_exception(pool))
+
+    def test_crashing_initializer(self):
+        # workers that keep dying before they are ready break the pool
+        with ProcessPool(max_workers=1, transport="pipe",
+                         initializer=funcs.crash) as pool:
+            future = pool.submit(funcs.square, 2)
+            with self.assertRaises(errors.CancelledError):
+                future.collect(10)
+            self.assertIsInstance(funcs.get_worker_exception(pool),
+                                  errors.BrokenPoolError)
+            self.assertEqual(MAX_STARTUP_CRASHES + 1,
+                             pool._monotonic_worker_count)
+
+    def test_with_queue_transport(self):
+        # the task fails and the pool gets broken
+        with ProcessPool(max_workers=2, transport="queue") as pool:
+            future = pool.submit(funcs.crash)
+            with self.assertRaises(errors.WorkerCrashError):
+                future.collect(10)
+            time.sleep(0.1)
+            self.assertIsInstance(funcs.get_worker_exception(pool),
+                                  errors.BrokenPoolError)
+        with funcs.catch_unraisable() as unraisables:
+            with self.assertRaises(ValueError):
+                ProcessPool(transport="queue", crash_retries=1)
+        self.assertEqual([], unraisables)
+
+    def test_watchdog(self):
+        # only the queue transport needs the watchdog
+        with ProcessPool(max_workers=1, transport="queue") as pool:
+            self.assertIsNotNone(pool._watchdog_thread)
+            self.assertIsNotNone(pool._watchdog_reader)
+        for name in ("pipe", "shm"):
+            with self.subTest(transport=name):
+                with ProcessPool(max_workers=1, transport=name) as pool:
+                    self.assertIsNone(pool._watchdog_thread)
+                    self.assertIsNone(pool._watchdog_reader)
+
+
 class TestSizedPools(unittest.TestCase):
 
     def test_single_process_pool(self):
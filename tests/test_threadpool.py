@@ -1,7 +1,8 @@
 import unittest
 import time
 import itertools
-from asyncpal import errors
+import threading
+from asyncpal import errors, as_done
 from tests import funcs
 from asyncpal.pool.threadpool import (ThreadPool, SingleThreadPool,
                                       DualThreadPool, TripleThreadPool,
@@ -170,6 +171,33 @@ class TestRunMethod(unittest.TestCase):
         with self.assertRaises(RuntimeError):
             pool.run(funcs.add, 1, 2)
 
+    def test_concurrent_runs(self):
+        with ThreadPool(max_workers=2) as pool:
+            thread = threading.Thread(target=pool.run, args=(funcs.add, 1, 2),
+                                      kwargs={"sleep": 0.5})
+            thread.start()
+            time.sleep(0.05)
+            instant_a = time.monotonic()
+            r = pool.run(funcs.add, 3, 4)
+            t = time.monotonic() - instant_a
+            thread.join()
+            self.assertEqual(7, r)
+            self.assertLess(t, 0.4)
+
+    def test_caller_runs(self):
+        with ThreadPool(max_workers=1, caller_runs=True) as pool:
+            future = pool.submit(funcs.add, 1, 2, sleep=0.2)
+            while not pool.count_busy_workers():
+                time.sleep(0.001)
+            r = pool.run(threading.get_ident)
+            self.assertEqual(threading.get_ident(), r)
+            self.assertEqual(3, future.collect())
+
+    def test_caller_runs_with_free_worker(self):
+        with ThreadPool(max_workers=1, caller_runs=True) as pool:
+            r = pool.run(threading.get_ident)
+            self.assertNotEqual(threading.get_ident(), r)
+
 
 class TestSubmitMethod(unittest.TestCase):
 
@@ -197,6 +225,53 @@ class TestSubmitMethod(unittest.TestCase):
             pool.submit(funcs.add, 1, 2)
 
 
+class TestSubmitManyMethod(unittest.TestCase):
+
+    def test_submit_many_to_pool(self):
+        with ThreadPool(max_workers=4) as pool:
+            futures = pool.submit_many(funcs.add, zip(range(10), range(10)))
+            r = tuple(future.collect() for future in futures)
+            expected = tuple(itertools.starmap(funcs.add, zip(range(10), range(10))))
+            self.assertEqual(expected, r)
+            self.assertLessEqual(pool.count_workers(), 4)
+
+    def test_submit_many_to_closed_pool(self):
+        with ThreadPool() as pool:
+            pass
+        with self.assertRaises(RuntimeError):
+            pool.submit_many(funcs.add, [(1, 2)])
+
+
+class TestBatchMethod(unittest.TestCase):
+
+    def test_batch(self):
+        with ThreadPool(max_workers=4) as pool:
+            with pool.batch():
+                futures = [pool.submit(funcs.add, i, i) for i in range(10)]
+                self.assertEqual(0, pool.count_workers())
+            r = tuple(future.collect() for future in futures)
+            expected = tuple(map(funcs.add, range(10), range(10)))
+            self.assertEqual(expected, r)
+            self.assertLessEqual(pool.count_workers(), 4)
+
+    def test_collect_inside_batch(self):
+        with ThreadPool(max_workers=4) as pool:
+            with pool.batch():
+                future = pool.submit(funcs.add, 1, 2)
+                self.assertEqual(3, future.collect(timeout=5))
+                futures = [pool.submit(funcs.add, i, i) for i in range(3)]
+                r = sorted(future.collect() for future in
+                           as_done(futures, keep_order=False, timeout=5))
+                self.assertEqual([0, 2, 4], r)
+
+    def test_batch_with_closed_pool(self):
+        with ThreadPool() as pool:
+            pass
+        with self.assertRaises(RuntimeError):
+            with pool.batch():
+                pass
+
+
 class TestProperties(unittest.TestCase):
 
     def test_closed_property(self):
@@ -232,6 +307,40 @@ class TestLazyMapMethod(unittest.TestCase):
             self.assertEqual(expected, r)
             self.assertLessEqual(pool.count_workers(), 2)
 
+    def test_with_auto_chunk_size(self):
+        with ThreadPool(max_workers=4) as pool:
+            r = tuple(pool.map(funcs.square, range(100), chunk_size="auto"))
+            expected = tuple(map(funcs.square, range(100)))
+            self.assertEqual(expected, r)
+
+    def test_auto_chunk_size_with_timeout(self):
+        with ThreadPool(max_workers=1) as pool:
+            job = pool.map_all(funcs.square, range(100), [0.2 for _ in range(100)],
+                               chunk_size="auto", timeout=0.1)
+            # the probe timed out, the other chunks aren't enqueued
+            self.assertLess(len(job), 100)
+            self.assertEqual(0, pool.count_pending_tasks())
+            with self.assertRaises(TimeoutError):
+                tuple(job)
+
+    def test_auto_chunk_size_probes(self):
+        # a probe runs on each worker, the probes that
+        # are still in flight on timeout are cancelled
+        with ThreadPool(max_workers=2) as pool:
+            job = pool.map_all(funcs.square, range(100), [0.2 for _ in range(100)],
+                               chunk_size="auto", timeout=0.1)
+            self.assertEqual(2, len(job))
+            for i in range(2):
+                with self.assertRaises(TimeoutError):
+                    job[i]
+            self.assertEqual(0, pool.count_pending_tasks())
+
+    def test_with_guided_chunk_size(self):
+        with ThreadPool(max_workers=4) as pool:
+            r = tuple(pool.map(funcs.square, range(100), chunk_size="guided"))
+            expected = tuple(map(funcs.square, range(100)))
+            self.assertEqual(expected, r)
+
     def test_with_buffer_size(self):
         with ThreadPool(max_workers=4) as pool:
             r = tuple(pool.map(funcs.square, range(10), chunk_size=1,
@@ -249,6 +358,102 @@ class TestLazyMapMethod(unittest.TestCase):
             self.assertEqual(expected, r)
             self.assertEqual(3, pool.count_workers())
 
+    def test_with_max_in_flight(self):
+        with ThreadPool(max_workers=4) as pool:
+            sleeps = (0.1, 0, 0, 0, 0, 0)
+            r = tuple(pool.map(funcs.square, range(6), sleeps,
+                               max_in_flight=2, buffer_size=4))
+            expected = tuple(map(funcs.square, range(6)))
+            self.assertEqual(expected, r)
+
+    def test_with_max_in_flight_and_chunk_size(self):
+        with ThreadPool(max_workers=4) as pool:
+            r = tuple(pool.map(funcs.square, range(10), chunk_size=3,
+                               max_in_flight=2))
+            expected = tuple(map(funcs.square, range(10)))
+            self.assertEqual(expected, r)
+
+    def test_with_invalid_max_in_flight(self):
+        with ThreadPool(max_workers=4) as pool:
+            for max_in_flight in (0, -1):
+                with self.assertRaises(ValueError):
+                    pool.map(funcs.square, range(10),
+                             max_in_flight=max_in_flight)
+                with self.assertRaises(ValueError):
+                    pool.starmap(funcs.add, ((1, 2), ),
+                                 max_in_flight=max_in_flight, feeder=True)
+
+    def test_with_feeder(self):
+        with ThreadPool(max_workers=4) as pool:
+            r = tuple(pool.map(funcs.square, range(10), chunk_size=3,
+                               buffer_size=2, feeder=True))
+            expected = tuple(map(funcs.square, range(10)))
+            self.assertEqual(expected, r)
+
+    def test_with_feeder_and_unordered_result(self):
+        with ThreadPool(max_workers=4) as pool:
+            r = tuple(pool.map(funcs.square, range(3),
+                               (0.1, 0.06, 0.02),
+                               keep_order=False, buffer_size=3, feeder=True))
+            expected = tuple(map(funcs.square, (2, 1, 0)))
+            self.assertEqual(expected, r)
+
+    def test_with_feeder_and_failing_input(self):
+        def get_input():
+            yield 1
+            raise ZeroDivisionError
+        with ThreadPool(max_workers=4) as pool:
+            with self.assertRaises(ZeroDivisionError):
+                tuple(pool.map(funcs.square, get_input(), feeder=True))
+
+    def test_with_feeder_and_early_exit(self):
+        with ThreadPool(max_workers=4) as pool:
+            iterator = pool.map(funcs.square, itertools.count(), feeder=True)
+            self.assertEqual(0, next(iterator))
+            iterator.close()
+            time.sleep(0.1)
+            names = [thread.name for thread in threading.enumerate()]
+            self.assertFalse(any("FeederThread" in name for name in names))
+
+    def test_cancel_on_early_exit(self):
+        for feeder in (False, True):
+            with self.subTest(feeder=feeder):
+                started = list()
+                def target(x):
+                    started.append(x)
+                    time.sleep(0.01)
+                    return x
+                with ThreadPool(max_workers=2) as pool:
+                    iterator = pool.map(target, range(50), buffer_size=20,
+                                        feeder=feeder)
+                    self.assertEqual(0, next(iterator))
+                    iterator.close()
+                    pool.join()
+                self.assertLess(len(started), 20)
+
+    def test_cancel_on_remote_exception(self):
+        started = list()
+        def target(x):
+            started.append(x)
+            time.sleep(0.01)
+            return 1 / x
+        with ThreadPool(max_workers=2) as pool:
+            with self.assertRaises(ZeroDivisionError):
+                tuple(pool.map(target, range(50), buffer_size=20))
+            pool.join()
+        self.assertLess(len(started), 20)
+
+    def test_with_fail_fast(self):
+        for feeder in (False, True):
+            with self.subTest(feeder=feeder):
+                with ThreadPool(max_workers=4) as pool:
+                    t = time.monotonic()
+                    with self.assertRaises(ZeroDivisionError):
+                        tuple(pool.map(funcs.divide, (1, 1, 1), (1, 1, 0),
+                                       (0.5, 0.5, 0), buffer_size=3,
+                                       feeder=feeder, fail_fast=True))
+                    self.assertLess(time.monotonic() - t, 0.4)
+
     def test_with_unexpired_timeout(self):
         with ThreadPool(max_workers=4) as pool:
             r = tuple(pool.map(funcs.square, range(10), timeout=1))
@@ -263,6 +468,13 @@ class TestLazyMapMethod(unittest.TestCase):
                                [0.02 for _ in range(5)],  # sleep for 0.01 s
                                timeout=0.01))
 
+    def test_with_max_in_flight_and_expired_timeout(self):
+        with ThreadPool(max_workers=4) as pool:
+            with self.assertRaises(TimeoutError):
+                tuple(pool.map(funcs.square, range(5),
+                               [0.02 for _ in range(5)],
+                               max_in_flight=2, timeout=0.01))
+
 
 class TestEagerMapMethod(unittest.TestCase):
 
@@ -280,6 +492,19 @@ class TestEagerMapMethod(unittest.TestCase):
             self.assertEqual(expected, r)
             self.assertLessEqual(pool.count_workers(), 2)
 
+    def test_with_auto_chunk_size(self):
+        with ThreadPool(max_workers=4) as pool:
+            r = tuple(pool.map_all(funcs.square, range(100), chunk_size="auto"))
+            expected = tuple(map(funcs.square, range(100)))
+            self.assertEqual(expected, r)
+
+    def test_with_guided_chunk_size(self):
+        with ThreadPool(max_workers=4) as pool:
+            job = pool.map_all(funcs.square, range(100), chunk_size="guided")
+            expected = tuple(map(funcs.square, range(100)))
+            self.assertEqual(expected, tuple(job))
+            self.assertEqual(100, len(job))
+
     def test_with_unordered_result(self):
         with ThreadPool(max_workers=4) as pool:
             r = tuple(pool.map_all(funcs.square, range(3),
@@ -320,6 +545,13 @@ class TestLazyStarmapMethod(unittest.TestCase):
             self.assertEqual(expected, r)
             self.assertLessEqual(pool.count_workers(), 2)
 
+    def test_with_auto_chunk_size(self):
+        with ThreadPool(max_workers=4) as pool:
+            r = tuple(pool.starmap(funcs.add, zip(range(100), range(100)),
+                                   chunk_size="auto"))
+            expected = tuple(itertools.starmap(funcs.add, zip(range(100), range(100))))
+            self.assertEqual(expected, r)
+
     def test_with_buffer_size(self):
         with ThreadPool(max_workers=4) as pool:
             r = tuple(pool.starmap(funcs.add, zip(range(10), range(10)),
@@ -369,6 +601,19 @@ class TestEagerStarmapMethod(unittest.TestCase):
             self.assertEqual(expected, r)
             self.assertLessEqual(pool.count_workers(), 2)
 
+    def test_with_auto_chunk_size(self):
+        with ThreadPool(max_workers=4) as pool:
+            r = tuple(pool.starmap_all(funcs.add, zip(range(100), range(100)),
+                                       chunk_size="auto"))
+            expected = tuple(itertools.starmap(funcs.add, zip(range(100), range(100))))
+            self.assertEqual(expected, r)
+
+    def test_with_guided_chunk_size_and_unsized_iterable(self):
+        with ThreadPool(max_workers=4) as pool:
+            with self.assertRaises(ValueError):
+                pool.starmap_all(funcs.add, zip(range(10), range(10)),
+                                 chunk_size="guided")
+
     def test_with_unordered_result(self):
         with ThreadPool(max_workers=4) as pool:
             r = tuple(pool.starmap_all(funcs.add, zip(range(3), range(3),